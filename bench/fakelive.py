@@ -0,0 +1,723 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ------------------------------------------------------------------------------
+#
+#   Program         : fakelive.py
+#
+# ------------------------------------------------------------------------------
+#
+#   Description     : This program is a stand-in for the livestatus sockets of
+#                     many Check_MK sites and the webapi of multisite. It
+#                     serves synthetic hosts, services, groups and downtimes,
+#                     executes the downtime commands and counts the requests.
+#                     It is used by the benchmarks of downtime.py (run.py).
+#
+#   Author          : Marek Zavesicky
+#   Copyright (C)   : (2019) Marek Zavesicky
+#   License         : AGPL3
+#   URL             : https://github.com/iamcheko/check_mk_downtime
+#
+#   Change history  : See "git log"
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------
+#   External Modules
+# ------------------------------------------------------------------------------
+import os
+import re
+import sys
+import json
+import time
+import urlparse
+import argparse
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+
+# ------------------------------------------------------------------------------
+#   Part            : Class definition
+# ------------------------------------------------------------------------------
+class Filter(object):
+    """
+    The Filter class evaluates a single Filter header of a query. List columns
+    support the operator >= (contains) and = with an empty value (is empty).
+    """
+    _int_columns = ['id', 'start_time', 'end_time', 'duration', 'fixed']
+    _operators = {
+        '=': lambda value, ref: value == ref,
+        '<': lambda value, ref: value < ref,
+        '>': lambda value, ref: value > ref,
+        '<=': lambda value, ref: value <= ref,
+        '>=': lambda value, ref: value >= ref,
+        '=~': lambda value, ref: value.lower() == ref.lower(),
+    }
+
+    def __init__(self, spec):
+        """
+        The constructor method for class Filter.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            spec            the value of the header, e.g. 'name = host01'
+        """
+        parts = spec.split(None, 2)
+        if len(parts) < 2:
+            raise ValueError('Invalid filter: {0}'.format(spec))
+        self.column = parts[0]
+        self.operator = parts[1]
+        self.value = parts[2] if len(parts) > 2 else ''
+        self.negate = self.operator.startswith('!')
+        operator = self.operator[1:] if self.negate else self.operator
+        if operator in ('~', '~~'):
+            regex = re.compile(self.value, re.I if operator == '~~' else 0)
+            self.compare = lambda value, ref: regex.search(value or '') is not None
+        elif operator in self._operators:
+            self.compare = self._operators[operator]
+        else:
+            raise ValueError('Invalid operator: {0}'.format(self.operator))
+        self.ref = int(self.value) if self.column in self._int_columns else self.value
+        self.is_equal = self.operator == '='
+
+    def match(self, row):
+        """
+        Return:
+            boolean         True if the row matches the filter
+        """
+        value = row.get(self.column)
+        if isinstance(value, list):
+            if self.operator in ('>=', '!>='):
+                result = self.ref in value
+            else:
+                result = self.ref == '' and not value
+        else:
+            result = self.compare(value, self.ref)
+        return not result if self.negate else result
+
+
+class Member(object):
+    """
+    The Member class replaces an Or of equality filters, or of And combined
+    equality filters, on the same columns. The row matches if its values are
+    one of the value tuples of the filters.
+    """
+
+    def __init__(self, columns, values):
+        """
+        The constructor method for class Member.
+
+        Attributes:
+            columns         a tuple of column names
+            values          a set of value tuples
+        """
+        self.columns = columns
+        self.values = values
+
+    def match(self, row):
+        """
+        Return:
+            boolean         True if the values of the columns are in the set
+        """
+        return tuple(row.get(column) for column in self.columns) in self.values
+
+    @staticmethod
+    def get_key(item):
+        """
+        This method returns the columns and values of an equality filter or of
+        an And of equality filters.
+
+        Attributes:
+            item            a filter object
+
+        Return:
+            tuple           the tuple of columns and the tuple of values or
+                            None if the filter is something else
+        """
+        if isinstance(item, Filter) and item.is_equal:
+            return (item.column,), (item.ref,)
+        if isinstance(item, Combined) and not item.any_of and not item.negate and \
+                all(isinstance(sub, Filter) and sub.is_equal for sub in item.items):
+            pairs = sorted((sub.column, sub.ref) for sub in item.items)
+            return tuple(pair[0] for pair in pairs), tuple(pair[1] for pair in pairs)
+        return None
+
+
+class Combined(object):
+    """
+    The Combined class combines filters with And or Or, or negates a filter.
+    """
+
+    def __init__(self, items, any_of, negate=False):
+        """
+        The constructor method for class Combined.
+
+        Attributes:
+            items           a list of filters
+            any_of          True for Or, False for And
+            negate          True to negate the result
+        """
+        self.items = items
+        self.any_of = any_of
+        self.negate = negate
+
+    def match(self, row):
+        """
+        Return:
+            boolean         True if the row matches one (Or) or all (And) filters
+        """
+        if self.any_of:
+            result = any(item.match(row) for item in self.items)
+        else:
+            result = all(item.match(row) for item in self.items)
+        return not result if self.negate else result
+
+    @staticmethod
+    def create(items, any_of):
+        """
+        This method combines the filters, an Or of equality filters of the
+        same columns becomes a Member object.
+
+        Attributes:
+            items           a list of filters
+            any_of          True for Or, False for And
+
+        Return:
+            obj             a filter object
+        """
+        if any_of and items:
+            keys = [Member.get_key(item) for item in items]
+            if None not in keys and len(set(columns for columns, values in keys)) == 1:
+                return Member(keys[0][0], set(values for columns, values in keys))
+        return Combined(items, any_of)
+
+
+class Site(object):
+    """
+    The Site class holds the synthetic objects and the downtimes of a site and
+    answers the queries and commands of its livestatus socket.
+    """
+    _indexes = {'hosts': 'name', 'services': 'host_name', 'hostgroups': 'name', 'servicegroups': 'name'}
+
+    def __init__(self, name, hosts=100, services=10, group_size=100, downtimes=0, latency=0.0, record=None):
+        """
+        The constructor method for class Site.
+
+        Attributes:
+            name            the site name
+            hosts           the number of hosts
+            services        the number of services per host
+            group_size      the number of hosts of the hostgroup bench-hg and
+                            of services of the servicegroup bench-sg
+            downtimes       the number of existing downtimes of other users
+            latency         the delay of each answer in seconds
+            record          the file name to record the received commands or
+                            None
+        """
+        self.name = name
+        self.latency = latency
+        self.record = open(record, 'a') if record else None
+        self.lock = threading.Lock()
+        self.active = 0
+        self.tables = collections.defaultdict(list)
+        self.index = collections.defaultdict(dict)
+        for number in range(hosts):
+            host_name = '{0}-host{1:05d}'.format(name, number)
+            names = ['service{0:03d}'.format(service) for service in range(services)]
+            self.add_row('hosts', {'name': host_name, 'services': names})
+            for service in names:
+                self.add_row('services', {'host_name': host_name, 'description': service})
+        members = [row['name'] for row in self.tables['hosts'][:group_size]]
+        self.add_row('hostgroups', {'name': 'bench-hg', 'members': members})
+        self.add_row('hostgroups', {'name': 'bench-all', 'members': [row['name'] for row in self.tables['hosts']]})
+        self.add_row('servicegroups', {'name': 'bench-sg', 'members': [
+            [row['host_name'], row['description']] for row in self.tables['services'][:group_size]]})
+        self.downtimes = collections.OrderedDict()
+        self.next_id = 1
+        now = int(time.time())
+        for number in range(downtimes):
+            host_name = self.tables['hosts'][number % hosts]['name'] if hosts else 'none'
+            self.schedule(now, host_name, '', now, now + 7200, 'bench', 'Existing ID:000000000999')
+        self.counters = self.get_counters()
+
+    @staticmethod
+    def get_counters():
+        """
+        Return:
+            dictionary      a new set of counters
+        """
+        return {'connections': 0, 'queries': 0, 'commands': 0, 'rows': 0, 'bytes_received': 0, 'bytes_sent': 0}
+
+    def add_row(self, table, row):
+        """
+        This method adds a row to a table and its index.
+
+        Attributes:
+            table           the table name
+            row             a dictionary with the columns
+        """
+        self.tables[table].append(row)
+        if table in self._indexes:
+            self.index[table].setdefault(row[self._indexes[table]], []).append(row)
+
+    def count(self, counter, value=1):
+        """
+        This method increases a counter.
+
+        Attributes:
+            counter         the counter name
+            value           the increment
+        """
+        with self.lock:
+            self.counters[counter] += value
+
+    def reset(self, timeout=30):
+        """
+        This method resets the counters and returns the previous values. It
+        waits until the open connections have been handled, so the commands
+        a client sent before it exited are counted.
+
+        Attributes:
+            timeout         the maximum time to wait in seconds
+
+        Return:
+            dictionary      the counters
+        """
+        deadline = time.time() + timeout
+        while self.active and time.time() < deadline:
+            time.sleep(0.01)
+        with self.lock:
+            counters, self.counters = self.counters, self.get_counters()
+            counters['downtimes'] = len(self.downtimes)
+        return counters
+
+    def get_rows(self, table, filters):
+        """
+        This method returns the rows of a table which match all filters. An
+        equality filter on the indexed column of the table selects the rows
+        by the index.
+
+        Attributes:
+            table           the table name
+            filters         a list of filter objects
+
+        Return:
+            list            a list of dictionaries
+        """
+        if table == 'downtimes':
+            with self.lock:
+                rows = self.downtimes.values()
+        elif table == 'status':
+            rows = [{'program_start': 0}]
+        else:
+            rows = self.tables.get(table, [])
+            column = self._indexes.get(table)
+            for a_filter in filters:
+                if isinstance(a_filter, Member) and a_filter.columns == (column,):
+                    keys = [values[0] for values in a_filter.values]
+                elif isinstance(a_filter, Filter) and a_filter.is_equal and a_filter.column == column:
+                    keys = [a_filter.ref]
+                else:
+                    continue
+                rows = [row for key in keys for row in self.index[table].get(key, [])]
+                break
+        return [row for row in rows if all(a_filter.match(row) for a_filter in filters)]
+
+    def query(self, request):
+        """
+        This method answers a query.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            request         a list of the lines of the query
+
+        Return:
+            string          the answer as JSON
+            boolean         True if the answer needs the fixed16 header
+            boolean         True if the connection stays open
+        """
+        table = request[0].split()[1]
+        columns = None
+        filters = []
+        stats = []
+        limit = None
+        fixed16 = keepalive = False
+        for line in request[1:]:
+            header, _, value = line.partition(':')
+            value = value.strip()
+            if header == 'Columns':
+                columns = value.split()
+            elif header == 'Filter':
+                filters.append(Filter(value))
+            elif header in ('And', 'Or'):
+                number = int(value)
+                items = filters[len(filters) - number:] if number else []
+                del filters[len(filters) - number:]
+                filters.append(Combined.create(items, header == 'Or'))
+            elif header == 'Negate':
+                filters.append(Combined([filters.pop()], False, True))
+            elif header == 'Stats':
+                parts = value.split()
+                if parts[0] in ('min', 'max', 'sum', 'avg'):
+                    stats.append((parts[0], parts[1]))
+                else:
+                    stats.append(('count', Filter(value)))
+            elif header == 'Limit':
+                limit = int(value)
+            elif header == 'ResponseHeader':
+                fixed16 = value == 'fixed16'
+            elif header == 'KeepAlive':
+                keepalive = value == 'on'
+        rows = self.get_rows(table, filters)
+        if columns is None:
+            columns = sorted(rows[0].keys()) if rows else []
+        if stats:
+            lines = self.get_stats(rows, columns, stats)
+        else:
+            lines = [[row.get(column) for column in columns] for row in rows]
+        if limit is not None:
+            lines = lines[:limit]
+        self.count('rows', len(lines))
+        # like livestatus, each row on its own line
+        return "[" + ",\n".join(json.dumps(line) for line in lines) + "]\n", fixed16, keepalive
+
+    @staticmethod
+    def get_stats(rows, columns, stats):
+        """
+        This method groups the rows by the columns and calculates the stats of
+        each group.
+
+        Attributes:
+            rows            a list of dictionaries
+            columns         the columns to group by
+            stats           a list of tuples (function, column or filter)
+
+        Return:
+            list            a list of lists with the columns and the stats
+        """
+        groups = collections.OrderedDict()
+        if not columns:
+            groups[()] = []
+        for row in rows:
+            groups.setdefault(tuple(row.get(column) for column in columns), []).append(row)
+        lines = []
+        for key, group in groups.items():
+            values = []
+            for function, argument in stats:
+                if function == 'count':
+                    values.append(sum(1 for row in group if argument.match(row)))
+                    continue
+                numbers = [row.get(argument) or 0 for row in group]
+                if not numbers:
+                    values.append(0)
+                elif function == 'min':
+                    values.append(min(numbers))
+                elif function == 'max':
+                    values.append(max(numbers))
+                elif function == 'sum':
+                    values.append(sum(numbers))
+                else:
+                    values.append(float(sum(numbers)) / len(numbers))
+            lines.append(list(key) + values)
+        return lines
+
+    def command(self, line):
+        """
+        This method executes a downtime command.
+
+        Attributes:
+            line            the command without the COMMAND keyword
+        """
+        self.count('commands')
+        if self.record is not None:
+            with self.lock:
+                self.record.write(line + "\n")
+        match = re.match(r'\[(\d+)\] (\w+);(.*)', line)
+        if not match:
+            return
+        operation, args = match.group(2), match.group(3).split(';')
+        if operation == 'SCHEDULE_HOST_DOWNTIME':
+            self.schedule(int(match.group(1)), args[0], '', int(args[1]), int(args[2]), args[6], ';'.join(args[7:]))
+        elif operation == 'SCHEDULE_SVC_DOWNTIME':
+            self.schedule(int(match.group(1)), args[0], args[1], int(args[2]), int(args[3]), args[7],
+                          ';'.join(args[8:]))
+        elif operation in ('DEL_HOST_DOWNTIME', 'DEL_SVC_DOWNTIME'):
+            with self.lock:
+                self.downtimes.pop(int(args[0]), None)
+
+    def schedule(self, now, host_name, service, start_time, end_time, author, comment):
+        """
+        This method adds a fixed downtime.
+
+        Attributes:
+            now             the time of the command
+            host_name       the host name
+            service         the service description or an empty string
+            start_time      the start time as Unix epoch time
+            end_time        the end time as Unix epoch time
+            author          the author
+            comment         the comment
+        """
+        with self.lock:
+            self.downtimes[self.next_id] = {
+                'id': self.next_id, 'author': author, 'host_name': host_name, 'service_description': service,
+                'start_time': start_time, 'end_time': end_time, 'duration': end_time - start_time, 'fixed': 1,
+                'comment': comment, 'entry_time': now,
+            }
+            self.next_id += 1
+
+
+class LivestatusHandler(SocketServer.StreamRequestHandler):
+    """
+    The LivestatusHandler class reads the requests of a connection, each ends
+    with an empty line, and answers the queries.
+    """
+
+    def handle(self):
+        """
+        This method handles the requests until the client closes the connection
+        or a query without KeepAlive has been answered.
+        """
+        site = self.server.site
+        site.count('connections')
+        with site.lock:
+            site.active += 1
+        try:
+            self.handle_requests(site)
+        finally:
+            with site.lock:
+                site.active -= 1
+
+    def handle_requests(self, site):
+        """
+        This method reads and answers the requests of the connection.
+
+        Attributes:
+            site            the Site object of the server
+        """
+        while True:
+            lines = []
+            for line in iter(self.rfile.readline, ''):
+                site.count('bytes_received', len(line))
+                if line == "\n":
+                    if lines:
+                        break
+                    continue
+                lines.append(line.rstrip("\n"))
+            if not lines:
+                return
+            if lines[0].startswith('COMMAND '):
+                site.command(lines[0][8:])
+                continue
+            site.count('queries')
+            if site.latency:
+                time.sleep(site.latency)
+            try:
+                answer, fixed16, keepalive = site.query(lines)
+                code = 200
+            except (ValueError, IndexError), e:
+                answer, fixed16, keepalive = str(e) + "\n", True, False
+                code = 400
+            if fixed16:
+                answer = '{0} {1:11d}\n'.format(code, len(answer)) + answer
+            site.count('bytes_sent', len(answer))
+            self.wfile.write(answer)
+            self.wfile.flush()
+            if not keepalive:
+                return
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    The UnixServer class serves the livestatus socket of a local site.
+    """
+    daemon_threads = True
+
+
+class TcpServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    The TcpServer class serves the livestatus socket of a remote site.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class WebapiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    The WebapiHandler class answers the get_site action of the webapi like
+    multisite. The path /bench/stats returns the counters of all sites as
+    JSON and resets them.
+    """
+
+    def do_GET(self):
+        """
+        This method answers a GET request.
+        """
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        if url.path.endswith('/bench/stats'):
+            body = json.dumps(dict((name, site.reset()) for name, site in self.server.sites.items()))
+        elif url.path.endswith('webapi.py') and params.get('action') == 'get_site':
+            address = self.server.addresses.get(params.get('site_id'), False)
+            if address is False:
+                result = {'result_code': 1, 'result': 'Site not found'}
+            else:
+                config = {'alias': params['site_id'], 'disabled': False}
+                if address is not None:
+                    config['socket'] = ('proxy', {'socket': address})
+                result = {'result_code': 0, 'result': {'site_config': config}}
+            body = repr(result)
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        The requests are not logged.
+        """
+        pass
+
+
+class WebapiServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The WebapiServer class serves the webapi stub.
+    """
+    daemon_threads = True
+
+
+# ------------------------------------------------------------------------------
+#   Part            : Main Body
+# ------------------------------------------------------------------------------
+def start(args):
+    """
+    This function creates the sites and starts their servers and the webapi
+    stub in background threads.
+
+    Attributes:
+        args        all passed command line arguments
+
+    Return:
+        string      the url of the webapi stub
+    """
+    sites = {}
+    addresses = {}
+    for number in range(args.sites):
+        name = 'site{0:03d}'.format(number)
+        record = os.path.join(args.record, name + '.commands') if args.record else None
+        sites[name] = Site(name, args.hosts, args.services, args.group_size, args.downtimes, args.latency, record)
+        # the site directory is needed for the discovery of a tcp site too
+        path = os.path.join(args.root, name, 'tmp', 'run')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if number < args.tcp_sites:
+            server = TcpServer(('127.0.0.1', 0), LivestatusHandler)
+            addresses[name] = server.server_address
+        else:
+            if os.path.exists(os.path.join(path, 'live')):
+                os.unlink(os.path.join(path, 'live'))
+            server = UnixServer(os.path.join(path, 'live'), LivestatusHandler)
+            addresses[name] = None
+        server.site = sites[name]
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    webapi = WebapiServer(('127.0.0.1', args.port), WebapiHandler)
+    webapi.sites = sites
+    webapi.addresses = addresses
+    thread = threading.Thread(target=webapi.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:{0}/'.format(webapi.server_address[1])
+
+
+def main(argv):
+    """
+    Parse the given command line arguments, start the servers and wait until
+    the program gets terminated.
+
+    Attributes:
+        argv        the argument list passed on the command line
+    Return:
+        int         0 if everything went fine else 1
+    """
+    parser = argparse.ArgumentParser(description='Stand-in livestatus sites and webapi for benchmarks')
+    parser.add_argument('root',
+                        help='The OMD base path, a directory per site gets created'
+                        )
+    parser.add_argument('--sites', type=int, default=2,
+                        help='The number of sites (default: 2)'
+                        )
+    parser.add_argument('--hosts', type=int, default=100,
+                        help='The number of hosts per site (default: 100)'
+                        )
+    parser.add_argument('--services', type=int, default=10,
+                        help='The number of services per host (default: 10)'
+                        )
+    parser.add_argument('--group-size', type=int, default=100,
+                        help='The members of the hostgroup bench-hg and the servicegroup bench-sg per site '
+                             '(default: 100)'
+                        )
+    parser.add_argument('--downtimes', type=int, default=0,
+                        help='The number of existing downtimes per site (default: 0)'
+                        )
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='The delay of each answer in seconds (default: 0)'
+                        )
+    parser.add_argument('--tcp-sites', type=int, default=0,
+                        help='The number of sites served on TCP instead of Unix sockets (default: 0)'
+                        )
+    parser.add_argument('--port', type=int, default=0,
+                        help='The port of the webapi stub (default: any free port)'
+                        )
+    parser.add_argument('--record', default=None,
+                        help='Record the received commands of each site in the given directory'
+                        )
+    parser.add_argument('--ready', default=None,
+                        help='Write the url of the webapi stub to the given file when the servers are ready'
+                        )
+    args = parser.parse_args(argv)
+
+    url = start(args)
+    if args.ready:
+        with open(args.ready + '.tmp', 'w') as stream:
+            stream.write(url)
+        os.rename(args.ready + '.tmp', args.ready)
+    else:
+        print url
+        sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+# ------------------------------------------------------------------------------
+#   Main
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
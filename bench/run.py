@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ------------------------------------------------------------------------------
+#
+#   Program         : run.py
+#
+# ------------------------------------------------------------------------------
+#
+#   Description     : This program benchmarks downtime.py against synthetic
+#                     sites served by fakelive.py. It runs list, add and
+#                     remove scenarios and reports the wall time, the phases,
+#                     the queries and commands received by the sites and the
+#                     peak RSS of each run.
+#
+#   Author          : Marek Zavesicky
+#   Copyright (C)   : (2019) Marek Zavesicky
+#   License         : AGPL3
+#   URL             : https://github.com/iamcheko/check_mk_downtime
+#
+#   Change history  : See "git log"
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------
+#   External Modules
+# ------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import urllib2
+import argparse
+import tempfile
+import subprocess
+
+
+# ------------------------------------------------------------------------------
+#   Global Variables
+# ------------------------------------------------------------------------------
+path_bench = os.path.dirname(os.path.realpath(__file__))
+path_script = os.path.join(os.path.dirname(path_bench), 'bin', 'downtime.py')
+
+# the scenarios in the order they get executed, each is a list of arguments of
+# downtime.py, the plan file gets created by write_plan
+scenarios = [
+    ('list_all', ['-i', '-o', 'list', '-f', 'jsonl']),
+    ('summary_all', ['-i', '-o', 'list', '--summary']),
+    ('add_hostgroup', ['-g', '101', '-N', 'bench-hg', '-o', 'add', '-q']),
+    ('list_hostgroup', ['-g', '101', '-N', 'bench-hg', '-o', 'list', '-f', 'jsonl']),
+    ('remove_hostgroup', ['-g', '101', '-N', 'bench-hg', '-o', 'remove', '-q']),
+    ('add_servicegroup', ['-g', '102', '-S', 'bench-sg', '-o', 'add', '-q']),
+    ('remove_servicegroup', ['-g', '102', '-S', 'bench-sg', '-o', 'remove', '-q']),
+    ('add_host', ['-g', '103', '-n', 'site000-host00000,site001-host00001', '-o', 'add', '-q']),
+    ('remove_host', ['-g', '103', '-n', 'site000-host00000,site001-host00001', '-o', 'remove', '-q']),
+    ('add_plan', ['-g', '104', '--plan', '{plan}', '-o', 'add', '-q']),
+    ('remove_plan', ['-g', '104', '--plan', '{plan}', '-o', 'remove', '-q']),
+]
+
+
+# ------------------------------------------------------------------------------
+#   Part            : Main Body
+# ------------------------------------------------------------------------------
+def start_sites(args, root):
+    """
+    This function starts fakelive.py and waits until its servers are ready.
+
+    Raises:
+        RuntimeError
+
+    Attributes:
+        args        all passed command line arguments
+        root        the working directory, the sites are created in sites
+
+    Return:
+        obj         the Popen object of the server
+        string      the url of the webapi stub
+    """
+    ready = os.path.join(root, '.ready')
+    command = [args.python, os.path.join(path_bench, 'fakelive.py'), os.path.join(root, 'sites'),
+               '--sites', str(args.sites), '--hosts', str(args.hosts), '--services', str(args.services),
+               '--group-size', str(args.group_size), '--downtimes', str(args.downtimes),
+               '--latency', str(args.latency), '--tcp-sites', str(args.tcp_sites), '--ready', ready]
+    if args.record:
+        command += ['--record', args.record]
+    server = subprocess.Popen(command)
+    while not os.path.exists(ready):
+        if server.poll() is not None:
+            raise RuntimeError('fakelive.py exited with {0}'.format(server.returncode))
+        time.sleep(0.1)
+    with open(ready) as stream:
+        return server, stream.read()
+
+
+def start_worker(args, root):
+    """
+    This function starts downtime.py as stand-in worker of the sites with a
+    Unix socket on localhost and writes the key and the workers file of the
+    coordinator.
+
+    Raises:
+        RuntimeError
+
+    Attributes:
+        args        all passed command line arguments
+        root        the working directory, it is also the home directory
+
+    Return:
+        obj         the Popen object of the worker
+        string      the file name of the workers
+    """
+    sites = os.path.join(root, 'sites')
+    if not os.path.exists(os.path.join(root, 'etc')):
+        os.makedirs(os.path.join(root, 'etc'))
+    with open(os.path.join(root, 'etc', 'downtime.key'), 'w') as stream:
+        stream.write(os.urandom(16).encode('hex') + "\n")
+    os.chmod(os.path.join(root, 'etc', 'downtime.key'), 0600)
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    address = '127.0.0.1:{0}'.format(probe.getsockname()[1])
+    probe.close()
+    workers = os.path.join(root, 'workers.json')
+    with open(workers, 'w') as stream:
+        json.dump(dict((site, address) for site in os.listdir(sites)
+                       if os.path.exists(os.path.join(sites, site, 'tmp', 'run', 'live'))), stream)
+
+    worker = subprocess.Popen([args.python, path_script, '-P', sites, '--worker', address],
+                              env=dict(os.environ, HOME=root))
+    while True:
+        if worker.poll() is not None:
+            raise RuntimeError('The worker exited with {0}'.format(worker.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', int(address.split(':')[1])), 1).close()
+            return worker, workers
+        except socket.error:
+            time.sleep(0.1)
+
+
+def get_counters(url):
+    """
+    This function returns the counters of the sites since the last call.
+
+    Attributes:
+        url         the url of the webapi stub
+
+    Return:
+        dictionary  the totals of all sites
+    """
+    totals = {}
+    for counters in json.load(urllib2.urlopen(url + 'bench/stats')).values():
+        for key, value in counters.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def write_plan(args, path):
+    """
+    This function writes a plan, which takes the hosts of the hostgroup
+    bench-hg of all sites down in waves.
+
+    Attributes:
+        args        all passed command line arguments
+        path        the file name of the plan
+    """
+    start = int(time.time()) + 3600
+    members = min(args.group_size, args.hosts)
+    with open(path, 'w') as stream:
+        stream.write("host,start,duration,comment\n")
+        for number in range(args.sites * members):
+            wave = number % args.waves
+            stream.write('site{0:03d}-host{1:05d},{2},1800,Wave {3}\n'.format(
+                number // members, number % members, start + wave * 1800, wave))
+
+
+def run_scenario(args, root, url, name, arguments):
+    """
+    This function runs downtime.py once and measures it.
+
+    Attributes:
+        args        all passed command line arguments
+        root        the working directory, it is also the home directory
+        url         the url of the webapi stub
+        name        the name of the scenario
+        arguments   the arguments of the scenario
+
+    Return:
+        dictionary  the measured values
+    """
+    stats = os.path.join(root, '.stats')
+    command = [args.python, path_script, '-P', os.path.join(root, 'sites'), '-U', url, '-u', 'bench', '-p', 'bench',
+               '--stats', stats] + arguments
+    environment = dict(os.environ, HOME=root)
+    get_counters(url)
+    with open(os.devnull, 'w') as devnull:
+        started = time.time()
+        process = subprocess.Popen(command, stdout=devnull, env=environment)
+        pid, status, usage = os.wait4(process.pid, 0)
+        wall = time.time() - started
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    result = {
+        'scenario': name,
+        'rc': process.returncode,
+        'wall': wall,
+        'cpu': usage.ru_utime + usage.ru_stime,
+        'peak_rss_kb': usage.ru_maxrss,
+    }
+    counters = get_counters(url)
+    result.update(dict((key, counters.get(key, 0)) for key in ('connections', 'queries', 'commands', 'rows',
+                                                                'downtimes')))
+    if os.path.exists(stats):
+        with open(stats) as stream:
+            phases = json.load(stream)['phases']
+        os.unlink(stats)
+        result.update(dict((phase + '_time', phases[phase]['time']) for phase in phases))
+    return result
+
+
+def print_results(results):
+    """
+    This function prints the results as table.
+
+    Attributes:
+        results     a list of dictionaries with the measured values
+    """
+    columns = [('scenario', 'scenario', '{0:<20}'), ('rc', 'rc', '{0:>3}'), ('wall', 'wall', '{0:>8.3f}'),
+               ('cpu', 'cpu', '{0:>7.3f}'), ('discovery_time', 'discovery', '{0:>9.3f}'),
+               ('resolution_time', 'resolution', '{0:>10.3f}'), ('queries_time', 'queries', '{0:>8.3f}'),
+               ('commands_time', 'commands', '{0:>8.3f}'), ('queries', 'queries', '{0:>8}'),
+               ('commands', 'commands', '{0:>8}'), ('rows', 'rows', '{0:>8}'),
+               ('downtimes', 'downtimes', '{0:>9}'), ('peak_rss_kb', 'peak_rss_kb', '{0:>11}')]
+    print " ".join(fmt.replace('.3f', '').format(header) for key, header, fmt in columns)
+    for result in results:
+        print " ".join(fmt.format(result.get(key, 0)) for key, header, fmt in columns)
+
+
+def main(argv):
+    """
+    Parse the given command line arguments, start the synthetic sites and run
+    the scenarios.
+
+    Attributes:
+        argv        the argument list passed on the command line
+    Return:
+        int         0 if all scenarios succeeded else 1
+    """
+    parser = argparse.ArgumentParser(description='Benchmark downtime.py against synthetic sites')
+    parser.add_argument('--sites', type=int, default=50,
+                        help='The number of sites (default: 50)'
+                        )
+    parser.add_argument('--hosts', type=int, default=200,
+                        help='The number of hosts per site (default: 200)'
+                        )
+    parser.add_argument('--services', type=int, default=10,
+                        help='The number of services per host (default: 10)'
+                        )
+    parser.add_argument('--group-size', type=int, default=200,
+                        help='The members of the hostgroup bench-hg and the servicegroup bench-sg per site '
+                             '(default: 200)'
+                        )
+    parser.add_argument('--downtimes', type=int, default=100,
+                        help='The number of existing downtimes per site (default: 100)'
+                        )
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='The delay of each livestatus answer in seconds (default: 0)'
+                        )
+    parser.add_argument('--tcp-sites', type=int, default=0,
+                        help='The number of sites served on TCP instead of Unix sockets (default: 0)'
+                        )
+    parser.add_argument('--waves', type=int, default=50,
+                        help='The number of waves of the plan scenarios (default: 50)'
+                        )
+    parser.add_argument('--scenario', action='append', default=None,
+                        choices=[name for name, arguments in scenarios],
+                        help='Run only the given scenario, can be repeated (default: all)'
+                        )
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Run each scenario the given number of times (default: 1)'
+                        )
+    parser.add_argument('--workers', action='store_true', default=False,
+                        help='Run the add and remove scenarios with --coordinate through a stand-in worker of '
+                             'the sites on localhost'
+                        )
+    parser.add_argument('--record', default=None,
+                        help='Record the received commands of each site in the given directory'
+                        )
+    parser.add_argument('--json', default=None,
+                        help='Write the results as JSON Lines to the given file'
+                        )
+    parser.add_argument('--python', default=sys.executable,
+                        help='The interpreter of downtime.py and fakelive.py (default: this one)'
+                        )
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='downtime-bench-')
+    server = worker = None
+    results = []
+    try:
+        sys.stderr.write('Starting {0} sites with {1} services...\n'.format(
+            args.sites, args.sites * args.hosts * args.services))
+        server, url = start_sites(args, root)
+        coordinate = []
+        if args.workers:
+            worker, workers = start_worker(args, root)
+            coordinate = ['--coordinate', workers]
+        plan = os.path.join(root, 'plan.csv')
+        write_plan(args, plan)
+        for name, arguments in scenarios:
+            if args.scenario is not None and name not in args.scenario:
+                continue
+            arguments = [argument.format(plan=plan) for argument in arguments]
+            if 'add' in arguments or 'remove' in arguments:
+                arguments += coordinate
+            for repeat in range(args.repeat):
+                results.append(run_scenario(args, root, url, name, arguments))
+    finally:
+        for process in (worker, server):
+            if process is not None:
+                process.send_signal(signal.SIGTERM)
+                process.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as stream:
+            for result in results:
+                stream.write(json.dumps(result, sort_keys=True) + "\n")
+    return 0 if all(result['rc'] == 0 for result in results) else 1
+
+
+# ------------------------------------------------------------------------------
+#   Main
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# ------------------------------------------------------------------------------
+#
+#   Program         : startup.py
+#
+# ------------------------------------------------------------------------------
+#
+#   Description     : This program measures the start time of downtime.py,
+#                     from the help and a failed validation, which need no
+#                     request, to a listing with and without the site cache.
+#                     Each case is started repeatedly as new process and the
+#                     minimum, median and maximum wall time is reported.
+#
+#   Author          : Marek Zavesicky
+#   Copyright (C)   : (2019) Marek Zavesicky
+#   License         : AGPL3
+#   URL             : https://github.com/iamcheko/check_mk_downtime
+#
+#   Change history  : See "git log"
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as
+#   published by the Free Software Foundation, either version 3 of the
+#   License, or (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------
+#   External Modules
+# ------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import subprocess
+import run
+
+
+# ------------------------------------------------------------------------------
+#   Global Variables
+# ------------------------------------------------------------------------------
+
+# the cases in the order they get measured, each is a list of arguments of
+# downtime.py, {credentials} gets replaced by the arguments of the sites
+cases = [
+    ('help', ['-h']),
+    ('invalid_selection', ['-u', 'bench', '-p', 'bench', '-g', '1', '-s', 'none', '-o', 'add']),
+    ('invalid_dates', ['-u', 'bench', '-p', 'bench', '-g', '1', '-N', 'bench-hg', '-o', 'add', '-b', '12:00',
+                       '-e', '11:00', '-E', '01-01-2000']),
+    ('list_discovery', ['{credentials}', '-i', '-o', 'list', '--site-cache', '0']),
+    ('list_cached', ['{credentials}', '-i', '-o', 'list']),
+]
+
+
+# ------------------------------------------------------------------------------
+#   Part            : Main Body
+# ------------------------------------------------------------------------------
+def measure(args, root, arguments):
+    """
+    This function starts downtime.py repeatedly and measures the wall time.
+
+    Attributes:
+        args        all passed command line arguments
+        root        the working directory, it is also the home directory
+        arguments   the arguments of downtime.py
+
+    Return:
+        list        the sorted wall times in milliseconds
+    """
+    environment = dict(os.environ, HOME=root)
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for repeat in range(args.repeat):
+            started = time.time()
+            subprocess.call([args.python, run.path_script] + arguments, stdout=devnull, stderr=devnull,
+                            env=environment)
+            times.append((time.time() - started) * 1000)
+    return sorted(times)
+
+
+def main(argv):
+    """
+    Parse the given command line arguments, start the synthetic sites and
+    measure the cases.
+
+    Attributes:
+        argv        the argument list passed on the command line
+    Return:
+        int         always 0
+    """
+    parser = argparse.ArgumentParser(description='Measure the start time of downtime.py')
+    parser.add_argument('--sites', type=int, default=2,
+                        help='The number of sites (default: 2)'
+                        )
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Start each case the given number of times (default: 20)'
+                        )
+    parser.add_argument('--json', default=None,
+                        help='Write the results as JSON Lines to the given file'
+                        )
+    parser.add_argument('--python', default=sys.executable,
+                        help='The interpreter of downtime.py and fakelive.py (default: this one)'
+                        )
+    parser.set_defaults(hosts=10, services=5, group_size=10, downtimes=10, latency=0.0, tcp_sites=0, record=None)
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='downtime-startup-')
+    server = None
+    results = []
+    try:
+        server, url = run.start_sites(args, root)
+        credentials = ['-P', os.path.join(root, 'sites'), '-U', url, '-u', 'bench', '-p', 'bench']
+        for name, arguments in cases:
+            arguments = [value for argument in arguments
+                         for value in (credentials if argument == '{credentials}' else [argument])]
+            times = measure(args, root, arguments)
+            results.append({
+                'case': name,
+                'min_ms': times[0],
+                'median_ms': times[len(times) // 2],
+                'max_ms': times[-1],
+            })
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+    print "{0:<20} {1:>8} {2:>10} {3:>8}".format('case', 'min_ms', 'median_ms', 'max_ms')
+    for result in results:
+        print "{case:<20} {min_ms:>8.1f} {median_ms:>10.1f} {max_ms:>8.1f}".format(**result)
+    if args.json:
+        with open(args.json, 'w') as stream:
+            for result in results:
+                stream.write(json.dumps(result, sort_keys=True) + "\n")
+    return 0
+
+
+# ------------------------------------------------------------------------------
+#   Main
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -43,18 +43,73 @@
 # ------------------------------------------------------------------------------
 import os
 import sys
+import re
+import abc
+import stat
+import csv
+import json
+import Queue
+import hmac
+import heapq
+import hashlib
+import binascii
+import time
+import errno
+import select
+import signal
+import socket
+import tempfile
 import logging
 import argparse
-from datetime import datetime
-import livestatus
-import requests
+import contextlib
+import threading
+import collections
+import importlib
+import SocketServer
+from datetime import datetime, timedelta
+
+
+class LazyModule(object):
+    """
+    The LazyModule class imports a module on the first access of one of its
+    attributes. The modules below are only needed by some operations, so the
+    start of the program, e.g. for the help or a failed validation of the
+    arguments, does not wait for them.
+    """
+
+    def __init__(self, name):
+        """
+        The constructor method for class LazyModule.
+
+        Attributes:
+            name            the name of the module
+        """
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        """
+        This method imports the module if needed and returns its attribute.
+
+        Attributes:
+            attribute       the name of the attribute
+
+        Return:
+            obj             the attribute of the module
+        """
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+requests = LazyModule('requests')
+sqlite3 = LazyModule('sqlite3')
+cProfile = LazyModule('cProfile')
 
 
 # ------------------------------------------------------------------------------
 #   Global Variables
 # ------------------------------------------------------------------------------
-# make logging facility globally available
-global logger
 
 # build the working environment
 path_bin = os.path.dirname(os.path.realpath(__file__))
@@ -62,6 +117,21 @@ path_base = os.environ['HOME']
 path_var_log = os.path.join(path_base, 'var/log')
 if not os.path.exists(path_var_log):
     os.makedirs(path_var_log)
+path_site_cache = os.path.join(path_base, 'tmp', 'downtime.sites.json')
+path_runs = os.path.join(path_base, 'var', 'downtime', 'runs')
+path_worker_key = os.path.join(path_base, 'etc', 'downtime.key')
+
+# the arguments of an add or remove run, which are recorded in its checkpoint
+# and restored by --resume
+run_spec_args = ['operation', 'groupedid', 'host', 'service', 'hostgroup', 'servicegroup', 'exclusive', 'comment',
+                 'author', 'authorization', 'plan', 'chunk_size', 'path', 'url']
+
+# the handlers and the level shared by all loggers, see setup_logging, the
+# console handler is only used if the program runs as script, see main
+log_handlers = []
+log_level = logging.INFO
+log_console = False
+log_lock = threading.Lock()
 
 
 # ------------------------------------------------------------------------------
@@ -71,13 +141,50 @@ if not os.path.exists(path_var_log):
 # TODO: Add unit testing
 
 
+class MKLivestatusException(Exception):
+    """
+    The MKLivestatusException class is the base class of the errors of the
+    livestatus client, the names are the ones of the livestatus module of
+    Check_MK, which is not needed anymore.
+    """
+    pass
+
+
+class MKLivestatusSocketError(MKLivestatusException):
+    """
+    The MKLivestatusSocketError class is raised if a livestatus socket can't
+    be connected or the connection fails.
+    """
+    pass
+
+
+class MKLivestatusQueryError(MKLivestatusException):
+    """
+    The MKLivestatusQueryError class is raised if livestatus answers a query
+    with an error.
+    """
+
+    def __init__(self, code, message):
+        """
+        The constructor method for class MKLivestatusQueryError.
+
+        Attributes:
+            code            the status code of the answer
+            message         the error message of the answer
+        """
+        super(MKLivestatusQueryError, self).__init__('Livestatus error {0}: {1}'.format(code, message))
+        self.code = code
+
+
 class Sites(object):
     """
-    The Sites class stores all active check_mk sites in its object.
+    The Sites class stores all active check_mk sites in its object. The sites
+    are discovered with the webapi, the result can be cached in a file for
+    cache_ttl seconds.
     """
     logger = None
 
-    def __init__(self, auth, path, url):
+    def __init__(self, auth, path, url, persist=False, stats=None, discover=True, cache_ttl=0):
         """
         The constructor method for class Sites.
 
@@ -85,14 +192,27 @@ class Sites(object):
             auth        the user credentials
             path        the base path (OMD_ROOT)
             url         the url
+            persist     keep the livestatus connections of the loop open
+                        between requests
+            stats       a reference to a Stats object to record the phases,
+                        by default the object records in its own
+            discover    discover the sites now, otherwise discover has to be
+                        called before the first request
+            cache_ttl   use the cached sites if they are not older than the
+                        given seconds, 0 disables the cache
         """
         if Sites.logger is None:
             Sites.logger = setup_logging(self.__class__.__name__)
         self.auth = auth
         self.path = path
         self.url = url
+        self.persist = persist
+        self.cache_ttl = cache_ttl
+        self.stats = stats if stats is not None else Stats()
+        self.loop = LivestatusLoop(persist, stats=self.stats)
         self.sites = {}
         self.sites_with_data = []
+        self.selected = None
         self.itter_idx = 0
         self.payload = {
             "action": 'get_site',
@@ -104,31 +224,128 @@ class Sites(object):
 
         self.logger.debug('Constructor call passed arguments user: %s, path: %s, url: %s',
                           self.auth.get_user(), self.path, self.url)
-        for sitename in os.listdir(self.path):
-            self.payload["site_id"] = sitename
-            self.logger.debug('Collecting informations for site %s', sitename)
-            response = requests.get(self.url + "webapi.py", params=self.payload)
-            site_struct = eval(response.content)
-
-            # Make sure that the collected sites are available
-            if site_struct['result_code'] == 0 and site_struct['result']['site_config']['disabled'] is False:
-                self.logger.debug('Site %s is enabled', sitename)
+        if discover:
+            self.discover()
+
+    def discover(self):
+        """
+        This method discovers the active sites and their livestatus sockets
+        with the webapi or takes them from the cache.
+        """
+        with self.stats.measure('discovery'):
+            if self.load_cache():
+                return
+            for sitename in os.listdir(self.path):
+                self.payload["site_id"] = sitename
+                self.logger.debug('Collecting informations for site %s', sitename)
+                started = time.time()
+                response = requests.get(self.url + "webapi.py", params=self.payload)
+                self.stats.record_request(sitename, time.time() - started, received=len(response.content))
+                site_struct = eval(response.content)
+
+                # Make sure that the collected sites are available
+                if site_struct['result_code'] == 0 and site_struct['result']['site_config']['disabled'] is False:
+                    self.logger.debug('Site %s is enabled', sitename)
+                    socket_path = self.path + "/" + sitename + "/tmp/run/live"
+                    socket_host = socket_port = None
+                    if 'socket' in site_struct['result']['site_config'].keys():
+                        socket_host = site_struct['result']['site_config']['socket'][1]['socket'][0]
+                        socket_port = str(site_struct['result']['site_config']['socket'][1]['socket'][1])
+                    if socket_host and socket_port:
+                        self.logger.debug('Livestatus tcp socket found: %s:%s', socket_host, socket_port)
+                        self.sites[sitename] = Site(sitename, site_struct['result']['site_config']['alias'],
+                                                    "tcp:" + socket_host + ":" + socket_port)
+                    elif os.path.exists(socket_path):
+                        self.logger.debug('Livestatus socket found: %s', socket_path)
+                        self.sites[sitename] = Site(sitename, site_struct['result']['site_config']['alias'],
+                                                    "unix:" + socket_path)
+                    else:
+                        self.logger.error('Livestatus socket not found: %s', socket_path)
+                        self.stats.record_unreachable(sitename)
+                else:
+                    self.logger.debug('Site %s is disabled', sitename)
+            self.save_cache()
+
+    def discover_local(self):
+        """
+        This method takes every site below the base path which has a
+        livestatus Unix socket, without asking the webapi. It is used by a
+        worker, which runs next to the sites.
+        """
+        with self.stats.measure('discovery'):
+            for sitename in sorted(os.listdir(self.path)):
                 socket_path = self.path + "/" + sitename + "/tmp/run/live"
-                if 'socket' in site_struct['result']['site_config'].keys():
-                    socket_host = site_struct['result']['site_config']['socket'][1]['socket'][0]
-                    socket_port = str(site_struct['result']['site_config']['socket'][1]['socket'][1])
-                if socket_host and socket_port:
-                    self.logger.debug('Livestatus tcp socket found: %s:%s', socket_host, socket_port)
-                    self.sites[sitename] = Site(sitename, site_struct['result']['site_config']['alias'],
-                                                "tcp:" + socket_host + ":" + socket_port)
-                elif os.path.exists(socket_path):
+                if os.path.exists(socket_path):
                     self.logger.debug('Livestatus socket found: %s', socket_path)
-                    self.sites[sitename] = Site(sitename, site_struct['result']['site_config']['alias'],
-                                                "unix:" + socket_path)
-                else:
-                    self.logger.error('Livestatus socket not found: %s', socket_path)
-            else:
-                self.logger.debug('Site %s is disabled', sitename)
+                    self.sites[sitename] = Site(sitename, sitename, "unix:" + socket_path)
+
+    def get_cache_key(self):
+        """
+        Getter method, returns the key of the cached sites, the sites of
+        another base path or url are not used.
+
+        Return:
+            string      the base path and the url
+        """
+        return self.path + " " + self.url
+
+    def load_cache(self):
+        """
+        This method takes the sites from the cache file if it is not older
+        than cache_ttl seconds and was written for the same base path and url.
+        The cache is not used if the livestatus Unix socket of a cached site
+        has gone or the one of a cached unreachable site has appeared.
+
+        Return:
+            boolean     True if the sites have been taken from the cache
+        """
+        if not self.cache_ttl or not os.path.exists(path_site_cache):
+            return False
+        try:
+            with open(path_site_cache) as stream:
+                cache = json.load(stream)
+        except (IOError, ValueError), e:
+            self.logger.debug('Ignoring the site cache %s: %s', path_site_cache, e)
+            return False
+        if cache.get('key') != self.get_cache_key() or cache.get('time', 0) + self.cache_ttl < time.time():
+            return False
+        gone = [sitename for sitename, (alias, socketurl) in cache['sites'].items()
+                if socketurl.startswith('unix:') and not os.path.exists(socketurl[5:])]
+        appeared = [sitename for sitename in cache['unreachable']
+                    if os.path.exists(self.path + "/" + sitename + "/tmp/run/live")]
+        if gone or appeared:
+            self.logger.debug('Ignoring the site cache %s, the livestatus socket of %s has changed', path_site_cache,
+                              ", ".join(sorted(gone + appeared)))
+            return False
+        self.logger.debug('Using the sites cached at %s', datetime.fromtimestamp(cache['time']))
+        for sitename, (alias, socketurl) in cache['sites'].items():
+            self.sites[sitename] = Site(sitename, alias, socketurl)
+        for sitename in cache['unreachable']:
+            self.stats.record_unreachable(sitename)
+        return True
+
+    def save_cache(self):
+        """
+        This method writes the discovered sites to the cache file, the old
+        file gets replaced only if the new one has been written completely.
+        """
+        if not self.cache_ttl:
+            return
+        cache = {
+            'key': self.get_cache_key(),
+            'time': time.time(),
+            'sites': dict((sitename, (site.alias, site.socket)) for sitename, site in self.sites.items()),
+            'unreachable': sorted(self.stats.unreachable),
+        }
+        temporary = '{0}.{1}.tmp'.format(path_site_cache, os.getpid())
+        try:
+            if not os.path.exists(os.path.dirname(path_site_cache)):
+                os.makedirs(os.path.dirname(path_site_cache))
+            with open(temporary, 'w') as stream:
+                json.dump(cache, stream, sort_keys=True)
+            os.rename(temporary, path_site_cache)
+        except (IOError, OSError), e:
+            self.logger.warning('Cannot write the site cache %s: %s', path_site_cache, e)
 
     def __iter__(self):
         """
@@ -163,27 +380,150 @@ class Sites(object):
         Attributes:
             obj         a object of a class host or service
         """
-        for site in self.sites.keys():
-            self.sites[site].validate_data(obj)
+        self.append_objs_to_sites([obj])
+
+    def append_objs_to_sites(self, objs):
+        """
+        This method resolves a list of objects on all sites concurrently and
+        stores the found objects to the sites they are related to.
+
+        Attributes:
+            objs        a list of objects of a class with a resolve method
+        """
+        with self.stats.measure('resolution'):
+            self.run_tasks([(site, obj.resolve(self.sites[site].push)) for site in self.get_sites() for obj in objs])
         self.collect_sites_with_data()
 
+    def reset(self):
+        """
+        This method removes all monitoring objects of all sites and the
+        selection, so the object can be used for the next request without a
+        new discovery.
+        """
+        for site in self.sites.keys():
+            self.sites[site].reset()
+        self.sites_with_data = []
+        self.selected = None
+
+    def select(self, sites):
+        """
+        This method restricts the next request to the given sites.
+
+        Attributes:
+            sites       a list of site names
+        """
+        self.selected = [site for site in sites if site in self.sites]
+
     def collect_sites_with_data(self):
         """
         This method will find all sites that have valid data and stores the site
         name in a list.
         """
         for site in self.sites.keys():
-            if self.sites[site].has_data:
+            if self.sites[site].has_data() and site not in self.sites_with_data:
                 self.sites_with_data.append(site)
 
+    def run_tasks(self, tasks, failed=None):
+        """
+        This method runs the given tasks concurrently on the event loop. A task
+        is a generator that yields livestatus requests and receives the result.
+
+        Raises:
+            the first exception raised by a task, unless failed is passed
+
+        Attributes:
+            tasks       a list of tuples (site name, generator)
+            failed      optional a dictionary to store the exception info of
+                        the first failed task of each site instead of raising
+        """
+        errors = self.loop.run([(self.sites[site].socket, task, site) for site, task in tasks])
+        if failed is not None:
+            for site, exc_info in reversed(errors):
+                failed[site] = exc_info
+        elif errors:
+            raise errors[0][1][0], errors[0][1][1], errors[0][1][2]
+
+    def query_sites(self, queries, consumer=None, failed=None):
+        """
+        This method sends the queries of all sites concurrently, also the
+        queries of a site, and returns the received lines. With a consumer
+        the lines are passed to it as soon as they have been decoded instead,
+        so neither a whole answer nor all answers have to be kept.
+
+        Attributes:
+            queries     a dictionary with the site name as key and a list of
+                        queries as value
+            consumer    optional a function, which takes the site name and the
+                        lines of a query
+            failed      optional a dictionary to store the failed sites, see
+                        run_tasks
+
+        Return:
+            dictionary  the site name as key and all received lines of the
+                        queries as value, empty lists with a consumer
+        """
+        results = dict((site, [[]] * len(queries[site])) for site in queries.keys())
+        with self.stats.measure('queries'):
+            self.run_tasks([(site, self._query(query, results[site], index, site, consumer))
+                            for site in queries.keys() for index, query in enumerate(queries[site])], failed)
+        return dict((site, [line for lines in results[site] for line in lines]) for site in results.keys())
+
+    @staticmethod
+    def _query(query, results, index, site=None, consumer=None):
+        """
+        This is a generator method. It yields the query and stores the received
+        lines or lets the loop pass them to the consumer while they are
+        received.
+
+        Attributes:
+            query       a query string
+            results     a list to store the received lines
+            index       the position of the query in results
+            site        the site name passed to the consumer
+            consumer    optional a function, which takes the site name and the
+                        lines
+        """
+        if consumer is None:
+            results[index] = yield query
+        else:
+            yield query, lambda lines: consumer(site, lines)
+
+    def send_commands(self, commands, failed=None):
+        """
+        This method sends the commands of all sites concurrently. Instead of a
+        write per command, up to LivestatusLoop.commands_per_write commands
+        are sent at once, each as separate COMMAND request.
+
+        Attributes:
+            commands    a dictionary with the site name as key and a list of
+                        command strings created by class Command as value
+            failed      optional a dictionary to store the failed sites, see
+                        run_tasks
+        """
+        with self.stats.measure('commands'):
+            self.run_tasks([(site, self._command(commands[site])) for site in commands.keys() if commands[site]],
+                           failed)
+
+    @staticmethod
+    def _command(commands):
+        """
+        This is a generator method. It yields the commands in batches.
+
+        Attributes:
+            commands    a list of command strings
+        """
+        for idx in range(0, len(commands), LivestatusLoop.commands_per_write):
+            yield commands[idx:idx + LivestatusLoop.commands_per_write]
+
     def get_sites(self):
         """
-        This method returns all sites which are active.
+        This method returns all sites which are active, restricted to the
+        selected sites if there is a selection.
 
         Return:
             list        a list of all active sites
         """
-        return self.sites.keys()
+        return self.sites.keys() if self.selected is None else self.selected
 
     def get_sites_with_data(self):
         """
@@ -194,6 +534,21 @@ class Sites(object):
         """
         return self.sites_with_data
 
+    def set_stats(self, stats):
+        """
+        Setter method, records the following requests in the given Stats
+        object. The sites found unreachable by the discovery are copied, they
+        are not requested again and would be missing otherwise.
+
+        Attributes:
+            stats       a reference to a Stats object
+        """
+        for site in self.stats.unreachable:
+            if site not in self.sites:
+                stats.record_unreachable(site)
+        self.stats = stats
+        self.loop.stats = stats
+
 
 class Site(object):
     """
@@ -209,15 +564,13 @@ class Site(object):
         Attributes:
             sitename    a string with the site name
             alias       a string with the alias of the site
-            socket      the filename with the absolute path of the livestatus
-                        socket
+            socket      the livestatus socket as unix:path or tcp:host:port
         """
         if Site.logger is None:
             Site.logger = setup_logging(self.__class__.__name__)
         self.sitename = sitename
         self.alias = alias
         self.socket = socket
-        self.connection = livestatus.SingleSiteConnection(self.socket)
         self.monitoring_objects = []
         self.logger.debug('Constructor call passed arguments sitename: %s, alias: %s, socket: %s',
                           self.sitename, self.alias, self.socket)
@@ -231,31 +584,18 @@ class Site(object):
         """
         return self.sitename
 
-    def get_connection(self):
-        """
-        Returns the connection to the livestatus socket.
-
-        Return:
-            filehandle  the filehandle to the lifestatus socket
-        """
-        return self.connection
-
-    def validate_data(self, obj):
-        """
-        This method validates the data of the passed object.
-
-        Arguments:
-            obj         the object that needs to be validated
-        """
-        self.logger.debug('Validate data for site %s', self.get_sitename())
-        obj.get_data(self.get_connection(), self.push, obj.get_query)
-
     def push(self, obj):
         """
         This method appends an obj to the monitored object list.
         """
         self.monitoring_objects.append(obj)
 
+    def reset(self):
+        """
+        This method removes all objects from the monitored object list.
+        """
+        self.monitoring_objects = []
+
     def has_data(self):
         """
         Returns True if there is data in the object list or False if there is
@@ -277,908 +617,4915 @@ class Site(object):
             yield obj
 
 
-class Host(object):
+class LivestatusChannel(object):
     """
-    The Host class represents a host in check_mk.
+    The LivestatusChannel class is a non-blocking connection to a unix: or
+    tcp: livestatus socket. It sends one request at a time and receives the
+    answer in pieces, it is driven by the LivestatusLoop class. The status
+    and the length of the answer are checked as soon as the fixed16 header
+    has arrived and the rows of the JSON answer are decoded while they are
+    received, so the whole answer is never kept as string. With a consumer
+    the rows are passed to it as soon as they are decoded, so they are not
+    kept either.
     """
-    logger = None
-    _table = 'hosts'
-    _columns = ['name']
+    _header_length = 16
+    _header = re.compile(r'^(\d{3}) ([ \d]{11})\n$')
+    _separator = re.compile(r'[\s,]*')
+    _decoder = json.JSONDecoder()
 
-    def __init__(self, host_name, auth):
+    def __init__(self, socketurl):
         """
-        The constructor method for class Host.
+        The constructor method for class LivestatusChannel.
+
+        Raises:
+            MKLivestatusSocketError
 
         Attributes:
-            host_name   a string with the name of the host
-        """
-        if Host.logger is None:
-            Host.logger = setup_logging(self.__class__.__name__)
-        self.host_name = host_name
-        self.auth = auth
-        self.logger.debug('Constructor call passed arguments host_name: %s', self.host_name)
+            socketurl       the socket as unix:path or tcp:host:port
+        """
+        self.socketurl = socketurl
+        self.task = None
+        self.outbuf = ''
+        self.inbuf = ''
+        self.expect = False
+        self.length = None
+        self.code = None
+        self.state = None
+        self.rows = None
+        self.consumer = None
+        self.count = 0
+        self.started = None
+        self.sent = 0
+        self.received = 0
+        try:
+            if socketurl.startswith('unix:'):
+                # a local connect does not block
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(socketurl[5:])
+                self.sock.setblocking(0)
+                self.connected = True
+            elif socketurl.startswith('tcp:'):
+                host, port = socketurl[4:].rsplit(':', 1)
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.sock.setblocking(0)
+                code = self.sock.connect_ex((host, int(port)))
+                if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    raise socket.error(code, os.strerror(code))
+                self.connected = code == 0
+            else:
+                raise MKLivestatusSocketError('Invalid livestatus socket {0}'.format(socketurl))
+        except (socket.error, ValueError), e:
+            raise MKLivestatusSocketError('Cannot connect to {0}: {1}'.format(socketurl, e))
 
-    def get_query(self):
+    def fileno(self):
         """
-        This method returns the query for the listing of hosts in downtime.
+        This method returns the file descriptor for select.
 
         Return:
-            string      returns a livestatus query string
+            int             the file descriptor of the socket
         """
-        query = Query()
-        return query.get_query(self.auth, self._table, self._columns, {self._columns[0]: self.get_host_name()})
+        return self.sock.fileno()
 
-    def get_host_name(self):
+    def start(self, task, request, expect, consumer=None):
         """
-        This method returns the host name of the Host object.
+        This method starts to send a request.
 
+        Attributes:
+            task            the task the request belongs to
+            request         the request string
+            expect          True if livestatus answers the request
+            consumer        optional a function, which takes a list of decoded
+                            rows
+        """
+        self.task = task
+        self.outbuf = request
+        self.inbuf = ''
+        self.expect = expect
+        self.length = None
+        self.code = None
+        self.state = None
+        self.rows = None
+        self.consumer = consumer
+        self.count = 0
+        self.started = time.time()
+        self.sent = len(request)
+        self.received = 0
+
+    def wants_write(self):
+        """
         Return:
-            string      returns a string with the host name
+            boolean         True if the channel waits for the socket to be
+                            writable
         """
-        return self.host_name
+        return not self.connected or self.outbuf != ''
 
-    def get_data(self, connection, store_func, query_func, obj=None):
+    def wants_read(self):
         """
-        This method retrieves the data for a object and stores it. If the object
-        isn't set all object will be received.
-
-        Attributes:
-            connection  the connection filehandle to the livestatus socket
-            store_func  a reference to a method
-            query_func  a reference to a method
-            obj         a object reference which is optional
+        Return:
+            boolean         True if the channel waits for the answer
         """
-        if obj is None:
-            data = connection.query_table(query_func())
-            if data:
-                store_func(self)
-        else:
-            data = connection.query_table(query_func(obj))
-            if data:
-                store_func(data, obj, connection)
+        return self.connected and self.outbuf == '' and self.expect
 
-    def get_filter_for_downtime(self):
+    def is_stale(self):
         """
-        This method returns the dictionary that is needed to generate the filter
-        part of a query.
-        The service_description is needed, since without, the generated query will
-        return all related services to the host, which leads to duplicates.
+        This method checks if an idle connection has been closed by the peer.
 
         Return:
-            dictionary  returns a dictionary for a filter
+            boolean         True if the connection can't be used anymore
         """
-        return {'host_name': self.get_host_name(), 'service_description': ''}
+        try:
+            return bool(select.select([self], [], [], 0)[0])
+        except (select.error, socket.error):
+            return True
 
-    def get_as_a_string(self):
+    def on_write(self):
         """
-        This method returns the hostname.
+        This method finishes the connect or sends the next part of the request.
+
+        Raises:
+            MKLivestatusSocketError
 
         Return:
-            string      the host name of the host or service object
-        """
-        return self.get_host_name()
+            boolean         True if the request is finished
+        """
+        try:
+            if not self.connected:
+                code = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code:
+                    raise socket.error(code, os.strerror(code))
+                self.connected = True
+            if self.outbuf:
+                self.outbuf = self.outbuf[self.sock.send(self.outbuf):]
+        except socket.error, e:
+            raise MKLivestatusSocketError('Cannot send to {0}: {1}'.format(self.socketurl, e))
+        return self.outbuf == '' and not self.expect
+
+    def on_read(self):
+        """
+        This method receives the next part of the answer. The status code and
+        length are checked as soon as the header has been received, the rows
+        of a successful answer are decoded as soon as they are complete.
 
-    @staticmethod
-    def get_downtime_operation(operator):
+        Raises:
+            MKLivestatusSocketError
+
+        Return:
+            boolean         True if the answer is complete
         """
-        This method returns the operator for the downtime command.
+        try:
+            data = self.sock.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return False
+            raise MKLivestatusSocketError('Cannot read from {0}: {1}'.format(self.socketurl, e))
+        if not data:
+            raise MKLivestatusSocketError('Connection to {0} closed'.format(self.socketurl))
+        self.received += len(data)
+        self.inbuf += data
+        if self.length is None:
+            if len(self.inbuf) < self._header_length:
+                return False
+            match = self._header.match(self.inbuf[:self._header_length])
+            if match is None:
+                raise MKLivestatusSocketError('Invalid response header from {0}: {1!r}'.format(
+                    self.socketurl, self.inbuf[:self._header_length]))
+            self.code = match.group(1)
+            self.length = int(match.group(2))
+            self.inbuf = self.inbuf[self._header_length:]
+            if self.code == '200':
+                self.state = 'start'
+                self.rows = []
+        body = self.received - self._header_length
+        if self.code == '200':
+            self.decode_rows()
+        if body > self.length:
+            raise MKLivestatusSocketError('Response from {0} longer than announced: {1} > {2}'.format(
+                self.socketurl, body, self.length))
+        if body == self.length and self.code == '200' and (self.state != 'end' or self.inbuf.strip()):
+            raise MKLivestatusSocketError('Invalid JSON response from {0} at: {1!r}'.format(
+                self.socketurl, self.inbuf[:80]))
+        return body == self.length
+
+    def decode_rows(self):
+        """
+        This method decodes the complete rows of the received part of the
+        JSON answer, an incomplete row stays in the buffer until the rest of
+        it has been received. The decoded rows are passed to the consumer, if
+        there is one.
 
-        Attributes:
-            operator    a string schedule to add a downtime every other string
-                        will return a delete operation
+        Raises:
+            MKLivestatusSocketError
+        """
+        buf = self.inbuf
+        pos = 0
+        rows = []
+        while self.state != 'end':
+            pos = self._separator.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if self.state == 'start':
+                if buf[pos] != '[':
+                    raise MKLivestatusSocketError('Invalid JSON response from {0} at: {1!r}'.format(
+                        self.socketurl, buf[pos:pos + 80]))
+                self.state = 'rows'
+                pos += 1
+            elif buf[pos] == ']':
+                self.state = 'end'
+                pos += 1
+            else:
+                try:
+                    row, pos = self._decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # the row is not complete yet
+                    break
+                rows.append(row)
+        self.inbuf = buf[pos:]
+        self.count += len(rows)
+        if self.consumer is None:
+            self.rows.extend(rows)
+        elif rows:
+            self.consumer(rows)
+
+    def get_result(self):
+        """
+        This method returns the decoded rows of the received answer.
+
+        Raises:
+            MKLivestatusQueryError
 
         Return:
-            string      nether SCHEDULE_HOST_DOWNTIME or DEL_HOST_DOWNTIME
+            list            a list of lists, empty if the rows have been
+                            passed to the consumer
         """
-        return "SCHEDULE_HOST_DOWNTIME" if operator == 'schedule' else "DEL_HOST_DOWNTIME"
+        if self.code != '200':
+            raise MKLivestatusQueryError(self.code, self.inbuf.strip())
+        rows = self.rows
+        self.rows = None
+        return rows
 
+    def close(self):
+        """
+        This method closes the connection.
+        """
+        self.sock.close()
 
-class Service(Host):
+
+class LivestatusLoop(object):
     """
-    The Service class represents a check_mk service.
+    The LivestatusLoop class is an event loop, which runs many livestatus
+    requests on many sites concurrently in one thread. A task is a generator
+    that yields a query string or a list of commands and receives the lines of
+    the query, so a task can decide about its next query. A task can also
+    yield a tuple (query string, consumer), then the lines are passed to the
+    consumer while they are received. Each site gets at
+    most max_channels connections, which are kept alive for the following
+    requests.
     """
     logger = None
-    _table = 'services'
-    _columns = ['host_name', 'description']
+    commands_per_write = 1000
+    max_channels = 4
 
-    def __init__(self, host_name, service_name, auth):
+    def __init__(self, persist=False, timeout=120, stats=None):
         """
-        The constructor method for class Service.
+        The constructor method for class LivestatusLoop.
 
         Attributes:
-            host_name       a string with the name of the host
-            service_name    a string with the service name
-        """
-        if Service.logger is None:
-            Service.logger = setup_logging(self.__class__.__name__)
-        self.host_name = host_name
-        self.service_name = service_name
-        self.auth = auth
-        self.logger.debug('Constructor call passed arguments host_name: %s, service_name: %s',
-                          self.host_name, self.service_name)
+            persist         keep idle connections for the next run
+            timeout         the maximum time of a request in seconds
+            stats           a reference to a Stats object to record the
+                            requests or None
+        """
+        if LivestatusLoop.logger is None:
+            LivestatusLoop.logger = setup_logging(self.__class__.__name__)
+        self.persist = persist
+        self.timeout = timeout
+        self.stats = stats
+        self.idle = {}
 
-    def get_query(self):
+    @staticmethod
+    def get_request(request):
         """
-        This method returns the query for the listing of services in downtime.
+        This method creates the request string of a query or a list of
+        commands.
+
+        Attributes:
+            request         a query string, a tuple (query string, consumer)
+                            or a list of command strings
 
         Return:
-            string          a string with the livesstatus query
+            string          the request string
+            boolean         True if livestatus answers the request
         """
-        query = Query()
-        return query.get_query(self.auth, self._table, self._columns, {self._columns[0]: self.get_host_name(),
-                                                            self._columns[1]: self.get_service_name()})
+        if isinstance(request, tuple):
+            request = request[0]
+        if isinstance(request, list):
+            return "".join("COMMAND " + Writer.encode(command).rstrip("\n") + "\n\n" for command in request), False
+        return Writer.encode(request).rstrip("\n") + \
+            "\nOutputFormat: json\nColumnHeaders: off\nKeepAlive: on\nResponseHeader: fixed16\n\n", True
 
-    def get_service_name(self):
+    def run(self, tasks):
         """
-        This method returns the service name of the Service object.
+        This method runs the tasks until all of them are finished. A failed
+        task gets closed, the others continue.
+
+        Attributes:
+            tasks           a list of tuples (socket url, generator, label)
 
         Return:
-            string          a string with the service name
+            list            a list of tuples (label, exception info) for each
+                            failed task
+        """
+        errors = []
+        ready = collections.defaultdict(collections.deque)
+        busy = []
+        for socketurl, generator, label in tasks:
+            self._advance(ready, errors, [socketurl, generator, label, None], None)
+
+        while busy or any(ready.values()):
+            for socketurl in ready.keys():
+                while ready[socketurl]:
+                    try:
+                        channel = self._get_channel(socketurl, busy)
+                    except MKLivestatusException:
+                        task = ready[socketurl].popleft()
+                        self._unreachable(task)
+                        self._fail(errors, task)
+                        continue
+                    if channel is None:
+                        break
+                    task = ready[socketurl].popleft()
+                    request, expect = self.get_request(task[3])
+                    channel.start(task, request, expect, task[3][1] if isinstance(task[3], tuple) else None)
+                    busy.append(channel)
+            if not busy:
+                continue
+
+            readable, writable, exceptional = select.select([channel for channel in busy if channel.wants_read()],
+                                                            [channel for channel in busy if channel.wants_write()],
+                                                            [], 1)
+            for channel in set(readable + writable):
+                try:
+                    if channel in writable and channel.on_write():
+                        result = None
+                    elif channel in readable and channel.on_read():
+                        result = channel.get_result()
+                    else:
+                        continue
+                except MKLivestatusQueryError:
+                    # the connection stays usable after an error answer
+                    busy.remove(channel)
+                    self.idle.setdefault(channel.socketurl, []).append(channel)
+                    self._record(channel, True)
+                    self._fail(errors, channel.task)
+                    continue
+                except MKLivestatusException:
+                    busy.remove(channel)
+                    channel.close()
+                    self._record(channel, True)
+                    self._unreachable(channel.task)
+                    self._fail(errors, channel.task)
+                    continue
+                except Exception:
+                    # a failed consumer leaves the rest of the answer unread
+                    busy.remove(channel)
+                    channel.close()
+                    self._record(channel, True)
+                    self._fail(errors, channel.task)
+                    continue
+                busy.remove(channel)
+                self.idle.setdefault(channel.socketurl, []).append(channel)
+                self._record(channel)
+                self._advance(ready, errors, channel.task, result)
+
+            for channel in [channel for channel in busy if channel.started + self.timeout < time.time()]:
+                busy.remove(channel)
+                channel.close()
+                self._record(channel, True)
+                self._unreachable(channel.task)
+                try:
+                    raise MKLivestatusSocketError('Timeout after {0} seconds on {1}'.format(
+                        self.timeout, channel.socketurl))
+                except MKLivestatusSocketError:
+                    self._fail(errors, channel.task)
+
+        if not self.persist:
+            self.close()
+        return errors
+
+    def _get_channel(self, socketurl, busy):
+        """
+        This method returns an idle connection to the socket or opens a new one,
+        if the socket has less than max_channels connections.
+
+        Attributes:
+            socketurl       the socket url
+            busy            the list of busy connections
+
+        Return:
+            obj             a LivestatusChannel object or None
         """
-        return self.service_name
+        idle = self.idle.setdefault(socketurl, [])
+        while idle:
+            channel = idle.pop()
+            if not channel.is_stale():
+                return channel
+            channel.close()
+        if len([channel for channel in busy if channel.socketurl == socketurl]) < self.max_channels:
+            self.logger.debug('Opening connection to %s', socketurl)
+            return LivestatusChannel(socketurl)
+        return None
 
-    def get_filter_for_downtime(self):
+    def _record(self, channel, error=False):
         """
-        This method returns the dictionary that is needed to generate the filter
-        part of a query.
+        This method records a finished or failed request of a channel.
 
-        Return:
-            dictionary      a dictionary needed to build the filter for a
-                            livestatus query
+        Attributes:
+            channel         the LivestatusChannel object of the request
+            error           True if the request failed
         """
-        return {'host_name': self.get_host_name(), 'service_description': self.get_service_name()}
+        if self.stats is None:
+            return
+        request = channel.task[3]
+        if isinstance(request, tuple):
+            request = request[0]
+        commands = isinstance(request, list)
+        self.stats.record_request(channel.task[2], time.time() - channel.started, channel.sent, channel.received,
+                                  channel.count, len(request) if commands else 0, error, request)
 
-    def get_as_a_string(self):
+    def _unreachable(self, task):
         """
-        This method returns the hostname and service.
+        This method records the site of a task as unreachable.
 
-        Return:
-            string          the host and service name of the Service object
+        Attributes:
+            task            a list [socket url, generator, label, request]
         """
-        return "{0};{1}".format(self.get_host_name(), self.get_service_name())
+        if self.stats is not None:
+            self.stats.record_unreachable(task[2])
 
-    @staticmethod
-    def get_downtime_operation(operator):
+    def _advance(self, ready, errors, task, result):
         """
-        This method returns the operator for the downtime command.
+        This method passes the result to a task and queues its next request.
 
         Attributes:
-            operator        expects schedule to add a downtime or it will delete
-                            an existing scheduled downtime
+            ready           a dictionary with the socket url as key and the
+                            queue of tasks waiting for a connection as value
+            errors          the list of failed tasks
+            task            a list [socket url, generator, label, request]
+            result          the result of the previous request
+        """
+        try:
+            task[3] = task[1].send(result)
+        except StopIteration:
+            return
+        except Exception:
+            errors.append((task[2], sys.exc_info()))
+            return
+        ready[task[0]].append(task)
 
-        Return:
-            string          Nether SCHEDULE_SVC_DOWNTIME or DEL_SVC_DOWNTIME
+    def _fail(self, errors, task):
         """
-        return "SCHEDULE_SVC_DOWNTIME" if operator == 'schedule' else "DEL_SVC_DOWNTIME"
+        This method records the current exception for a task and closes it.
+
+        Attributes:
+            errors          the list of failed tasks
+            task            a list [socket url, generator, label, request]
+        """
+        self.logger.error('Request for %s failed: %s', task[2], sys.exc_info()[1])
+        errors.append((task[2], sys.exc_info()))
+        task[1].close()
 
+    def close(self):
+        """
+        This method closes all idle connections.
+        """
+        for socketurl in self.idle.keys():
+            for channel in self.idle[socketurl]:
+                channel.close()
+        self.idle = {}
 
 
-class Hostgroup(object):
+class Stats(object):
     """
-    The Hostgroup class receives a hostgroup name and creates for each host of
-    this group a object of a Host class.
+    The Stats class records the wall time and the number of calls of the
+    phases of a run, discovery, resolution, queries and commands, and the
+    requests, commands, rows and bytes of each phase in total and per site.
+    It also counts the resolved objects per site, the created commands per
+    operation and the unreachable sites, and exports all of them as metrics.
     """
-    logger = None
-    _table = 'hostgroups'
-    _columns = ['members']
+    _phases = ['discovery', 'resolution', 'queries', 'commands']
+    _metrics_prefix = 'downtime_'
 
-    def __init__(self, name, auth, exclusive=False):
+    def __init__(self, started=None):
         """
-        The constructor method for class Hostgroup.
+        The constructor method for class Stats.
 
         Attributes:
-            hostgroup       a string with the name of the hostgroup
-            auth            the user credentials
+            started         the start time of the run, default now
         """
-        if Hostgroup.logger is None:
-            Hostgroup.logger = setup_logging(self.__class__.__name__)
-        self.name = name
-        self.auth = auth
-        self.exclusive = exclusive
-        self.logger.debug('Constructor call passed arguments %s: %s', Hostgroup._table, self.name)
+        self.started = started if started is not None else time.time()
+        self.phase = None
+        self.phases = dict((phase, self._counters(time=0.0, calls=0)) for phase in self._phases)
+        self.sites = {}
+        self.objects = {}
+        self.operations = {}
+        self.unreachable = set()
+        self.tracer = None
 
-    def get_query(self):
+    @staticmethod
+    def _counters(**kwargs):
         """
-        A getter method to retrieve the query.
+        This method returns a new set of counters.
+
+        Attributes:
+            kwargs          additional counters with their initial value
 
         Return:
-            string          the query sring for livestatus
+            dictionary      the counter name as key and the value
         """
-        query = Query()
-        return query.get_query(self.auth, self._table, self._columns, {'name': self.get_name()})
+        counters = {'requests': 0, 'commands': 0, 'rows': 0, 'bytes_sent': 0, 'bytes_received': 0, 'errors': 0}
+        counters.update(kwargs)
+        return counters
 
-    def get_name(self):
+    @contextlib.contextmanager
+    def measure(self, phase):
         """
-        A getter method to return the name of the hostgroup.
+        This is a context manager, it adds the wall time of the block to the
+        phase and assigns the requests of the block to the phase.
 
-        Return:
-            string          a string with the hostgroup name
+        Attributes:
+            phase           one of discovery, resolution, queries or commands
         """
-        return self.name
+        previous = self.phase
+        self.phase = phase
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.phases[phase]['time'] += time.time() - started
+            self.phases[phase]['calls'] += 1
+            self.phase = previous
 
-    def get_auth(self):
+    def set_tracer(self, tracer):
         """
-        A getter method to return the reference to the authentication credentials.
+        Setter method, passes the following livestatus requests also to the
+        given tracer.
 
-        Return:
-            dictionary      a reference to the auth dictionary
+        Attributes:
+            tracer          a reference to a QueryTracer object or None
         """
-        return self.name
+        self.tracer = tracer
 
-    def get_exclusive(self):
+    def record_request(self, site, latency, sent=0, received=0, rows=0, commands=0, error=False, request=None):
         """
-        A getter method to figure out if Services should be considered.
+        This method adds a request to the counters of the current phase and
+        of the site.
 
-        Return:
-            boolean         True if Services shall be excluded else False
+        Attributes:
+            site            the site name
+            latency         the time of the request in seconds
+            sent            the number of sent bytes
+            received        the number of received bytes
+            rows            the number of received rows
+            commands        the number of sent commands
+            error           True if the request failed
+            request         the livestatus query string or list of commands,
+                            it is passed to the tracer
+        """
+        if self.tracer is not None and request is not None:
+            self.tracer.record(site, request, latency, rows, received, error)
+        phase = self.phase or 'queries'
+        counters = self.sites.setdefault(site, {}).setdefault(phase, self._counters(latency=0.0, max_latency=0.0))
+        counters['latency'] += latency
+        counters['max_latency'] = max(counters['max_latency'], latency)
+        for counters in (self.phases[phase], counters):
+            counters['requests'] += 1
+            counters['commands'] += commands
+            counters['rows'] += rows
+            counters['bytes_sent'] += sent
+            counters['bytes_received'] += received
+            counters['errors'] += 1 if error else 0
+
+    def record_objects(self, site, count):
+        """
+        This method adds the number of resolved objects of a site.
+
+        Attributes:
+            site            the site name
+            count           the number of hosts and services
         """
-        return self.exclusive
+        self.objects[site] = self.objects.get(site, 0) + count
 
-    def get_data(self, connection, store_func, query_func=None):
+    def record_command(self, operation):
         """
-        This method retrieves the data for a object and stores it.
+        This method counts a created downtime command.
 
         Attributes:
-            connection      the connection to the livestatus socket
-            store_func      a reference to a method
-            query_func      not used but needed
+            operation       either add or remove
         """
-        data = connection.query_table(self.get_query())
-        if data:
-            for host_name in data[0][0]:
-                self.logger.debug('Received data - Host: %s', host_name)
-                obj = HostAndServices(host_name, self.get_auth())
-                store_func(obj)
-
-
-class Servicegroup(Hostgroup):
-    """
-    The Servicegroup class receives a servicegroup name and creates for each
-    service of this group a object of a Service class.
-    """
-    logger = None
-    _table = 'servicegroups'
-    _columns = ['members']
+        self.operations[operation] = self.operations.get(operation, 0) + 1
 
-    def __init__(self, name, auth):
+    def record_unreachable(self, site):
         """
-        The constructor method for class Servicegroup.
+        This method marks a site as unreachable.
 
         Attributes:
-            servicegroup    a string with the name of the servicegroup
-            auth            the user credentials
+            site            the site name
         """
-        if Servicegroup.logger is None:
-            Servicegroup.logger = setup_logging(self.__class__.__name__)
-        self.name = name
-        self.auth = auth
-        self.logger.debug('Constructor call passed arguments %s: %s', Servicegroup._table, self.name)
+        self.unreachable.add(site)
 
-    def get_data(self, connection, store_func, query_func=None):
+    def get_report(self):
         """
-        This method retrieves the data for a object and stores it.
+        This method returns the report of all recorded phases and sites.
+
+        Return:
+            dictionary      the runtime, the phases, the phases per site, the
+                            objects per site, the commands per operation and
+                            the unreachable sites
+        """
+        return {
+            'runtime': time.time() - self.started,
+            'phases': self.phases,
+            'sites': self.sites,
+            'objects': self.objects,
+            'operations': self.operations,
+            'unreachable': sorted(self.unreachable),
+        }
 
-        connection          the connection to the livestatus socket
-        store_func          a reference to a method
-        query_func          not used but needed
+    def merge(self, report):
         """
-        data = connection.query_table(self.get_query())
-        if data:
-            for host_name, service in data[0][0]:
-                obj = Service(host_name, service, self.get_auth())
-                store_func(obj)
+        This method adds the counters of a report returned by get_report of
+        another Stats object, the runtime is not merged.
 
+        Attributes:
+            report          a dictionary returned by get_report
+        """
+        for phase, counters in report['phases'].items():
+            for key, value in counters.items():
+                self.phases[phase][key] += value
+        for site, phases in report['sites'].items():
+            for phase, counters in phases.items():
+                mine = self.sites.setdefault(site, {}).setdefault(phase, self._counters(latency=0.0,
+                                                                                        max_latency=0.0))
+                for key, value in counters.items():
+                    mine[key] = max(mine[key], value) if key == 'max_latency' else mine[key] + value
+        for site, count in report['objects'].items():
+            self.record_objects(site, count)
+        for operation, count in report['operations'].items():
+            self.operations[operation] = self.operations.get(operation, 0) + count
+        self.unreachable.update(report['unreachable'])
+
+    def get_metrics(self, labels=None, gauges=None):
+        """
+        This method returns the recorded counters in the Prometheus text
+        exposition format.
 
-class HostAndServices(Servicegroup):
-    """
-    The HostAndServices class receives a hostname and creates for each service that belong to that hsot
-    object of a Service class.
-    """
-    logger = None
-    _table = 'hosts'
-    _columns = ['name', 'services']
+        Attributes:
+            labels          a dictionary with labels added to every sample
+            gauges          a dictionary with additional gauges, the name
+                            without prefix as key and a tuple (help, value) as
+                            value
 
-    def __init__(self, name, auth, exclusive=False):
+        Return:
+            string          the metrics
+        """
+        labels = labels or {}
+        families = [
+            ('last_run_timestamp_seconds', 'Unix time of the end of the run', [({}, time.time())]),
+            ('runtime_seconds', 'Wall time of the run', [({}, time.time() - self.started)]),
+            ('phase_duration_seconds', 'Wall time of the phase',
+             [({'phase': phase}, self.phases[phase]['time']) for phase in self._phases]),
+            ('phase_calls', 'Number of times the phase was entered',
+             [({'phase': phase}, self.phases[phase]['calls']) for phase in self._phases]),
+            ('site_requests', 'Livestatus queries and webapi requests per site and phase',
+             [({'site': site, 'phase': phase}, counters['requests'])
+              for site, phase, counters in self._site_counters()]),
+            ('site_commands', 'Livestatus commands per site and phase',
+             [({'site': site, 'phase': phase}, counters['commands'])
+              for site, phase, counters in self._site_counters() if counters['commands']]),
+            ('site_errors', 'Failed requests per site and phase',
+             [({'site': site, 'phase': phase}, counters['errors'])
+              for site, phase, counters in self._site_counters()]),
+            ('site_latency_seconds', 'Summed latency of the requests per site and phase',
+             [({'site': site, 'phase': phase}, counters['latency'])
+              for site, phase, counters in self._site_counters()]),
+            ('site_objects', 'Resolved hosts and services per site',
+             [({'site': site}, count) for site, count in sorted(self.objects.items())]),
+            ('site_unreachable', 'The site was not reachable',
+             [({'site': site}, 1) for site in sorted(self.unreachable)]),
+            ('sites_unreachable', 'Number of unreachable sites', [({}, len(self.unreachable))]),
+            ('created_commands', 'Created downtime commands per operation',
+             [({'operation': operation}, count) for operation, count in sorted(self.operations.items())]),
+            ('errors', 'Failed requests of all sites',
+             [({}, sum(self.phases[phase]['errors'] for phase in self._phases))]),
+        ]
+        for name, (description, value) in sorted((gauges or {}).items()):
+            families.append((name, description, [({}, value)]))
+
+        lines = []
+        for name, description, samples in families:
+            name = self._metrics_prefix + name
+            lines.append('# HELP {0} {1}'.format(name, description))
+            lines.append('# TYPE {0} gauge'.format(name))
+            for sample_labels, value in samples:
+                sample_labels = dict(labels, **sample_labels)
+                pairs = ','.join('{0}="{1}"'.format(key, self._escape(sample_labels[key]))
+                                 for key in sorted(sample_labels.keys()))
+                lines.append('{0}{1} {2}'.format(name, '{' + pairs + '}' if pairs else '', repr(float(value))))
+        return "\n".join(lines) + "\n"
+
+    def _site_counters(self):
+        """
+        This is a generator method. It yields the counters of each site and
+        phase in a stable order.
+        """
+        for site in sorted(self.sites.keys()):
+            for phase in self._phases:
+                if phase in self.sites[site]:
+                    yield site, phase, self.sites[site][phase]
+
+    @staticmethod
+    def _escape(value):
         """
-        The constructor method for class HostAndServices.
+        This method escapes a label value.
 
         Attributes:
-            host            a string with the name of the host
-            auth            the user credentials
-            exclusive       if set, services will not included in downtime
+            value           the label value
+
+        Return:
+            string          the escaped value
         """
-        if HostAndServices.logger is None:
-            HostAndServices.logger = setup_logging(self.__class__.__name__)
-        self.name = name
-        self.auth = auth
-        self.exclusive = exclusive
-        self.logger.debug('Constructor call passed arguments %s: %s', HostAndServices._table, self.name)
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
-    def get_query(self):
+    def write_metrics(self, path, labels=None, gauges=None):
         """
-        A getter method to return the query.
+        This method writes the metrics for the textfile collector of the
+        Prometheus node exporter. The file is written under a temporary name
+        and renamed, so the collector never reads a partial file.
 
-        Return:
-            string          the query sring for livestatus
+        Attributes:
+            path            the file name, should end with .prom
+            labels          see get_metrics
+            gauges          see get_metrics
         """
-        query = Query()
-        return query.get_query(self.auth, self._table, self._columns, {'name': self.get_name()})
+        temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temporary, 'w') as stream:
+            stream.write(self.get_metrics(labels, gauges))
+        os.rename(temporary, path)
 
-    def get_data(self, connection, store_func, query_func=None):
+    def write(self, path):
         """
-        This method retrieves the data for a object and stores it.
+        This method writes the report as JSON to a file or to stderr if the
+        file name is -.
 
         Attributes:
-            connection      the connection to the livestatus socket
-            store_func      a reference to a method
-            query_func      not used but needed
+            path            the file name
         """
-        data = connection.query_table(self.get_query())
-        if data:
-            for host_name, services in data:
-                obj = Host(host_name, self.get_auth())
-                store_func(obj)
-                if not self.get_exclusive():
-                    for service in services:
-                        self.logger.debug('Received data - Host: %s Service: %s', host_name, service)
-                        obj = Service(host_name, service, self.get_auth())
-                        store_func(obj)
+        report = json.dumps(self.get_report(), sort_keys=True, indent=2) + "\n"
+        if path == '-':
+            sys.stderr.write(report)
+        else:
+            with open(path, 'w') as stream:
+                stream.write(report)
 
 
-class Downtime(object):
+class QueryTracer(object):
     """
-    The Downtime class lists or removes existing or adds new downtimes.
-    Important is, the comment ist the key to select the downtimes to remove.
+    The QueryTracer class records the livestatus requests per site and shape.
+    The shape of a query is the query without the values of the filters and
+    with repeated filter blocks collapsed, so the queries of one selector
+    share a shape regardless of the selected objects. The shape of a batch of
+    commands is the names of the commands.
     """
-    logger = None
-    _table = 'downtimes'
-    _columns = ['id', 'author', 'host_name', 'service_description', 'start_time',
-                'end_time', 'duration', 'fixed', 'comment']
-    _lables = ['ID', 'Grouped ID', 'Author', 'Hostname', 'Servicename', 'Start', 'End', 'Duration', 'Fixed', 'Comment']
+    _placeholders = ['AuthUser', 'Limit', 'Or', 'And', 'Negate', 'StatsOr', 'StatsAnd']
+    _block_sizes = [1, 2, 3, 4]
 
-    def __init__(self, sites, auth, comment='', groupedid=None, epoch=False, quiet=False, limit=100):
+    def __init__(self):
         """
-        The constructor method for class Downtime.
-
-        Attributes:
-            sites           a object reference of class Sites
-            author          a string with the name of the author
-            comment         a descriptive text to explain the reason for the downtime
-            groupedid       a groupedid string for the downtime
-            epoch           show time representations in epoch instead of human
-                            readable
-            quiet           no output
-            limit           limit the output to a given amount of lines
+        The constructor method for class QueryTracer.
         """
-        if Downtime.logger is None:
-            Downtime.logger = setup_logging(self.__class__.__name__)
-        self.sites = sites
-        self.auth = auth
-        self.author = self.auth.get_author()
-        self.comment = comment
-        self.groupedid = groupedid
-        self.epoch = epoch
-        self.quiet = quiet
-        self.limit = limit
-        self.data = []
-        self.dates = {
-            'now': int(datetime.now().strftime('%s')),
-            'start_time': None,
-            'end_time': None,
-            'duration': None,
-        }
-        self.logger.debug('Constructor call passed arguments sites (keys): %s, author: %s, groupedid: %s',
-                          self.sites.sites.keys(), self.author, self.groupedid)
+        self.lock = threading.Lock()
+        self.shapes = {}
 
-    def _request_objects(self):
+    @classmethod
+    def normalize(cls, request):
         """
-        This is a generator method. It loops through all sites that contain data
-        and returns the site name and the object reference of class Host or Service
+        This method returns the table and the shape of a request.
 
-        Return:
-            site            a string with the site name
-            obj             a object reference of class Host or Service
-        """
-        for site in self.sites.get_sites_with_data():
-            for obj in self.sites.sites[site].get_monitoring_objects():
-                self.logger.debug('Found object on site %s: discovered data is %s', site, obj.get_as_a_string())
-                yield site, obj
+        Attributes:
+            request         a query string or a list of command strings
 
-    def get_data(self, connection, store_func, query_func):
-        """
-        This method retrieves the data for a object and stores it.
+        Return:
+            string          the table or COMMAND
+            string          the shape
+        """
+        if isinstance(request, list):
+            names = set(command.split('] ', 1)[-1].split(';', 1)[0] for command in request)
+            return 'COMMAND', 'COMMAND ' + ','.join(sorted(names))
+        table = ''
+        lines = []
+        for line in request.strip().split("\n"):
+            header, value = line.split(': ', 1) if ': ' in line else (line, None)
+            if line.startswith('GET '):
+                table = line[4:]
+            elif header in ('Filter', 'Stats') and len(value.split(' ', 2)) == 3:
+                line = header + ': ' + ' '.join(value.split(' ', 2)[:2]) + ' ?'
+            elif header in cls._placeholders:
+                line = header + ': ?'
+            lines.append(line)
+        for size in cls._block_sizes:
+            collapsed = []
+            for line in lines:
+                collapsed.append(line)
+                if len(collapsed) >= 2 * size and collapsed[-size:] == collapsed[-2 * size:-size]:
+                    del collapsed[-size:]
+            lines = collapsed
+        return table, "\n".join(lines)
+
+    def record(self, site, request, latency, rows=0, received=0, error=False):
+        """
+        This method adds a request to its shape.
 
         Attributes:
-            connection      the connection to the livestatus socket
-            store_func      a reference to a method
-            query_func      not used but needed
-        """
-        self.logger.debug('Querying livestatus query: %s', query_func())
-        data = connection.query_table(query_func())
-        if data:
-            self.logger.debug('Retrieved data: %s', data)
-            store_func(data)
-
-    def get_query(self, obj=None):
-        """
-        A getter method to retrieve the query. If object is specified a
-        livestatus filter gets also returned.
+            site            the site name
+            request         a query string or a list of command strings
+            latency         the time of the request in seconds
+            rows            the number of received rows
+            received        the number of received bytes
+            error           True if the request failed
+        """
+        table, shape = self.normalize(request)
+        digest = hashlib.sha1(shape).hexdigest()[:12]
+        with self.lock:
+            entry = self.shapes.setdefault((site, digest), {
+                'site': site, 'table': table, 'hash': digest, 'shape': shape, 'count': 0, 'errors': 0,
+                'latency': 0.0, 'max_latency': 0.0, 'rows': 0, 'bytes': 0})
+            entry['count'] += 1
+            entry['errors'] += 1 if error else 0
+            entry['latency'] += latency
+            entry['max_latency'] = max(entry['max_latency'], latency)
+            entry['rows'] += rows
+            entry['bytes'] += received
+
+    def get_top(self, key, top=10):
+        """
+        This method returns the shapes with the highest values.
 
         Attributes:
-            obj             a object reference of Host or Service
+            key             the sort key, e.g. latency or count
+            top             the number of shapes
 
         Return:
-            string          a string with the query for livestatus
+            list            a list of dictionaries
         """
-        query = Query()
-        if obj is None:
-            return query.get_query(self.auth, self._table, self._columns)
-        else:
-            return query.get_query(self.auth, self._table, self._columns, obj.get_filter_for_downtime())
+        with self.lock:
+            entries = self.shapes.values()
+        return sorted(entries, key=lambda entry: (-entry[key], entry['site'], entry['hash']))[:top]
 
-    def list_downtimes(self, is_filter=True):
+    def write(self, stream, top=10):
         """
-        This method queries livestatus and passes the result to a print method.
-        If the optional filter is not given all downtimes get retrieved.
+        This method writes the slowest and the most frequent shapes as tables
+        and the shapes of the listed hashes.
 
         Attributes:
-            is_filter       a boolean True if a filter has been provided
-        """
-        print "{0:8s} {1:12} {2:10s} {3:20s} {4:40s} {5:19s} {6:19s} {7:10s} {8:6s} {9:80s}".format(
-            self._lables[0],
-            self._lables[1],
-            self._lables[2],
-            self._lables[3],
-            self._lables[4],
-            self._lables[5],
-            self._lables[6],
-            self._lables[7],
-            self._lables[8],
-            self._lables[9]
-        )
-        if is_filter:
-            for site, obj in self._request_objects():
-                obj.get_data(self.sites.sites[site].get_connection(), self.print_downtime, self.get_query, obj)
-        else:
-            for site in self.sites.get_sites():
-                self.get_data(self.sites.sites[site].get_connection(), self.print_downtime, self.get_query)
+            stream          a file object
+            top             the number of shapes of each table
+        """
+        listed = {}
+        for title, key in [('Slowest query shapes', 'latency'), ('Most frequent query shapes', 'count')]:
+            stream.write("{0} (top {1}):\n".format(title, top))
+            stream.write("{0:<20} {1:<14} {2:<12} {3:>7} {4:>10} {5:>9} {6:>9} {7:>9} {8:>11}\n".format(
+                'Site', 'Table', 'Hash', 'Count', 'Total s', 'Max s', 'Avg ms', 'Rows', 'Bytes'))
+            for entry in self.get_top(key, top):
+                listed[entry['hash']] = entry['shape']
+                stream.write("{0:<20} {1:<14} {2:<12} {3:>7} {4:>10.3f} {5:>9.3f} {6:>9.1f} {7:>9} {8:>11}\n".format(
+                    entry['site'], entry['table'], entry['hash'], entry['count'], entry['latency'],
+                    entry['max_latency'], entry['latency'] * 1000 / entry['count'], entry['rows'], entry['bytes']))
+            stream.write("\n")
+        stream.write("Query shapes:\n")
+        for digest in sorted(listed.keys()):
+            stream.write("{0} {1}\n".format(digest, listed[digest].replace("\n", " | ")))
 
-    def add_downtimes(self):
-        """
-        This method sends commands to livestatus to add the requested downtimes.
-        """
-        for site, obj in self._request_objects():
-            cmd = Command()
-            self.sites.sites[site].get_connection().command(cmd.add_downtime(obj, self))
 
-    def remove_downtimes(self):
-        """
-        This method sends commands to livestatus to evaluate the downtime id and
-        creates and executes the command to remove the specified downtime.
-        """
-        for site, obj in self._request_objects():
-            obj.get_data(self.sites.sites[site].get_connection(), self.remove_downtime, self.get_query, obj)
+class Host(object):
+    """
+    The Host class represents a host in check_mk.
+    """
+    logger = None
+    _table = 'hosts'
+    _columns = ['name']
 
-    def print_downtime(self, data, obj=None, connection=None):
+    def __init__(self, host_name, auth):
         """
-        This method prints all retrieved data if groupedid is None or the groupedid
-        of the downtime matches the groupedid passed to the programm.
+        The constructor method for class Host.
 
         Attributes:
-            data            a list of lists returnd from livestatus
-            obj             optional
-            connection      optional
+            host_name   a string with the name of the host
         """
-        for line in data:
-            if self.get_groupedid() is None or self.get_groupedid() in line[8].encode('utf-8'):
-                start_date = line[4] if self.epoch else str(datetime.fromtimestamp(line[4]))
-                end_date = line[5] if self.epoch else str(datetime.fromtimestamp(line[5]))
-                cmt, sep, groupedid = line[8].encode('utf-8').partition(' ID:')
-                print "{0:8d} {1:12s} {2:10s} {3:20s} {4:40s} {5:19s} {6:19s} {7:10d} {8:6d} {9:80s}".format(
-                    line[0],
-                    groupedid,
-                    line[1][:10].encode('utf-8'),
-                    line[2][:20].encode('utf-8'),
-                    line[3][:40].encode('utf-8'),
-                    start_date,
-                    end_date,
-                    line[6],
-                    line[7],
-                    cmt
-                )
-
-    def remove_downtime(self, data, obj, connection):
-        """
-        This method executes a command if the comment passed by data matches the
-        comment stored in this object.
-
-        Attributes:
-            data            a list of lists from livestatus
-            obj             the object reference of type Host or Service from
-                            which the downtime shall be removed
-            connection      the connection to livestatus
-        """
-        # See if comment contains the groupedid
-        for data_set in data:
-            if self.get_groupedid() in data_set[8]:
-                cmd = Command()
-                connection.command(cmd.remove_downtime(obj, data_set[0], self))
+        if Host.logger is None:
+            Host.logger = setup_logging(self.__class__.__name__)
+        self.host_name = host_name
+        self.auth = auth
+        self.window = None
+        self.logger.debug('Constructor call passed arguments host_name: %s', self.host_name)
 
-    def get_author(self):
+    def get_query(self):
         """
-        Getter method, returns the author.
+        This method returns the query for the listing of hosts in downtime.
 
         Return:
-            string          a string with the user name
+            string      returns a livestatus query string
         """
-        return self.author
+        query = Query()
+        return query.get_query(self.auth, self._table, self._columns, {self._columns[0]: self.get_host_name()})
 
-    def get_quiet(self):
+    def get_host_name(self):
         """
-        Getter method, returns True if quiet mode is enabled. Has no impact on list
-        operation.
+        This method returns the host name of the Host object.
 
         Return:
-            boolean         True if quiet mode is enabled else False
+            string      returns a string with the host name
         """
-        return self.quiet
+        return self.host_name
 
-    def get_limit(self):
+    def get_window(self):
         """
-        Getter method, returns the line limit of lines to be printed.
+        This method returns the own downtime window of the object.
 
         Return:
-            int             the number of lines to be printed
+            dictionary  the start_time, end_time, duration and comment of the
+                        window or None if the window of the downtime applies
         """
-        return self.limit
+        return self.window
 
-    def get_comment(self):
+    def set_window(self, window):
         """
-        Getter method, returns the descriptive text for the reason of the downtime.
+        Setter method, retrieves the own downtime window of the object.
 
-        Return:
-            string          the comment string
+        Attributes:
+            window      a dictionary with start_time, end_time, duration and
+                        comment, shared by all objects of a plan row
         """
-        return self.comment
+        self.window = window
 
-    def get_groupedid(self):
+    def resolve(self, store_func):
         """
-        Getter method, returns the downtime groupedid.
+        This is a generator method for LivestatusLoop. It yields the query for
+        the object and stores it, if it exists.
 
-        Return:
-            string          the groupedid string
+        Attributes:
+            store_func  a reference to a method
         """
-        return self.groupedid
+        data = yield self.get_query()
+        if data:
+            store_func(self)
 
-    def get_now(self):
+    def get_filter_for_downtime(self):
         """
-        Getter method, returns the actual date if available for the downtime
-        object.
+        This method returns the dictionary that is needed to generate the filter
+        part of a query.
+        The service_description is needed, since without, the generated query will
+        return all related services to the host, which leads to duplicates.
 
         Return:
-            int             the date as Unix epoch time
+            dictionary  returns a dictionary for a filter
         """
-        return self.dates['now'] if self.dates['now'] else None
+        return {'host_name': self.get_host_name(), 'service_description': ''}
 
-    def get_start_time(self):
+    def get_as_a_string(self):
         """
-        Getter method, returns the start time for the downtime object.
+        This method returns the hostname.
 
         Return:
-            int             the date as Unix epoch time or None
+            string      the host name of the host or service object
         """
-        return self.dates['start_time'] if self.dates['start_time'] else None
+        return self.get_host_name()
 
-    def set_start_time(self, start_time):
+    @staticmethod
+    def get_downtime_operation(operator):
         """
-        Setter method, retrieves the start time.
+        This method returns the operator for the downtime command.
 
         Attributes:
-            start_time      the start time as Unix epoch time
-        """
-        self.dates['start_time'] = int(start_time)
-        self.logger.debug('Setting downtime start time to: %d', self.dates['start_time'])
+            operator    a string schedule to add a downtime every other string
+                        will return a delete operation
+
+        Return:
+            string      nether SCHEDULE_HOST_DOWNTIME or DEL_HOST_DOWNTIME
+        """
+        return "SCHEDULE_HOST_DOWNTIME" if operator == 'schedule' else "DEL_HOST_DOWNTIME"
+
+
+class Service(Host):
+    """
+    The Service class represents a check_mk service.
+    """
+    logger = None
+    _table = 'services'
+    _columns = ['host_name', 'description']
+
+    def __init__(self, host_name, service_name, auth):
+        """
+        The constructor method for class Service.
+
+        Attributes:
+            host_name       a string with the name of the host
+            service_name    a string with the service name
+        """
+        if Service.logger is None:
+            Service.logger = setup_logging(self.__class__.__name__)
+        self.host_name = host_name
+        self.service_name = service_name
+        self.auth = auth
+        self.window = None
+        self.logger.debug('Constructor call passed arguments host_name: %s, service_name: %s',
+                          self.host_name, self.service_name)
+
+    def get_query(self):
+        """
+        This method returns the query for the listing of services in downtime.
+
+        Return:
+            string          a string with the livesstatus query
+        """
+        query = Query()
+        return query.get_query(self.auth, self._table, self._columns, {self._columns[0]: self.get_host_name(),
+                                                            self._columns[1]: self.get_service_name()})
+
+    def get_service_name(self):
+        """
+        This method returns the service name of the Service object.
+
+        Return:
+            string          a string with the service name
+        """
+        return self.service_name
+
+    def get_filter_for_downtime(self):
+        """
+        This method returns the dictionary that is needed to generate the filter
+        part of a query.
+
+        Return:
+            dictionary      a dictionary needed to build the filter for a
+                            livestatus query
+        """
+        return {'host_name': self.get_host_name(), 'service_description': self.get_service_name()}
+
+    def get_as_a_string(self):
+        """
+        This method returns the hostname and service.
+
+        Return:
+            string          the host and service name of the Service object
+        """
+        return "{0};{1}".format(self.get_host_name(), self.get_service_name())
+
+    @staticmethod
+    def get_downtime_operation(operator):
+        """
+        This method returns the operator for the downtime command.
+
+        Attributes:
+            operator        expects schedule to add a downtime or it will delete
+                            an existing scheduled downtime
+
+        Return:
+            string          Nether SCHEDULE_SVC_DOWNTIME or DEL_SVC_DOWNTIME
+        """
+        return "SCHEDULE_SVC_DOWNTIME" if operator == 'schedule' else "DEL_SVC_DOWNTIME"
+
+
+
+class Hostgroup(object):
+    """
+    The Hostgroup class receives a hostgroup name and creates for each host of
+    this group a object of a Host class.
+    """
+    logger = None
+    _table = 'hostgroups'
+    _columns = ['members']
+
+    def __init__(self, name, auth, exclusive=False):
+        """
+        The constructor method for class Hostgroup.
+
+        Attributes:
+            hostgroup       a string with the name of the hostgroup
+            auth            the user credentials
+        """
+        if Hostgroup.logger is None:
+            Hostgroup.logger = setup_logging(self.__class__.__name__)
+        self.name = name
+        self.auth = auth
+        self.exclusive = exclusive
+        self.logger.debug('Constructor call passed arguments %s: %s', Hostgroup._table, self.name)
+
+    def get_query(self):
+        """
+        A getter method to retrieve the query.
+
+        Return:
+            string          the query sring for livestatus
+        """
+        query = Query()
+        return query.get_query(self.auth, self._table, self._columns, {'name': self.get_name()})
+
+    def get_name(self):
+        """
+        A getter method to return the name of the hostgroup.
+
+        Return:
+            string          a string with the hostgroup name
+        """
+        return self.name
+
+    def get_auth(self):
+        """
+        A getter method to return the reference to the authentication credentials.
+
+        Return:
+            dictionary      a reference to the auth dictionary
+        """
+        return self.auth
+
+    def get_exclusive(self):
+        """
+        A getter method to figure out if Services should be considered.
+
+        Return:
+            boolean         True if Services shall be excluded else False
+        """
+        return self.exclusive
+
+    def resolve(self, store_func):
+        """
+        This is a generator method for LivestatusLoop. It yields the query for
+        the members and then one query per chunk of members for their services.
+
+        Attributes:
+            store_func      a reference to a method
+        """
+        data = yield self.get_query()
+        if data:
+            members = data[0][0]
+            hosts = HostAndServices(None, self.get_auth(), self.get_exclusive())
+            for idx in range(0, len(members), Downtime.objects_per_query):
+                chunk = members[idx:idx + Downtime.objects_per_query]
+                self.logger.debug('Received data - Hosts: %s', chunk)
+                hosts.store_data((yield hosts.get_members_query(chunk)), store_func)
+
+
+class Servicegroup(Hostgroup):
+    """
+    The Servicegroup class receives a servicegroup name and creates for each
+    service of this group a object of a Service class.
+    """
+    logger = None
+    _table = 'servicegroups'
+    _columns = ['members']
+
+    def __init__(self, name, auth):
+        """
+        The constructor method for class Servicegroup.
+
+        Attributes:
+            servicegroup    a string with the name of the servicegroup
+            auth            the user credentials
+        """
+        if Servicegroup.logger is None:
+            Servicegroup.logger = setup_logging(self.__class__.__name__)
+        self.name = name
+        self.auth = auth
+        self.logger.debug('Constructor call passed arguments %s: %s', Servicegroup._table, self.name)
+
+    def resolve(self, store_func):
+        """
+        This is a generator method for LivestatusLoop. It yields the query for
+        the members and stores them.
+
+        Attributes:
+            store_func      a reference to a method
+        """
+        data = yield self.get_query()
+        if data:
+            for host_name, service in data[0][0]:
+                store_func(Service(host_name, service, self.get_auth()))
+
+
+class HostAndServices(Servicegroup):
+    """
+    The HostAndServices class receives a hostname and creates for each service that belong to that hsot
+    object of a Service class.
+    """
+    logger = None
+    _table = 'hosts'
+    _columns = ['name', 'services']
+
+    def __init__(self, name, auth, exclusive=False):
+        """
+        The constructor method for class HostAndServices.
+
+        Attributes:
+            host            a string with the name of the host
+            auth            the user credentials
+            exclusive       if set, services will not included in downtime
+        """
+        if HostAndServices.logger is None:
+            HostAndServices.logger = setup_logging(self.__class__.__name__)
+        self.name = name
+        self.auth = auth
+        self.exclusive = exclusive
+        self.logger.debug('Constructor call passed arguments %s: %s', HostAndServices._table, self.name)
+
+    def get_query(self):
+        """
+        A getter method to return the query.
+
+        Return:
+            string          the query sring for livestatus
+        """
+        query = Query()
+        return query.get_query(self.auth, self._table, self._columns, {'name': self.get_name()})
+
+    def get_members_query(self, host_names):
+        """
+        A getter method to return the query for a list of hosts.
+
+        Attributes:
+            host_names      a list of host names
+
+        Return:
+            string          the query sring for livestatus
+        """
+        query = Query()
+        return query.get_query(self.auth, self._table, self._columns, any_of=[{'name': name} for name in host_names])
+
+    def resolve(self, store_func):
+        """
+        This is a generator method for LivestatusLoop. It yields the query for
+        the host and stores it and its services.
+
+        Attributes:
+            store_func      a reference to a method
+        """
+        self.store_data((yield self.get_query()), store_func)
+
+    def store_data(self, data, store_func):
+        """
+        This method stores the hosts and, if not exclusive, their services.
+
+        Attributes:
+            data            a list of [host name, services] lists
+            store_func      a reference to a method
+        """
+        for host_name, services in data:
+            obj = Host(host_name, self.get_auth())
+            store_func(obj)
+            if not self.get_exclusive():
+                for service in services:
+                    self.logger.debug('Received data - Host: %s Service: %s', host_name, service)
+                    obj = Service(host_name, service, self.get_auth())
+                    store_func(obj)
+
+
+class Plan(object):
+    """
+    The Plan class reads downtime windows per object from a CSV or JSON Lines
+    file. Each row has the fields host, service (optional), start, end or
+    duration and comment (optional). The rows get validated while the file is
+    read and the objects of all rows get resolved with combined queries, each
+    object keeps the window of its row.
+    """
+    logger = None
+    _fields = ['host', 'service', 'start', 'end', 'duration', 'comment']
+
+    def __init__(self, auth, exclusive=False, comment='Maintenance', duration=7200, now=None):
+        """
+        The constructor method for class Plan.
+
+        Attributes:
+            auth            the user credentials
+            exclusive       if set, the services of a host row are not included
+            comment         the comment of rows without comment
+            duration        the duration of rows without end and duration
+            now             the current time as Unix epoch time, if set windows
+                            which end before are invalid
+        """
+        if Plan.logger is None:
+            Plan.logger = setup_logging(self.__class__.__name__)
+        self.auth = auth
+        self.exclusive = exclusive
+        self.comment = comment
+        self.duration = duration
+        self.now = now
+        self.host_names = []
+        self.windows = {}
+        self.found = set()
+        self.row_count = 0
+
+    def read(self, stream):
+        """
+        This method reads and validates the rows of a stream in one pass. The
+        format is detected by the first line, a JSON object starts JSON Lines,
+        everything else is the header of CSV.
+
+        Attributes:
+            stream          a file object with one row per line
+
+        Return:
+            list            a list of error messages, empty if all rows are valid
+        """
+        errors = []
+        fields = None
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            if fields is None and self.row_count == 0 and not line.lstrip().startswith('{'):
+                fields = [field.strip() for field in next(csv.reader([line]))]
+                try:
+                    self._check_fields(fields)
+                except ValueError, e:
+                    return ['Invalid plan header in line {0}: {1}'.format(number, e)]
+                continue
+            try:
+                if fields is None:
+                    spec = json.loads(line)
+                    if not isinstance(spec, dict):
+                        raise ValueError('Row is not a JSON object')
+                else:
+                    values = next(csv.reader([line]))
+                    if len(values) != len(fields):
+                        raise ValueError('Expected {0} values, got {1}'.format(len(fields), len(values)))
+                    spec = dict(zip(fields, values))
+                self.add(spec)
+            except (ValueError, TypeError, csv.Error), e:
+                errors.append('Invalid plan row in line {0}: {1}'.format(number, e))
+            self.row_count += 1
+        if self.row_count == 0:
+            errors.append('The plan has no rows')
+        return errors
+
+    def _check_fields(self, fields):
+        """
+        This method validates the field names of a row.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            fields          a list of field names
+        """
+        unknown = [field for field in fields if field not in self._fields]
+        if unknown:
+            raise ValueError('Unknown fields: {0}'.format(", ".join(unknown)))
+
+    def add(self, spec):
+        """
+        This method validates a row and stores its window.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            spec            a dictionary with the fields of the row
+        """
+        self._check_fields(spec.keys())
+        spec = dict((key, value) for key, value in spec.items() if value not in ('', None))
+        if 'host' not in spec:
+            raise ValueError('The host is missing')
+        if 'start' not in spec:
+            raise ValueError('The start is missing')
+        start_time = self._epoch(spec['start'])
+        if 'end' in spec:
+            end_time = self._epoch(spec['end'])
+        else:
+            end_time = start_time + int(spec.get('duration', self.duration))
+        if start_time >= end_time:
+            raise ValueError('The start has to be before the end')
+        if self.now is not None and end_time <= self.now:
+            raise ValueError('The window ends in the past')
+        comment = spec.get('comment', self.comment)
+        if "\n" in comment or ";" in spec['host'] or ";" in spec.get('service', ''):
+            raise ValueError('Line breaks in the comment or semicolons in names are not allowed')
+
+        window = {
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration': end_time - start_time,
+            'comment': comment,
+        }
+        if spec['host'] not in self.windows:
+            self.host_names.append(spec['host'])
+            self.windows[spec['host']] = []
+        self.windows[spec['host']].append((spec.get('service', ''), window))
+
+    @staticmethod
+    def _epoch(value):
+        """
+        This method converts a time of a row to Unix epoch time.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            value           Unix epoch time or a string dd-mm-yyyy HH:MM
+
+        Return:
+            int             the Unix epoch time
+        """
+        if isinstance(value, (int, long, float)) or isinstance(value, basestring) and value.isdigit():
+            return int(value)
+        try:
+            return int(datetime.strptime(value, "%d-%m-%Y %H:%M").strftime('%s'))
+        except (ValueError, TypeError):
+            raise ValueError("Time is neither epoch time nor in the format dd-mm-yyyy HH:MM: '{0}'".format(value))
+
+    def get_row_count(self):
+        """
+        A getter method to return the number of read rows.
+
+        Return:
+            int             the number of rows
+        """
+        return self.row_count
+
+    def get_missing(self):
+        """
+        This method returns the rows whose host or service was not found on
+        any site.
+
+        Return:
+            list            a list of (host name, service name) tuples, the
+                            service name is empty for host rows
+        """
+        return [(host_name, service) for host_name in self.host_names for service, window in self.windows[host_name]
+                if (host_name, service) not in self.found]
+
+    def resolve(self, store_func):
+        """
+        This is a generator method for LivestatusLoop. It yields one query per
+        chunk of hosts and stores the found hosts and services with the window
+        of their row. A service with its own row doesn't get the window of the
+        row of its host, the same object with the same window is stored once.
+
+        Attributes:
+            store_func      a reference to a method
+        """
+        hosts = HostAndServices(None, self.auth, True)
+        for idx in range(0, len(self.host_names), Downtime.objects_per_query):
+            data = yield hosts.get_members_query(self.host_names[idx:idx + Downtime.objects_per_query])
+            for host_name, services in data:
+                windows = self.windows.get(host_name, [])
+                explicit = set(service for service, window in windows if service != '')
+                stored = set()
+                for service, window in windows:
+                    if service == '':
+                        self._store(Host(host_name, self.auth), window, store_func, stored)
+                        if not self.exclusive:
+                            for name in services:
+                                if name not in explicit:
+                                    self._store(Service(host_name, name, self.auth), window, store_func, stored)
+                    elif service in services:
+                        self._store(Service(host_name, service, self.auth), window, store_func, stored)
+                    else:
+                        continue
+                    self.found.add((host_name, service))
+
+    @staticmethod
+    def _store(obj, window, store_func, stored):
+        """
+        This method stores an object with its window, unless it has already
+        been stored with the same window.
+
+        Attributes:
+            obj             a object reference of Host or Service
+            window          the window of the row
+            store_func      a reference to a method
+            stored          a set of the (host name, service description,
+                            start, end, comment) of the stored objects
+        """
+        a_filter = obj.get_filter_for_downtime()
+        key = (a_filter['host_name'], a_filter['service_description'], window['start_time'], window['end_time'],
+               window['comment'])
+        if key in stored:
+            return
+        stored.add(key)
+        obj.set_window(window)
+        store_func(obj)
+
+
+class Downtime(object):
+    """
+    The Downtime class lists or removes existing or adds new downtimes.
+    Important is, the comment ist the key to select the downtimes to remove.
+    """
+    logger = None
+    _table = 'downtimes'
+    _columns = ['id', 'author', 'host_name', 'service_description', 'start_time',
+                'end_time', 'duration', 'fixed', 'comment']
+    _sort_keys = {
+        'id': lambda line: line[0],
+        'start': lambda line: line[4],
+        'end': lambda line: line[5],
+        'host': lambda line: (line[2], line[3]),
+    }
+    objects_per_query = 500
+    _summary_columns = ['author', 'comment']
+    _summary_stats = ['id > 0', 'min start_time', 'max end_time']
+
+    def __init__(self, sites, auth, comment='', groupedid=None, epoch=False, quiet=False, limit=100,
+                 output_format='table', sort=None):
+        """
+        The constructor method for class Downtime.
+
+        Attributes:
+            sites           a object reference of class Sites
+            author          a string with the name of the author
+            comment         a descriptive text to explain the reason for the downtime
+            groupedid       a groupedid string for the downtime
+            epoch           show time representations in epoch instead of human
+                            readable
+            quiet           no output
+            limit           limit the output to a given amount of lines
+            output_format   the output format of the list operation, one of
+                            table, jsonl or csv
+            sort            the sort key of the list operation, one of id,
+                            start, end or host, None keeps the order of livestatus
+        """
+        if Downtime.logger is None:
+            Downtime.logger = setup_logging(self.__class__.__name__)
+        self.sites = sites
+        self.auth = auth
+        self.author = self.auth.get_author()
+        self.comment = comment
+        self.groupedid = groupedid
+        self.epoch = epoch
+        self.quiet = quiet
+        self.limit = limit
+        self.output_format = output_format
+        self.sort = sort
+        self.writer = None
+        self.messages = None
+        self.coordinator = None
+        self.line_count = 0
+        self.command_count = 0
+        self.data = []
+        self.dates = {
+            'now': int(datetime.now().strftime('%s')),
+            'start_time': None,
+            'end_time': None,
+            'duration': None,
+        }
+        self.filters = {
+            'author': None,
+            'since': None,
+            'until': None,
+        }
+        self.page = {
+            'after_id': None,
+            'page_size': None,
+        }
+        self.logger.debug('Constructor call passed arguments sites (keys): %s, author: %s, groupedid: %s',
+                          self.sites.sites.keys(), self.author, self.groupedid)
+
+    def get_query(self, obj=None, site=None):
+        """
+        A getter method to retrieve the query. If object is specified a
+        livestatus filter gets also returned. The filters for the grouped ID,
+        author and time range are always part of the query, so only matching
+        downtimes get transferred. If a page size is set, only the downtimes
+        after the cursor of the site are requested. The page itself is taken
+        by get_page, a Limit would cut the answer in the order of livestatus,
+        which is not the order of the ids.
+
+        Attributes:
+            obj             a object reference of Host or Service or a list of
+                            them, which get combined in one query
+            site            a string with the site name, needed for paging
+
+        Return:
+            string          a string with the query for livestatus
+        """
+        query = Query()
+        a_filter = self.get_downtime_filter()
+        if self.page['after_id'] is not None and site is not None:
+            a_filter['id'] = ('>', str(self.get_after_id(site)))
+        return query.get_query(self.auth, self._table, self._columns, self._object_filter(a_filter, obj),
+                               any_of=self._object_filters(obj))
+
+    @staticmethod
+    def _object_filter(a_filter, obj):
+        """
+        This method adds the filter of a single object to the passed filter.
+
+        Attributes:
+            a_filter        a dictionary with the filter of the query
+            obj             a object reference of Host or Service, a list of
+                            them or None
+
+        Return:
+            dictionary      the filter or None if it is empty
+        """
+        if obj is not None and not isinstance(obj, list):
+            a_filter.update(obj.get_filter_for_downtime())
+        return a_filter if a_filter else None
+
+    @staticmethod
+    def _object_filters(obj):
+        """
+        This method returns the filters of a list of objects, the query matches
+        if one of them matches.
+
+        Attributes:
+            obj             a object reference of Host or Service, a list of
+                            them or None
+
+        Return:
+            list            a list of filter dictionaries or None
+        """
+        if isinstance(obj, list):
+            return [o.get_filter_for_downtime() for o in obj]
+        return None
+
+    def _chunks(self, objs):
+        """
+        This is a generator method. It splits a list of objects in chunks that
+        are combined in one query.
+
+        Attributes:
+            objs            a list of objects
+
+        Return:
+            list            a list of at most objects_per_query objects
+        """
+        for idx in range(0, len(objs), self.objects_per_query):
+            yield objs[idx:idx + self.objects_per_query]
+
+    def get_downtime_filter(self):
+        """
+        This method returns the dictionary that is needed to restrict the
+        queried downtimes to the grouped ID, the author and the time range.
+
+        Return:
+            dictionary      a dictionary needed to build the filter for a
+                            livestatus query
+        """
+        a_filter = {}
+        if self.get_groupedid() is not None:
+            a_filter['comment'] = ('~', self.get_groupedid())
+        if self.filters['author'] is not None:
+            a_filter['author'] = self.filters['author']
+        if self.filters['since'] is not None:
+            a_filter['end_time'] = ('>=', str(self.filters['since']))
+        if self.filters['until'] is not None:
+            a_filter['start_time'] = ('<=', str(self.filters['until']))
+        return a_filter
+
+    def set_list_filter(self, author=None, since=None, until=None):
+        """
+        Setter method, retrieves the filters for listing downtimes. A downtime
+        matches the time range if it overlaps with it.
+
+        Attributes:
+            author          only downtimes created by this author
+            since           only downtimes ending after this Unix epoch time
+            until           only downtimes starting before this Unix epoch time
+        """
+        self.filters['author'] = author
+        self.filters['since'] = since
+        self.filters['until'] = until
+        self.logger.debug('Setting list filter to: %s', self.filters)
+
+    def list_downtimes(self, is_filter=True):
+        """
+        This method queries all sites concurrently and passes the downtimes to
+        the writer. Without a sort key they are written while they are
+        received. With a sort key the downtimes of each site get sorted in a
+        RowSpool and the sites get merged, so the output is ordered over all
+        sites. If the optional filter is not given all downtimes get retrieved.
+
+        Attributes:
+            is_filter       a boolean True if a filter has been provided
+        """
+        sites = self.sites.get_sites_with_data() if is_filter else self.sites.get_sites()
+        sites = [site for site in sites if self.get_after_id(site) is not None]
+        queries = dict((site, self.get_queries(site, self.get_query, is_filter)) for site in sites)
+
+        self.writer = Writer.get_writer(self.output_format)
+        self.writer.write_header()
+        if self.page['page_size'] is not None:
+            results = dict((site, []) for site in sites)
+            self.sites.query_sites(queries, lambda site, lines: self.keep_page(results[site],
+                                                                               self.select_downtimes(lines)))
+            cursors = {}
+            for site in sites:
+                results[site], cursors[site] = self.get_page(results[site])
+                if self.sort is not None:
+                    results[site].sort(key=self._sort_keys[self.sort])
+            self.write_downtimes(self._merge_downtimes(sites, results))
+            self.writer.write_cursor(cursors)
+        elif self.sort is not None:
+            spools = dict((site, RowSpool(self._sort_keys[self.sort])) for site in sites)
+            self.sites.query_sites(queries, lambda site, lines: spools[site].add(self.select_downtimes(lines)))
+            self.write_downtimes(self._merge_downtimes(sites, spools))
+        else:
+            self.sites.query_sites(queries, lambda site, lines: self.write_downtimes(
+                (site, line) for line in self.select_downtimes(lines)))
+        self.writer.close()
+
+    def write_downtimes(self, downtimes):
+        """
+        This method passes downtimes to the writer.
+
+        Attributes:
+            downtimes       an iterable of tuples (site name, line)
+        """
+        for site, line in downtimes:
+            self.writer.write_row(self.get_row(site, line))
+
+    def get_queries(self, site, query_func, is_filter=True, objs=None):
+        """
+        This method returns the queries of a single site. The objects of the
+        site are combined to one query per chunk.
+
+        Attributes:
+            site            a string with the site name
+            query_func      a reference to a method creating the query
+            is_filter       a boolean True if the objects have to be filtered
+            objs            optional a list of objects, by default all objects
+                            of the site
+
+        Return:
+            list            a list of query strings
+        """
+        if not is_filter:
+            return [query_func(site=site)]
+        if objs is None:
+            objs = list(self.sites.sites[site].get_monitoring_objects())
+        queries = []
+        for objs in self._chunks(objs):
+            self.logger.debug('Querying %d objects on site %s', len(objs), site)
+            queries.append(query_func(objs, site))
+        return queries
+
+    def _merge_downtimes(self, sites, results):
+        """
+        This is a generator method. It yields the downtimes of each site in the
+        order of the sort key. The sites get merged with a heap, which holds one
+        line per site.
+
+        Attributes:
+            sites           a list of site names in the order of the output
+            results         a dictionary with the site name as key and the
+                            downtimes sorted by the sort key as value
+
+        Return:
+            site            a string with the site name
+            line            a list with the columns of a downtime
+        """
+        streams = []
+        for rank, site in enumerate(sites):
+            if self.sort is None:
+                for line in results[site]:
+                    yield site, line
+            else:
+                streams.append(self._decorate(site, rank, results[site]))
+        for key, rank, site, line in heapq.merge(*streams):
+            yield site, line
+
+    def _decorate(self, site, rank, data):
+        """
+        This is a generator method. It prefixes each line with its sort key and
+        the rank of the site, which is needed by heapq.merge.
+
+        Attributes:
+            site            a string with the site name
+            rank            the position of the site, used for equal sort keys
+            data            an iterable of sorted lists
+
+        Return:
+            tuple           (sort key, rank, site, line)
+        """
+        key_func = self._sort_keys[self.sort]
+        for line in data:
+            yield key_func(line), rank, site, line
+
+    def summarize_downtimes(self, is_filter=True):
+        """
+        This method lets livestatus count the downtimes and passes a summary per
+        site, author and grouped ID to the writer. Livestatus groups the result
+        by author and comment, the groups with the same grouped ID get merged
+        here. All sites are queried concurrently.
+
+        Attributes:
+            is_filter       a boolean True if a filter has been provided
+        """
+        summary = {}
+        sites = self.sites.get_sites_with_data() if is_filter else self.sites.get_sites()
+        results = self.sites.query_sites(dict((site, self.get_queries(site, self.get_summary_query, is_filter))
+                                              for site in sites))
+        for site in sites:
+            self.merge_summary(summary, site, results[site])
+
+        self.writer = Writer.get_writer(self.output_format, summary=True)
+        self.writer.write_header()
+        for key in sorted(summary.keys()):
+            site, author, groupedid = key
+            count, start_time, end_time = summary[key]
+            self.writer.write_row({
+                'site': site,
+                'author': author,
+                'groupedid': groupedid,
+                'count': count,
+                'start_time': start_time if self.epoch else str(datetime.fromtimestamp(start_time)),
+                'end_time': end_time if self.epoch else str(datetime.fromtimestamp(end_time)),
+            })
+        self.writer.close()
+
+    def get_summary_query(self, obj=None, site=None):
+        """
+        A getter method to retrieve the Stats query for the summary. It uses the
+        same filters as get_query.
+
+        Attributes:
+            obj             a object reference of Host or Service or a list of
+                            them, which get combined in one query
+            site            not used but needed
+
+        Return:
+            string          a string with the query for livestatus
+        """
+        query = Query()
+        a_filter = self.get_downtime_filter()
+        return query.get_query(self.auth, self._table, self._summary_columns, self._object_filter(a_filter, obj),
+                               self._summary_stats, any_of=self._object_filters(obj))
+
+    def merge_summary(self, summary, site, data):
+        """
+        This method merges the Stats result of a site into the summary.
+
+        Attributes:
+            summary         a dictionary with (site, author, groupedid) as key and
+                            [count, start_time, end_time] as value
+            site            a string with the site name
+            data            a list of lists returned from livestatus
+        """
+        for author, comment, count, start_time, end_time in data:
+            if count == 0:
+                continue
+            cmt, groupedid = self.split_comment(comment)
+            key = (site, author, groupedid)
+            if key in summary:
+                summary[key][0] += count
+                summary[key][1] = min(summary[key][1], start_time)
+                summary[key][2] = max(summary[key][2], end_time)
+            else:
+                summary[key] = [count, start_time, end_time]
+
+    def get_objects(self):
+        """
+        This method returns the monitoring objects of all sites with data.
+
+        Return:
+            dictionary      the site name as key and the list of objects as
+                            value
+        """
+        return dict((site, list(self.sites.sites[site].get_monitoring_objects()))
+                    for site in self.sites.get_sites_with_data())
+
+    def add_downtimes(self, objects=None):
+        """
+        This method sends commands to livestatus to add the requested downtimes.
+        The commands of a site are sent in batches, all sites concurrently. With
+        a coordinator the sites which have a worker are passed to it.
+
+        Attributes:
+            objects         optional a dictionary with the site name as key
+                            and a list of objects as value, by default all
+                            objects of all sites
+
+        Return:
+            dictionary      the site name as key and the number of sent
+                            commands as value, a site which failed or whose
+                            worker failed is missing
+        """
+        objects = objects if objects is not None else self.get_objects()
+        if self.coordinator is not None:
+            return self.coordinator.execute('add', objects, self, self.add_local_downtimes)
+        return self.add_local_downtimes(objects)
+
+    def add_local_downtimes(self, objects):
+        """
+        This method creates the commands to add the downtimes of the objects
+        and sends them to the livestatus sockets of the sites.
+
+        Attributes:
+            objects         a dictionary with the site name as key and a list
+                            of objects as value
+
+        Return:
+            dictionary      the site name as key and the number of sent
+                            commands as value, a failed site is missing
+        """
+        cmd = Command(self.sites.stats)
+        commands = {}
+        failed = {}
+        for site in objects.keys():
+            self.sites.stats.record_objects(site, len(objects[site]))
+            commands[site] = [cmd.add_downtime(obj, self) for obj in objects[site]]
+        self.sites.send_commands(commands, failed)
+        return self.count_commands(commands, failed)
+
+    def remove_downtimes(self, objects=None):
+        """
+        This method sends commands to livestatus to evaluate the downtime id and
+        creates and executes the command to remove the specified downtime. The
+        downtimes of the objects of a site are queried with combined queries
+        and the commands are sent in batches, all sites concurrently. With a
+        coordinator the sites which have a worker are passed to it.
+
+        Attributes:
+            objects         optional a dictionary with the site name as key
+                            and a list of objects as value, by default all
+                            objects of all sites
+
+        Return:
+            dictionary      the site name as key and the number of sent
+                            commands as value, a site which failed or whose
+                            worker failed is missing
+        """
+        objects = objects if objects is not None else self.get_objects()
+        if self.coordinator is not None:
+            return self.coordinator.execute('remove', objects, self, self.remove_local_downtimes)
+        return self.remove_local_downtimes(objects)
+
+    def remove_local_downtimes(self, objects):
+        """
+        This method queries the downtimes of the objects on the livestatus
+        sockets of the sites and sends the commands to remove them.
+
+        Attributes:
+            objects         a dictionary with the site name as key and a list
+                            of objects as value
+
+        Return:
+            dictionary      the site name as key and the number of sent
+                            commands as value, a failed site is missing
+        """
+        cmd = Command(self.sites.stats)
+        commands = {}
+        failed = {}
+        keys = {}
+        for site in objects.keys():
+            keys[site] = {}
+            self.sites.stats.record_objects(site, len(objects[site]))
+            for obj in objects[site]:
+                a_filter = obj.get_filter_for_downtime()
+                keys[site][(a_filter['host_name'], a_filter['service_description'])] = obj
+            commands[site] = []
+
+        # the commands are created while the answers are received, so the
+        # downtimes are never kept
+        self.sites.query_sites(dict((site, self.get_queries(site, self.get_query, objs=objects[site]))
+                                    for site in objects.keys()),
+                               lambda site, lines: self.collect_removals(cmd, keys[site], commands[site], lines),
+                               failed)
+        # the removals of a site whose query failed may be incomplete
+        self.sites.send_commands(dict((site, commands[site]) for site in commands.keys() if site not in failed),
+                                 failed)
+        return self.count_commands(commands, failed)
+
+    def count_commands(self, commands, failed):
+        """
+        This method counts the sent commands of the sites which have not
+        failed.
+
+        Attributes:
+            commands        a dictionary with the site name as key and the
+                            list of commands as value
+            failed          a dictionary with the failed sites as key
+
+        Return:
+            dictionary      the site name as key and the number of sent
+                            commands as value, a failed site is missing
+        """
+        counts = dict((site, len(commands[site])) for site in commands.keys() if site not in failed)
+        self.command_count += sum(counts.values())
+        return counts
+
+    def merge_result(self, result):
+        """
+        This method merges the result of a job executed by a worker, the
+        recorded counters, the messages and the number of sent commands.
+
+        Attributes:
+            result          a dictionary with the keys commands, messages and
+                            stats returned by a worker
+
+        Return:
+            dictionary      the site name as key and the number of sent
+                            commands as value
+        """
+        self.sites.stats.merge(result['stats'])
+        for message in result['messages']:
+            self.report(message)
+        self.command_count += sum(result['commands'].values())
+        return result['commands']
+
+    def run_chunks(self, operation, checkpoint, chunk_size=1000, progress=None):
+        """
+        This method adds or removes the downtimes in chunks. The objects of
+        each site are sorted and split in chunks of chunk_size objects, one
+        chunk of every site is executed concurrently and recorded in the
+        checkpoint afterwards. The chunks already recorded in the checkpoint
+        are skipped, so an interrupted run can be continued. The chunks of a
+        site whose worker failed are not recorded, the site is skipped for the
+        remaining chunks and the run is not finished. Without a checkpoint the
+        run can't be continued.
+
+        Raises:
+            ValueError
+            IOError
+
+        Attributes:
+            operation       either add or remove
+            checkpoint      a reference to a Checkpoint object or None
+            chunk_size      the number of objects per chunk and site
+            progress        optional a reference to a Progress object
+        """
+        chunks = {}
+        digests = {}
+        for site, objs in self.get_objects().items():
+            objs = sorted(objs, key=lambda obj: obj.get_as_a_string())
+            digests[site] = hashlib.sha1("\n".join(obj.get_as_a_string() for obj in objs)).hexdigest()
+            chunks[site] = [objs[idx:idx + chunk_size] for idx in range(0, len(objs), chunk_size)]
+        done = {}
+        if checkpoint is not None:
+            checkpoint.set_sites(digests)
+            done = dict((site, checkpoint.get_done(site)) for site in chunks.keys())
+
+        if progress is not None:
+            progress.start(sum(len(chunk) for site in chunks.keys() for chunk in chunks[site]),
+                           sum(len(chunks[site][index]) for site in done.keys() for index in done[site]))
+        failed = set()
+        for index in range(max([len(chunks[site]) for site in chunks.keys()] or [0])):
+            batch = dict((site, chunks[site][index]) for site in chunks.keys()
+                         if index < len(chunks[site]) and index not in done.get(site, set()) and
+                         site not in failed)
+            if not batch:
+                continue
+            if operation == 'add':
+                commands = self.add_downtimes(batch)
+            else:
+                commands = self.remove_downtimes(batch)
+            for site in batch.keys():
+                if site not in commands:
+                    failed.add(site)
+                elif checkpoint is not None:
+                    checkpoint.record(site, index, len(batch[site]), commands[site])
+            if progress is not None:
+                progress.update(sum(len(batch[site]) for site in batch.keys() if site in commands))
+        if failed:
+            raise IOError('The chunks of the sites {0} have not been sent completely'.format(
+                ", ".join(sorted(failed))))
+        if checkpoint is not None:
+            checkpoint.finish()
+
+    def collect_removals(self, cmd, objects, commands, lines):
+        """
+        This method creates the commands to remove the received downtimes of
+        the selected objects.
+
+        Attributes:
+            cmd             a reference to a Command object
+            objects         a dictionary with (host name, service description)
+                            as key and the object as value
+            commands        the list to append the commands to
+            lines           the received downtimes
+        """
+        for line in lines:
+            # See if comment contains the groupedid
+            if self.get_groupedid() in line[8] and (line[2], line[3]) in objects:
+                commands.append(cmd.remove_downtime(objects[(line[2], line[3])], line[0], self))
+
+    def select_downtimes(self, data):
+        """
+        This method returns all retrieved data if groupedid is None or the lines
+        where the groupedid of the downtime matches the groupedid passed to the
+        programm.
+
+        Attributes:
+            data            a list of lists returnd from livestatus
+
+        Return:
+            list            a list of lists with the matching downtimes
+        """
+        if self.get_groupedid() is None:
+            return data
+        return [line for line in data if self.get_groupedid() in line[8].encode('utf-8')]
+
+    def keep_page(self, heap, lines):
+        """
+        This method keeps the received downtimes of a site with the lowest ids,
+        one more than the page size, so it is known if there is a next page.
+
+        Attributes:
+            heap            a list used as heap of tuples (negative id, line)
+            lines           a list of lists with received downtimes
+        """
+        for line in lines:
+            if len(heap) <= self.page['page_size']:
+                heapq.heappush(heap, (-line[0], line))
+            elif line[0] < -heap[0][0]:
+                heapq.heapreplace(heap, (-line[0], line))
+
+    def get_page(self, heap):
+        """
+        This method returns the first page of the downtimes of a site ordered
+        by id and the cursor for the next page. The cursor is None if there are
+        no more downtimes on the site.
+
+        Attributes:
+            heap            the heap filled by keep_page
+
+        Return:
+            list            a list of lists with at most page_size downtimes
+            int             the downtime id to continue with or None
+        """
+        data = [line for key, line in sorted(heap, reverse=True)]
+        if len(data) > self.page['page_size']:
+            return data[:self.page['page_size']], data[self.page['page_size'] - 1][0]
+        return data, None
+
+    def get_after_id(self, site):
+        """
+        Getter method, returns the downtime id after which the listing of the
+        site continues. If the cursor names other sites only, the site is
+        finished and None gets returned.
+
+        Attributes:
+            site            a string with the site name
+
+        Return:
+            int             the downtime id or None
+        """
+        if self.page['after_id'] is None:
+            return 0
+        if '' in self.page['after_id']:
+            return self.page['after_id']['']
+        return self.page['after_id'].get(site)
+
+    def set_page(self, after_id=None, page_size=None):
+        """
+        Setter method, retrieves the cursor and the page size for listing
+        downtimes.
+
+        Attributes:
+            after_id        a dictionary with the site name as key and the last
+                            listed downtime id as value, the key '' applies to
+                            all sites
+            page_size       the maximum number of downtimes per site
+        """
+        self.page['after_id'] = after_id
+        self.page['page_size'] = page_size
+        if page_size is not None and after_id is None:
+            self.page['after_id'] = {'': 0}
+        self.logger.debug('Setting page to: %s', self.page)
+
+    def get_row(self, site, line):
+        """
+        This method converts a line of the downtimes table into a dictionary
+        with the site name and the grouped ID as separate fields.
+
+        Attributes:
+            site            a string with the site name
+            line            a list with the columns of a downtime
+
+        Return:
+            dictionary      the downtime with the field names of Writer as keys
+        """
+        cmt, groupedid = self.split_comment(line[8])
+        return {
+            'site': site,
+            'id': line[0],
+            'groupedid': groupedid,
+            'author': line[1],
+            'host_name': line[2],
+            'service_description': line[3],
+            'start_time': line[4] if self.epoch else str(datetime.fromtimestamp(line[4])),
+            'end_time': line[5] if self.epoch else str(datetime.fromtimestamp(line[5])),
+            'duration': line[6],
+            'fixed': line[7],
+            'comment': cmt,
+        }
+
+    @staticmethod
+    def split_comment(comment):
+        """
+        This method splits the comment of a downtime into the descriptive text
+        and the grouped ID which has been appended by this program.
+
+        Attributes:
+            comment         the comment string of a downtime
+
+        Return:
+            string          the descriptive text of the comment
+            string          the grouped ID digits or an empty string
+        """
+        cmt, sep, groupedid = comment.partition(' ID:')
+        return cmt, groupedid
+
+    def get_author(self):
+        """
+        Getter method, returns the author.
+
+        Return:
+            string          a string with the user name
+        """
+        return self.author
+
+    def report(self, message):
+        """
+        This method prints a message about an added or removed downtime. If the
+        messages get collected, the message is stored instead. Nothing is
+        reported in quiet mode or if the limit of lines is reached.
+
+        Attributes:
+            message         a string with the message
+        """
+        if self.get_quiet() or self.line_count >= self.get_limit():
+            return
+        self.line_count += 1
+        if self.messages is None:
+            print message
+        else:
+            self.messages.append(message)
+
+    def collect_messages(self):
+        """
+        This method enables the collection of the reported messages instead of
+        printing them.
+        """
+        self.messages = []
+
+    def get_messages(self):
+        """
+        Getter method, returns the collected messages.
+
+        Return:
+            list            a list of message strings
+        """
+        return self.messages if self.messages is not None else []
+
+    def get_object_count(self):
+        """
+        Getter method, returns the number of hosts and services found on all
+        sites.
+
+        Return:
+            int             the number of monitoring objects
+        """
+        return sum(len(self.sites.sites[site].monitoring_objects) for site in self.sites.get_sites_with_data())
+
+    def get_command_count(self):
+        """
+        Getter method, returns the number of commands sent to livestatus.
+
+        Return:
+            int             the number of commands
+        """
+        return self.command_count
+
+    def set_coordinator(self, coordinator):
+        """
+        Setter method, passes the add and remove jobs of the sites which have
+        a worker to the given coordinator.
+
+        Attributes:
+            coordinator     a reference to a Coordinator object or None
+        """
+        self.coordinator = coordinator
+
+    def get_quiet(self):
+        """
+        Getter method, returns True if quiet mode is enabled. Has no impact on list
+        operation.
+
+        Return:
+            boolean         True if quiet mode is enabled else False
+        """
+        return self.quiet
+
+    def get_limit(self):
+        """
+        Getter method, returns the line limit of lines to be printed.
+
+        Return:
+            int             the number of lines to be printed
+        """
+        return self.limit
+
+    def get_comment(self):
+        """
+        Getter method, returns the descriptive text for the reason of the downtime.
+
+        Return:
+            string          the comment string
+        """
+        return self.comment
+
+    def get_groupedid(self):
+        """
+        Getter method, returns the downtime groupedid.
+
+        Return:
+            string          the groupedid string
+        """
+        return self.groupedid
+
+    def get_now(self):
+        """
+        Getter method, returns the actual date if available for the downtime
+        object.
+
+        Return:
+            int             the date as Unix epoch time
+        """
+        return self.dates['now'] if self.dates['now'] else None
+
+    def get_start_time(self):
+        """
+        Getter method, returns the start time for the downtime object.
+
+        Return:
+            int             the date as Unix epoch time or None
+        """
+        return self.dates['start_time'] if self.dates['start_time'] else None
+
+    def set_start_time(self, start_time):
+        """
+        Setter method, retrieves the start time.
+
+        Attributes:
+            start_time      the start time as Unix epoch time
+        """
+        self.dates['start_time'] = int(start_time)
+        self.logger.debug('Setting downtime start time to: %d', self.dates['start_time'])
 
     def get_end_time(self):
         """
-        Getter method, returns the end time for the downtime object.
+        Getter method, returns the end time for the downtime object.
+
+        Return:
+            int             the date as Unix epoch time or None
+        """
+        return self.dates['end_time'] if self.dates['end_time'] else None
+
+    def set_end_time(self, end_time):
+        """
+        Setter method, retrieves the end time.
+
+        Attributes:
+            end_time        the end time as Unix epoch time
+        """
+        self.dates['end_time'] = int(end_time)
+        self.logger.debug('Setting downtime end time to: %d', self.dates['end_time'])
+
+    def get_duration(self):
+        """
+        Getter method, returns the duration in second for the downtime object.
+
+        Return:
+            int             the time in seconds between the start and end date
+        """
+        return self.dates['duration'] if self.dates['duration'] else None
+
+    def set_duration(self, duration):
+        """
+        Setter method, retrieves the duration of the downtime.
+
+        Attributes:
+            duration        the duration of the downtime in seconds
+        """
+        self.dates['duration'] = int(duration)
+        self.logger.debug('Setting downtime duration to: %d', self.dates['duration'])
+
+    def get_window(self, obj):
+        """
+        This method returns the window of the downtime for an object, which is
+        the own window of the object if it has one, else the window of the
+        downtime.
+
+        Attributes:
+            obj             a object reference of Host or Service
+
+        Return:
+            int             the start time as Unix epoch time
+            int             the end time as Unix epoch time
+            int             the duration in seconds
+            string          the comment
+        """
+        window = obj.get_window()
+        if window is None:
+            return self.get_start_time(), self.get_end_time(), self.get_duration(), self.get_comment()
+        return window['start_time'], window['end_time'], window['duration'], window['comment']
+
+    def calculate_end_time(self):
+        """
+        If start time and duration is given, this method calculates the end time.
+        """
+        self.set_end_time(self.get_start_time() + self.get_duration())
+        self.logger.debug('Calculating downtime end time')
+
+    def calculate_duration(self):
+        """
+        If start time and end time is given, this method calculates the duration.
+        :return:
+        """
+        self.set_duration(self.get_end_time() - self.get_start_time())
+        self.logger.debug('Calculating downtime duration')
+
+    def validate_dates(self):
+        """
+        This method validates the given dates on plausibility.
+
+        Return:
+            boolean         True if date is valid else False
+        """
+        self.logger.debug('Validate downtime: %d < %d and %d > %d', self.get_start_time(),
+                          self.get_end_time(), self.get_end_time(), self.get_now())
+        return True if self.get_start_time() < self.get_end_time() and self.get_end_time() > self.get_now() else False
+
+
+class Checkpoint(object):
+    """
+    The Checkpoint class records the progress of an add or remove run in a
+    JSON Lines file. The first line holds the arguments of the run, the
+    second the digest of the objects of each site and each following line a
+    chunk which has been sent. The file is removed when the run has finished,
+    an interrupted run can be continued with its run ID. The files of runs
+    which have not been continued within max_age seconds get removed.
+    """
+    logger = None
+    run_id_format = re.compile(r'^\d{8}-\d{6}-\d+$')
+    max_age = 7 * 86400
+
+    def __init__(self, run_id=None, path=None):
+        """
+        The constructor method for class Checkpoint.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            run_id          the ID of the run, by default a new one
+            path            the directory of the checkpoint files
+        """
+        if Checkpoint.logger is None:
+            Checkpoint.logger = setup_logging(self.__class__.__name__)
+        # the run ID becomes a file name, which gets removed at the end
+        if run_id is not None and not self.run_id_format.match(run_id):
+            raise ValueError('Invalid run ID: {0!r}'.format(run_id))
+        self.run_id = run_id or '{0}-{1}'.format(datetime.now().strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.path = os.path.join(path or path_runs, self.run_id + '.jsonl')
+        self.spec = None
+        self.digests = None
+        self.done = {}
+
+    def get_run_id(self):
+        """
+        Getter method, returns the run ID.
+
+        Return:
+            string          the run ID
+        """
+        return self.run_id
+
+    def get_spec(self):
+        """
+        Getter method, returns the arguments of the run.
+
+        Return:
+            dictionary      the arguments of the run
+        """
+        return self.spec
+
+    def get_done(self, site):
+        """
+        Getter method, returns the indexes of the sent chunks of a site.
+
+        Attributes:
+            site            the site name
+
+        Return:
+            set             the indexes of the chunks
+        """
+        return self.done.get(site, set())
+
+    def create(self, spec):
+        """
+        This method creates the checkpoint file of a new run.
+
+        Attributes:
+            spec            a dictionary with the arguments of the run
+        """
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self.cleanup()
+        self.spec = spec
+        self.append({'run_id': self.run_id, 'spec': spec})
+        self.logger.debug('Created checkpoint %s', self.path)
+
+    def load(self):
+        """
+        This method reads the checkpoint file of an interrupted run.
+
+        Raises:
+            ValueError
+
+        Return:
+            dictionary      the arguments of the run
+        """
+        if not os.path.exists(self.path):
+            raise ValueError('No interrupted run with the ID {0} found'.format(self.run_id))
+        with open(self.path) as stream:
+            for line in stream:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete
+                    continue
+                if 'spec' in entry:
+                    self.spec = entry['spec']
+                elif 'digests' in entry:
+                    self.digests = entry['digests']
+                elif 'chunk' in entry:
+                    self.done.setdefault(entry['site'], set()).add(entry['chunk'])
+        if self.spec is None:
+            raise ValueError('The checkpoint {0} is invalid'.format(self.path))
+        return self.spec
+
+    def set_sites(self, digests):
+        """
+        This method records the digests of the objects of each site. If the
+        run is continued, the digests have to match the recorded ones, else
+        the chunks would contain other objects.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            digests         a dictionary with the site name as key and the
+                            digest of the sorted objects as value
+        """
+        if self.digests is None:
+            self.digests = digests
+            self.append({'digests': digests})
+        elif self.digests != digests:
+            changed = sorted(site for site in set(self.digests.keys() + digests.keys())
+                             if self.digests.get(site) != digests.get(site))
+            raise ValueError('The objects of the sites {0} have changed since the run {1} started'.format(
+                ", ".join(changed), self.run_id))
+
+    def record(self, site, index, objects, commands):
+        """
+        This method records a sent chunk.
+
+        Attributes:
+            site            the site name
+            index           the index of the chunk
+            objects         the number of objects of the chunk
+            commands        the number of sent commands
+        """
+        self.done.setdefault(site, set()).add(index)
+        self.append({'site': site, 'chunk': index, 'objects': objects, 'commands': commands, 'time': time.time()})
+
+    def append(self, entry):
+        """
+        This method appends a line to the checkpoint file and waits until it
+        has been written to the disk.
+
+        Attributes:
+            entry           a dictionary
+        """
+        with open(self.path, 'a') as stream:
+            stream.write(json.dumps(entry, sort_keys=True) + "\n")
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    def finish(self):
+        """
+        This method removes the checkpoint file of the finished run.
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.logger.debug('Run %s finished', self.run_id)
+
+    def cleanup(self):
+        """
+        This method removes the checkpoint files of abandoned runs, which have
+        not been written for max_age seconds.
+        """
+        directory = os.path.dirname(self.path)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not name.endswith('.jsonl') or not self.run_id_format.match(name[:-6]):
+                continue
+            try:
+                if os.path.getmtime(path) + self.max_age < time.time():
+                    os.unlink(path)
+                    self.logger.info('Removed the checkpoint of the abandoned run %s', name[:-6])
+            except OSError, e:
+                self.logger.debug('Cannot remove the checkpoint %s: %s', path, e)
+
+
+class Progress(object):
+    """
+    The Progress class writes the number of done objects, the throughput and
+    the estimated remaining time of a chunked run, at most every interval
+    seconds.
+    """
+    interval = 1.0
+
+    def __init__(self, run_id, stream=None):
+        """
+        The constructor method for class Progress.
+
+        Attributes:
+            run_id          the ID of the run or None if it has no checkpoint
+            stream          the file object to write to, default stderr
+        """
+        self.run_id = run_id
+        self.stream = stream if stream is not None else sys.stderr
+        self.total = 0
+        self.done = 0
+        self.sent = 0
+        self.started = None
+        self.written = 0
+
+    def start(self, total, done=0):
+        """
+        This method starts the measurement.
+
+        Attributes:
+            total           the number of objects of the run
+            done            the number of objects done by a previous attempt
+        """
+        self.total = total
+        self.done = done
+        self.started = time.time()
+        if self.run_id is None:
+            self.stream.write("Run: {0} objects, an interrupted run can not be continued\n".format(total))
+        else:
+            self.stream.write("Run {0}: {1} objects, {2} done, continue an interrupted run with --resume {0}\n".format(
+                self.run_id, total, done))
+
+    def update(self, objects):
+        """
+        This method adds the objects of a sent chunk and writes the progress.
+
+        Attributes:
+            objects         the number of objects of the chunk
+        """
+        self.done += objects
+        self.sent += objects
+        now = time.time()
+        if now - self.written < self.interval and self.done < self.total:
+            return
+        self.written = now
+        rate = self.sent / max(now - self.started, 0.001)
+        self.stream.write("Progress: {0}/{1} objects ({2:.1f}%), {3:.0f} objects/s, ETA {4}\n".format(
+            self.done, self.total, 100.0 * self.done / max(self.total, 1), rate,
+            timedelta(seconds=int((self.total - self.done) / rate)) if rate else 'unknown'))
+        self.stream.flush()
+
+
+class RowSpool(object):
+    """
+    The RowSpool class sorts the rows of a site, which are received in pieces.
+    At most rows_per_run rows are kept in memory, more rows get written to
+    temporary files as sorted runs of JSON Lines. The runs are merged while
+    they are read, so only one row per run is kept.
+    """
+    rows_per_run = 10000
+
+    def __init__(self, key):
+        """
+        The constructor method for class RowSpool.
+
+        Attributes:
+            key             a function, which returns the sort key of a row
+        """
+        self.key = key
+        self.rows = []
+        self.runs = []
+
+    def add(self, rows):
+        """
+        This method adds received rows, a full run gets written to a file.
+
+        Attributes:
+            rows            a list of rows
+        """
+        self.rows.extend(rows)
+        if len(self.rows) >= self.rows_per_run:
+            self.rows.sort(key=self.key)
+            run = tempfile.TemporaryFile()
+            for row in self.rows:
+                run.write(json.dumps(row) + "\n")
+            run.seek(0)
+            self.runs.append(run)
+            self.rows = []
+
+    def __iter__(self):
+        """
+        This is a generator method. It yields all added rows in the order of
+        the sort key and closes the runs.
+
+        Return:
+            list            a row
+        """
+        self.rows.sort(key=self.key)
+        streams = [((self.key(row), row) for row in (json.loads(line) for line in run)) for run in self.runs]
+        streams.append((self.key(row), row) for row in self.rows)
+        try:
+            for key, row in heapq.merge(*streams):
+                yield row
+        finally:
+            for run in self.runs:
+                run.close()
+            self.runs = []
+            self.rows = []
+
+
+class Writer(object):
+    """
+    The Writer class is the abstract base class of the output formats for
+    listed downtimes. Every row is written to the stream as soon as it is
+    received, nothing is collected before it gets written. A subclass has to
+    implement write_row.
+    """
+    __metaclass__ = abc.ABCMeta
+    _fields = ['site', 'id', 'groupedid', 'author', 'host_name', 'service_description',
+               'start_time', 'end_time', 'duration', 'fixed', 'comment']
+
+    _summary_fields = ['site', 'author', 'groupedid', 'count', 'start_time', 'end_time']
+
+    def __init__(self, stream=None, fields=None):
+        """
+        The constructor method for class Writer.
+
+        Attributes:
+            stream          a file like object, default is stdout
+            fields          the field names of a row, default is _fields
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.fields = fields if fields is not None else self._fields
+
+    @staticmethod
+    def get_writer(output_format, stream=None, summary=False):
+        """
+        This method returns a writer object for the requested output format.
+
+        Attributes:
+            output_format   one of table, jsonl, csv or collect
+            stream          a file like object, default is stdout
+            summary         True if the rows are summaries of downtimes
+
+        Return:
+            obj             a object reference of a Writer subclass
+        """
+        fields = Writer._summary_fields if summary else None
+        if output_format == 'collect':
+            return CollectWriter(stream, fields)
+        elif output_format == 'jsonl':
+            return JsonLinesWriter(stream, fields)
+        elif output_format == 'csv':
+            return CsvWriter(stream, fields)
+        elif summary:
+            return SummaryTableWriter(stream, fields)
+        else:
+            return TableWriter(stream)
+
+    @staticmethod
+    def encode(value):
+        """
+        This method encodes unicode strings to utf-8, every other value is
+        returned unchanged.
+
+        Attributes:
+            value           the value to encode
+
+        Return:
+            string          the utf-8 encoded value
+        """
+        return value.encode('utf-8') if isinstance(value, unicode) else value
+
+    def write_header(self):
+        """
+        This method writes the header if the format has one.
+        """
+        pass
+
+    @abc.abstractmethod
+    def write_row(self, row):
+        """
+        This abstract method writes a single row in the format of the
+        subclass.
+
+        Attributes:
+            row             a dictionary with the keys of fields
+        """
+
+    def write_cursor(self, cursors):
+        """
+        This method writes the cursor to continue the listing with the next
+        page, if any site has more downtimes.
+
+        Attributes:
+            cursors         a dictionary with the site name as key and the last
+                            listed downtime id or None as value
+        """
+        if self.get_cursor_string(cursors):
+            self.stream.write("Next page: --after-id {0}\n".format(self.get_cursor_string(cursors)))
+
+    @staticmethod
+    def get_cursor_string(cursors):
+        """
+        This method returns the cursor as argument string for --after-id.
+
+        Attributes:
+            cursors         a dictionary with the site name as key and the last
+                            listed downtime id or None as value
+
+        Return:
+            string          the cursor, e.g. site1:123,site2:456
+        """
+        return ",".join("{0}:{1}".format(site, cursors[site]) for site in sorted(cursors.keys())
+                        if cursors[site] is not None)
+
+    def close(self):
+        """
+        This method flushes the stream.
+        """
+        self.stream.flush()
+
+
+class TableWriter(Writer):
+    """
+    The TableWriter class writes the downtimes as fixed width text table.
+    """
+    _lables = ['ID', 'Grouped ID', 'Author', 'Hostname', 'Servicename', 'Start', 'End', 'Duration', 'Fixed', 'Comment']
+
+    def write_header(self):
+        """
+        This method writes the labels of the table.
+        """
+        self.stream.write("{0:8s} {1:12} {2:10s} {3:20s} {4:40s} {5:19s} {6:19s} {7:10s} {8:6s} {9:80s}\n".format(
+            *self._lables))
+
+    def write_row(self, row):
+        """
+        This method writes a single row as line of the table.
+
+        Attributes:
+            row             a dictionary with the keys of _fields
+        """
+        self.stream.write("{0:8d} {1:12s} {2:10s} {3:20s} {4:40s} {5:19s} {6:19s} {7:10d} {8:6d} {9:80s}\n".format(
+            row['id'],
+            self.encode(row['groupedid']),
+            self.encode(row['author'][:10]),
+            self.encode(row['host_name'][:20]),
+            self.encode(row['service_description'][:40]),
+            str(row['start_time']),
+            str(row['end_time']),
+            row['duration'],
+            row['fixed'],
+            self.encode(row['comment'])
+        ))
+
+
+class SummaryTableWriter(TableWriter):
+    """
+    The SummaryTableWriter class writes the summary of downtimes as fixed width
+    text table.
+    """
+    _lables = ['Site', 'Author', 'Grouped ID', 'Count', 'First start', 'Last end']
+
+    def write_header(self):
+        """
+        This method writes the labels of the table.
+        """
+        self.stream.write("{0:20s} {1:10s} {2:12s} {3:8s} {4:19s} {5:19s}\n".format(*self._lables))
+
+    def write_row(self, row):
+        """
+        This method writes a single summary as line of the table.
+
+        Attributes:
+            row             a dictionary with the keys of _summary_fields
+        """
+        self.stream.write("{0:20s} {1:10s} {2:12s} {3:8d} {4:19s} {5:19s}\n".format(
+            self.encode(row['site'][:20]),
+            self.encode(row['author'][:10]),
+            self.encode(row['groupedid']),
+            row['count'],
+            str(row['start_time']),
+            str(row['end_time'])
+        ))
+
+
+class JsonLinesWriter(Writer):
+    """
+    The JsonLinesWriter class writes each downtime as JSON object on its own
+    line.
+    """
+
+    def write_row(self, row):
+        """
+        This method writes a single row as JSON object.
+
+        Attributes:
+            row             a dictionary with the keys of _fields
+        """
+        self.stream.write(json.dumps(row, sort_keys=True) + "\n")
+
+    def write_cursor(self, cursors):
+        """
+        This method writes the cursor of each site as JSON object. A site
+        without more downtimes has the cursor null.
+
+        Attributes:
+            cursors         a dictionary with the site name as key and the last
+                            listed downtime id or None as value
+        """
+        self.stream.write(json.dumps({'cursor': cursors}, sort_keys=True) + "\n")
+
+
+class CsvWriter(Writer):
+    """
+    The CsvWriter class writes the downtimes as comma separated values with
+    the field names as header.
+    """
+
+    def __init__(self, stream=None, fields=None):
+        """
+        The constructor method for class CsvWriter.
+
+        Attributes:
+            stream          a file like object, default is stdout
+            fields          the field names of a row, default is _fields
+        """
+        super(CsvWriter, self).__init__(stream, fields)
+        self.csv = csv.writer(self.stream)
+
+    def write_header(self):
+        """
+        This method writes the field names.
+        """
+        self.csv.writerow(self.fields)
+
+    def write_row(self, row):
+        """
+        This method writes a single row as csv record.
+
+        Attributes:
+            row             a dictionary with the keys of fields
+        """
+        self.csv.writerow([self.encode(row[field]) for field in self.fields])
+
+    def write_cursor(self, cursors):
+        """
+        This method writes the cursor to stderr, so the csv output stays
+        parseable.
+
+        Attributes:
+            cursors         a dictionary with the site name as key and the last
+                            listed downtime id or None as value
+        """
+        if self.get_cursor_string(cursors):
+            sys.stderr.write("Next page: --after-id {0}\n".format(self.get_cursor_string(cursors)))
+
+
+class CollectWriter(Writer):
+    """
+    The CollectWriter class keeps the rows and the cursor instead of writing
+    them, it is used to return listed downtimes by the Api class.
+    """
+
+    def __init__(self, stream=None, fields=None):
+        """
+        The constructor method for class CollectWriter.
+
+        Attributes:
+            stream          not used but needed
+            fields          the field names of a row, default is _fields
+        """
+        super(CollectWriter, self).__init__(stream, fields)
+        self.rows = []
+        self.cursors = None
+
+    def write_row(self, row):
+        """
+        This method keeps a single row.
+
+        Attributes:
+            row             a dictionary with the keys of fields
+        """
+        self.rows.append(row)
+
+    def write_cursor(self, cursors):
+        """
+        This method keeps the cursor.
+
+        Attributes:
+            cursors         a dictionary with the site name as key and the last
+                            listed downtime id or None as value
+        """
+        self.cursors = cursors
+
+    def close(self):
+        """
+        Nothing to flush.
+        """
+        pass
+
+
+class Query(object):
+    """
+    The Query class receives a bunch of arguments and creates a livestatus query
+    out of it.
+    """
+    logger = None
+
+    def __init__(self):
+        """
+        The constructor method for class Query.
+        """
+        if Query.logger is None:
+            Query.logger = setup_logging(self.__class__.__name__)
+
+    def get_query(self, auth, table, columns, is_filter=None, stats=None, limit=None, any_of=None):
+        """
+        The method creates a query string with all the received arguments. Then
+        it returns the created query.
+
+        Attributes:
+            auth            the user credentials
+            table           the name of the livestatus table
+            columns         the requested columns, if stats are given the
+                            result gets grouped by these columns
+            is_filter       optional a dictionary of key value pairs to form the
+                            Filter. The key has to be a valid column name of the
+                            queried table
+            stats           optional a list of Stats expressions
+            limit           optional the maximum number of returned lines
+            any_of          optional a list of filter dictionaries, a line
+                            matches if it matches one of them
+
+        Return:
+            string          the query string for livestatus
+        """
+        query = "GET {0}{1}{2}{3}{4}".format(
+            table,
+            self._columns(columns),
+            self._filter(is_filter),
+            self._any_of(any_of),
+            self._stats(stats))
+        if limit is not None:
+            query += "\nLimit: " + str(limit)
+        if auth.get_authorization():
+            query += "\nAuthUser: " + auth.get_user()
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Livestatus query: %s', ';'.join(query.split('\n')))
+        return query
+
+    @staticmethod
+    def _columns(columns):
+        """
+        If the passed columns list is not empty, this method will join all
+        columns with a space and return it.
+
+        Attributes:
+            columns         the requested columns
+
+        Return:
+            string          a query string for livestatus
+        """
+        if columns is None:
+            return ""
+        else:
+            return "\nColumns: " + " ".join(columns)
+
+    @staticmethod
+    def _stats(stats):
+        """
+        If the passed stats list is not empty, this method will create a Stats
+        header for each expression.
+
+        Attributes:
+            stats           a list of Stats expressions, e.g. 'min start_time'
+
+        Return:
+            string          a query string for livestatus
+        """
+        if stats is None:
+            return ""
+        else:
+            return "".join("\nStats: " + stat for stat in stats)
+
+    @staticmethod
+    def _any_of(filters):
+        """
+        This method combines a list of filters with Or, the filters of each
+        dictionary are combined with And.
+
+        Attributes:
+            filters         a list of dictionaries of column: requested value
+                            pairs
+
+        Return:
+            string          a query string for livestatus
+        """
+        if not filters:
+            return ""
+        string = ""
+        for a_filter in filters:
+            string += Query._filter(a_filter)
+            if len(a_filter) > 1:
+                string += "\nAnd: " + str(len(a_filter))
+        if len(filters) > 1:
+            string += "\nOr: " + str(len(filters))
+        return string
+
+    @staticmethod
+    def _filter(a_filter):
+        """
+        This methode creates a query filter. The key has to be one of the column
+        names of the queried table. A value of type tuple holds an operator and
+        the value, e.g. ('~', 'ID:000000000123'), every other value is compared
+        for equality.
+
+        Attributes:
+            a_filter        a dictionary of column: requested value pairs
+        """
+        string = ""
+
+        if a_filter is None:
+            return string
+
+        for key, value in a_filter.items():
+            if type(value) == list:
+                for v in value:
+                    string += "\nFilter: " + key + " = " + v
+                if len(value) > 1:
+                    string += "\nOr: " + str(len(value))
+            elif type(value) == tuple:
+                string += "\nFilter: " + key + " " + value[0] + " " + value[1]
+            else:
+                string += "\nFilter: " + key + " = " + value
+        return string
+
+
+class Command(object):
+    """
+    This class creates mainly a livestatus command which can be passed to the
+    command method of the livestatus module.
+    """
+    logger = None
+
+    def __init__(self, stats=None):
+        """
+        The constructor method for class Command.
+
+        Attributes:
+            stats       a reference to a Stats object to count the created
+                        commands or None
+        """
+        if Command.logger is None:
+            Command.logger = setup_logging(self.__class__.__name__)
+        self.stats = stats
+
+    def print_details(self, obj, downtime, operation):
+        """
+        This method prints details which hosts and services have been set or removed
+        from downtime.
+
+        Attributes:
+            obj         a reference to a object of class Host or Service
+            downtime    a reference to the downtime object
+            operation   either add or remove
+        """
+        if not downtime.get_quiet():
+            dict = obj.get_filter_for_downtime()
+            if dict['service_description'] != '':
+                string = "host {0} and service {1}".format(dict['host_name'], dict['service_description'])
+            else:
+                string = "host {0}".format(dict['host_name'])
+
+            if operation == 'add':
+                start_time, end_time, duration, comment = downtime.get_window(obj)
+                downtime.report("Adding downtime with the grouped id {0} for {1} from {2} for a duration of {3} seconds untill {4} created by {5}.".format(
+                    downtime.get_groupedid(),
+                    string,
+                    str(datetime.fromtimestamp(start_time)),
+                    str(duration),
+                    str(datetime.fromtimestamp(end_time)),
+                    downtime.get_author()))
+            else:
+                downtime.report("Removing downtime with the grouped id {0} for {1} created by {2}.".format(
+                    downtime.get_groupedid(),
+                    string,
+                    downtime.get_author()))
+
+    def add_downtime(self, obj, downtime):
+        """
+        The method creates a command string with the settings of the passed
+        object references to add a downtime for a Host or Service object. The
+        own window of the object overrides the window of the downtime.
+
+        Attributes:
+            obj         a reference to a object of class Host or Service
+            downtime    a reference to the downtime object
+
+        Return:
+            string      the created livestatus command string
+        """
+        start_time, end_time, duration, comment = downtime.get_window(obj)
+        command = "[" + str(downtime.get_now()) + "] "
+        command += obj.get_downtime_operation('schedule') + ";"
+        command += obj.get_as_a_string() + ";"
+        command += str(start_time) + ";"
+        command += str(end_time) + ";1;0;"
+        command += str(duration) + ";"
+        command += downtime.get_author() + ";"
+        command += comment + " "
+        command += downtime.get_groupedid() + "\n"
+        self.logger.debug('Livestatus command: COMMAND %s', command)
+        self.print_details(obj, downtime, 'add')
+        if self.stats is not None:
+            self.stats.record_command('add')
+
+        return command
+
+    def remove_downtime(self, obj, dtid, downtime):
+        """
+        The method creates a command string with the settings of the passed
+        object references to remove a downtime for a Host or Service object.
+
+        Attribute:
+            obj         a reference to a object of class Host or Service
+            data        a list reference with informations to a specific object
+                        where data[0][0] has the needed downtime id
+            downtime    a reference to the downtime object
+
+        Return:
+            string      the created livestatus command string
+        """
+        command = "[{0}] {1};{2}\n".format(
+            str(downtime.get_now()),
+            obj.get_downtime_operation('remove'),
+            str(dtid))
+        self.logger.debug('Livestatus command: COMMAND %s', command)
+        self.print_details(obj, downtime, 'remove')
+        if self.stats is not None:
+            self.stats.record_command('remove')
+
+        return command
+
+
+class Auth(object):
+    """
+    This class holds the user credentials.
+    """
+    logger = None
+
+    def __init__(self, user, secret, authorization, author=None):
+        """
+        The constructor method for class Auth.
+        """
+        if Auth.logger is None:
+            Auth.logger = setup_logging(self.__class__.__name__)
+        self.user = user
+        self.secret = secret
+        self.authorization = authorization
+
+        if self.get_authorization():
+            self.author = author
+        else:
+            self.author = user
+
+    def get_author(self):
+        """
+        Getter method for author.
+
+        Return:
+            string      the author name
+        """
+        return self.author
+
+    def get_user(self):
+        """
+        Getter method for user.
+
+        Return:
+            string      the user name
+        """
+        return self.user
+
+    def get_secret(self):
+        """
+        Getter method for secret.
+
+        Return:
+            string      the user secret
+        """
+        return self.secret
+
+    def get_authorization(self):
+        """
+        Getter method that returns if AuthUser shall be considered.
+
+        Return:
+            boolean     True if it is enabled else False
+        """
+        return self.authorization
+
+
+class Job(object):
+    """
+    The Job class holds a structured add, remove or list request for the Api
+    class. Its attributes are named like the command line arguments, so the
+    same validation functions can be used.
+    """
+    logger = None
+
+    def __init__(self, operation, groupedid=None, host=None, service=None, hostgroup=None, servicegroup=None,
+                 exclusive=False, comment='Maintenance', start_time=None, end_time=None, duration=7200,
+                 author=None, quiet=False, limit=100, ignore=False, epoch=False, sort=None, after_id=None,
+                 page_size=None, summary=False, created_by=None, since=None, until=None):
+        """
+        The constructor method for class Job.
+
+        Raises:
+            ArgumentTypeError
+
+        Attributes:
+            operation       one of add, remove or list
+            groupedid       the grouped ID as integer or string of digits, only
+                            optional for list with ignore
+            host            a host name or a list of host names
+            service         a service name or a list of service names, needs host
+            hostgroup       the name of a hostgroup
+            servicegroup    the name of a servicegroup
+            exclusive       if set, services will not included in downtime
+            comment         a descriptive comment for the downtime
+            start_time      the start time as Unix epoch time or string in the
+                            format dd-mm-yyyy HH:MM, default is now
+            end_time        the end time as Unix epoch time or string in the
+                            format dd-mm-yyyy HH:MM, overrides duration
+            duration        the duration of the downtime in seconds
+            author          the Check_MK user name, only used with AuthUser
+            quiet           no messages about added or removed downtimes
+            limit           limit the messages to a given amount of lines
+            ignore          list the downtimes without grouped ID
+            epoch           list the times in epoch instead of date and time
+            sort            sort the listed downtimes by id, start, end or host
+            after_id        list after the given id or cursor (see --after-id)
+            page_size       list at most the given number of downtimes per site
+            summary         count the listed downtimes instead of listing them
+            created_by      list only downtimes created by the given author
+            since           list only downtimes ending after this time
+            until           list only downtimes starting before this time
+        """
+        if Job.logger is None:
+            Job.logger = setup_logging(self.__class__.__name__)
+        self.operation = operation
+        self.groupedid = validate_groupedid(str(groupedid)) if groupedid is not None else None
+        self.host = self._join(host)
+        self.service = self._join(service)
+        self.hostgroup = self._join(hostgroup)
+        self.servicegroup = self._join(servicegroup)
+        self.exclusive = exclusive
+        self.ignore = ignore
+        self.comment = comment
+        self.start_time = self._epoch(start_time)
+        self.end_time = self._epoch(end_time)
+        self.duration = int(duration)
+        self.author = author
+        self.quiet = quiet
+        self.limit = limit
+        self.epoch = epoch
+        self.sort = sort
+        self.after_id = validate_after_id(str(after_id)) if isinstance(after_id, (basestring, int)) else after_id
+        self.page_size = page_size
+        self.summary = summary
+        self.created_by = created_by
+        self.since = self._epoch(since)
+        self.until = self._epoch(until)
+        self.logger.debug('Constructor call passed arguments operation: %s, groupedid: %s',
+                          self.operation, self.groupedid)
+
+    @staticmethod
+    def _join(value):
+        """
+        This method joins a list of names with a comma like it is expected on
+        the command line.
+
+        Attributes:
+            value           a string, a list of strings or None
+
+        Return:
+            string          a comma separated string or None
+        """
+        if isinstance(value, (list, tuple)):
+            return ",".join(value)
+        return value
+
+    @staticmethod
+    def _epoch(value):
+        """
+        This method converts a date and time string to Unix epoch time.
+
+        Attributes:
+            value           Unix epoch time, a string dd-mm-yyyy HH:MM or None
+
+        Return:
+            int             the Unix epoch time or None
+        """
+        if isinstance(value, basestring):
+            return validate_datetime(value)
+        return value
+
+    def apply_dates(self, downtime):
+        """
+        This method stores the start time, end time and duration in the passed
+        downtime object and validates them.
+
+        Attributes:
+            downtime        a reference to a downtime object
+
+        Return:
+            boolean         True if the dates are valid else False
+        """
+        downtime.set_start_time(self.start_time if self.start_time is not None else downtime.get_now())
+        if self.end_time is not None:
+            downtime.set_end_time(self.end_time)
+            downtime.calculate_duration()
+        else:
+            downtime.set_duration(self.duration)
+            downtime.calculate_end_time()
+        return downtime.validate_dates()
+
+
+class Api(object):
+    """
+    The Api class allows to add and remove downtimes without starting the
+    program for each request. The sites get discovered once and the
+    connections are shared by all executed jobs.
+    """
+    logger = None
+
+    def __init__(self, auth, path='/omd/sites', url='http://localhost/cmk_master/check_mk/', persist=False,
+                 stats=None):
+        """
+        The constructor method for class Api.
+
+        Attributes:
+            auth            the user credentials
+            path            the base path (OMD_ROOT)
+            url             the url
+            persist         keep the livestatus connections open between jobs
+            stats           a reference to a Stats object to record the phases
+                            of all jobs or None
+        """
+        if Api.logger is None:
+            Api.logger = setup_logging(self.__class__.__name__)
+        self.auth = auth
+        self.sites = Sites(auth, path, url, persist, stats)
+
+    def get_auth(self, job):
+        """
+        This method returns the user credentials for a job. The author of the
+        job is only considered if AuthUser is enabled.
+
+        Attributes:
+            job             a reference to a Job object
+
+        Return:
+            obj             a reference to an Auth object
+        """
+        if job.author is None:
+            return self.auth
+        return Auth(self.auth.get_user(), self.auth.get_secret(), self.auth.get_authorization(), job.author)
+
+    def execute(self, job, site=None, stats=None):
+        """
+        This method executes a job and returns the result.
+
+        Raises:
+            ValueError
+            IOError
+
+        Attributes:
+            job             a reference to a Job object
+            site            optional the name of the only site to consider
+            stats           optional a Stats object to record this and the
+                            following jobs
+
+        Return:
+            dictionary      the result with the keys operation, groupedid,
+                            objects, commands and messages, for list the keys
+                            operation, groupedid, summary, rows and cursor
+        """
+        auth = self.get_auth(job)
+        self.sites.reset()
+        if stats is not None:
+            self.sites.set_stats(stats)
+        if site is not None:
+            self.sites.select([site])
+        if job.groupedid is None and not (job.operation == 'list' and job.ignore):
+            raise ValueError('Invalid job, a grouped ID is needed for operation {0}'.format(job.operation))
+        if job.operation == 'list':
+            return self.list(job, auth)
+        downtime = Downtime(self.sites, auth, job.comment, job.groupedid, quiet=job.quiet, limit=job.limit)
+        downtime.collect_messages()
+        if job.operation == 'add' and not job.apply_dates(downtime):
+            raise ValueError('Error in date and time arguments')
+        if job.operation not in ['add', 'remove'] or not validate_args(job, self.sites, auth):
+            raise ValueError('Invalid job, operation {0} with the given selection is not possible'.format(
+                job.operation))
+
+        objects = downtime.get_objects()
+        if job.operation == 'add':
+            commands = downtime.add_downtimes(objects)
+        else:
+            commands = downtime.remove_downtimes(objects)
+        failed = sorted(site for site in objects.keys() if site not in commands)
+        if failed:
+            raise IOError('The commands of the sites {0} have not been sent'.format(", ".join(failed)))
+
+        self.logger.debug('Job %s %s sent %d commands', job.operation, job.groupedid, downtime.get_command_count())
+        return {
+            'operation': job.operation,
+            'groupedid': job.groupedid,
+            'objects': downtime.get_object_count(),
+            'commands': downtime.get_command_count(),
+            'messages': downtime.get_messages(),
+        }
+
+    def list(self, job, auth):
+        """
+        This method lists or summarizes the downtimes of a list job and returns
+        the rows instead of writing them.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            job             a reference to a Job object
+            auth            the user credentials of the job
+
+        Return:
+            dictionary      the result with the keys operation, groupedid,
+                            summary, rows and cursor
+        """
+        downtime = Downtime(self.sites, auth, job.comment, job.groupedid, job.epoch, output_format='collect',
+                            sort=job.sort)
+        downtime.set_list_filter(job.created_by, job.since, job.until)
+        downtime.set_page(job.after_id, job.page_size)
+        if not validate_args(job, self.sites, auth):
+            raise ValueError('Invalid job, operation list with the given selection is not possible')
+
+        is_filter = len(self.sites.get_sites_with_data()) > 0
+        if job.summary:
+            downtime.summarize_downtimes(is_filter)
+        else:
+            downtime.list_downtimes(is_filter)
+        return {
+            'operation': job.operation,
+            'groupedid': job.groupedid,
+            'summary': job.summary,
+            'rows': downtime.writer.rows,
+            'cursor': downtime.writer.cursors,
+        }
+
+
+class Daemon(object):
+    """
+    The Daemon class executes the requests of clients with an Api object, so
+    the sites, the livestatus connections and the loaded modules stay in
+    memory. The requests are JSON objects with the arguments of class Job, one
+    per line, each gets answered by one line with the result. The requests are
+    executed one at a time.
+    """
+    logger = None
+
+    def __init__(self, api, path):
+        """
+        The constructor method for class Daemon.
+
+        Attributes:
+            api             a reference to an Api object
+            path            the path of the Unix socket
+        """
+        if Daemon.logger is None:
+            Daemon.logger = setup_logging(self.__class__.__name__)
+        self.api = api
+        self.path = path
+        self.lock = threading.Lock()
+
+    def serve(self):
+        """
+        This method listens on the Unix socket until the program gets
+        interrupted or terminated. Only the owner is allowed to connect to the
+        socket, it is created with these permissions, so there is no moment
+        in which others could connect.
+
+        Return:
+            boolean         False if the path is in use and the daemon could
+                            not be started
+        """
+        if not self.remove_stale_socket():
+            return False
+        umask = os.umask(0077)
+        try:
+            server = DaemonServer(self.path, DaemonRequestHandler)
+        finally:
+            os.umask(umask)
+        server.daemon = self
+        signal.signal(signal.SIGTERM, self.terminate)
+        self.logger.info('Listening on %s', self.path)
+        try:
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.path)
+        return True
+
+    def remove_stale_socket(self):
+        """
+        This method removes a socket left behind by a daemon which is gone. A
+        path which is not a socket or a socket another daemon still listens
+        on is kept.
+
+        Return:
+            boolean         True if the path is free now
+        """
+        try:
+            mode = os.lstat(self.path).st_mode
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return True
+            self.logger.critical('Cannot use %s: %s', self.path, e)
+            return False
+        if not stat.S_ISSOCK(mode):
+            self.logger.critical('Cannot use %s, it exists and is not a socket', self.path)
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except socket.error, e:
+            if e.errno != errno.ECONNREFUSED:
+                self.logger.critical('Cannot use %s: %s', self.path, e)
+                return False
+            self.logger.info('Removing the stale socket %s', self.path)
+            os.unlink(self.path)
+            return True
+        finally:
+            sock.close()
+        self.logger.critical('Cannot use %s, another daemon is listening on it', self.path)
+        return False
+
+    @staticmethod
+    def terminate(signum, frame):
+        """
+        This method is the handler of SIGTERM, it stops the daemon.
+
+        Raises:
+            SystemExit
+        """
+        raise SystemExit(0)
+
+    def handle(self, line):
+        """
+        This method executes a single request.
+
+        Attributes:
+            line            a string with the request as JSON object
+
+        Return:
+            dictionary      the result of the job with the status ok or the
+                            status error and the error message
+        """
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Request is not a JSON object')
+            with self.lock:
+                result = self.api.execute(Job(**request))
+            result['status'] = 'ok'
+        except (ValueError, TypeError, argparse.ArgumentTypeError, MKLivestatusException), e:
+            self.logger.error('Request failed: %s', e)
+            result = {'status': 'error', 'error': str(e)}
+        except Exception, e:
+            # the client gets an answer instead of a closed connection
+            self.logger.exception('Request failed unexpectedly: %s', e)
+            result = {'status': 'error', 'error': str(e)}
+        return result
+
+
+class DaemonServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    The DaemonServer class accepts the connections of the clients, each one is
+    handled by its own thread.
+    """
+    daemon_threads = True
+
+
+class DaemonRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    The DaemonRequestHandler class reads the requests of a client connection
+    and writes the results.
+    """
+
+    def handle(self):
+        """
+        This method answers each request line until the client closes the
+        connection.
+        """
+        for line in iter(self.rfile.readline, ''):
+            if line.strip():
+                self.wfile.write(json.dumps(self.server.daemon.handle(line), sort_keys=True) + "\n")
+                self.wfile.flush()
+
+
+class Client(object):
+    """
+    The Client class sends requests to a running daemon.
+    """
+    logger = None
+
+    def __init__(self, path):
+        """
+        The constructor method for class Client.
+
+        Attributes:
+            path            the path of the Unix socket of the daemon
+        """
+        if Client.logger is None:
+            Client.logger = setup_logging(self.__class__.__name__)
+        self.path = path
+
+    def request(self, request):
+        """
+        This method sends a request and returns the result.
+
+        Raises:
+            socket.error
+
+        Attributes:
+            request         a dictionary with the arguments of class Job
+
+        Return:
+            dictionary      the result returned by the daemon
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(json.dumps(request) + "\n")
+            stream = sock.makefile('r')
+            line = stream.readline()
+            stream.close()
+        finally:
+            sock.close()
+        if not line:
+            raise socket.error('Connection closed by daemon')
+        return json.loads(line)
+
+
+class WorkerChannel(object):
+    """
+    The WorkerChannel class sends and receives the messages between a
+    coordinator and a worker. Both ends exchange a random nonce first, then
+    each message is a JSON object on its own line, preceded by its HMAC-SHA256
+    over both nonces, the number of the message and the JSON object. The key
+    is shared by the coordinator and all workers, so a message with a wrong
+    key, a replayed message or a message of another connection is rejected.
+    The messages are authenticated, not encrypted.
+    """
+    logger = None
+    max_line = 64 * 1024 * 1024
+
+    def __init__(self, rfile, wfile, key):
+        """
+        The constructor method for class WorkerChannel.
+
+        Attributes:
+            rfile           the file object to read the messages from
+            wfile           the file object to write the messages to
+            key             the shared key
+        """
+        if WorkerChannel.logger is None:
+            WorkerChannel.logger = setup_logging(self.__class__.__name__)
+        self.rfile = rfile
+        self.wfile = wfile
+        self.key = key
+        self.nonce = None
+        self.sequence = 0
+
+    @classmethod
+    def load_key(cls, path):
+        """
+        This method reads the shared key from a file, it should be readable by
+        the owner only.
+
+        Raises:
+            IOError
+            ValueError
+
+        Attributes:
+            path            the file name of the key
+
+        Return:
+            string          the key
+        """
+        if cls.logger is None:
+            cls.logger = setup_logging(cls.__name__)
+        with open(path) as stream:
+            key = stream.read().strip()
+        if not key:
+            raise ValueError('The worker key {0} is empty'.format(path))
+        if os.stat(path).st_mode & 0077:
+            cls.logger.warning('The worker key %s is readable by others', path)
+        return key
+
+    def handshake(self, initiator):
+        """
+        This method exchanges the nonces, the coordinator sends its nonce
+        first.
+
+        Raises:
+            socket.error
+            ValueError
+
+        Attributes:
+            initiator       True for the coordinator, False for the worker
+        """
+        own = binascii.hexlify(os.urandom(16))
+        if initiator:
+            self._write({'nonce': own})
+            self.nonce = own + self._read_nonce()
+        else:
+            self.nonce = self._read_nonce() + own
+            self._write({'nonce': own})
+
+    def _read_nonce(self):
+        """
+        This method reads the nonce of the other end.
+
+        Raises:
+            socket.error
+            ValueError
+
+        Return:
+            string          the nonce as hexadecimal string
+        """
+        line = self.rfile.readline(1024)
+        if not line:
+            raise socket.error('Connection closed during the handshake')
+        nonce = json.loads(line).get('nonce')
+        if not isinstance(nonce, basestring) or not re.match('^[0-9a-f]{32}$', nonce):
+            raise ValueError('Invalid handshake')
+        return str(nonce)
+
+    def _write(self, message, signed=False):
+        """
+        This method writes a message as line.
+
+        Attributes:
+            message         a dictionary
+            signed          prepend the signature of the message
+        """
+        body = json.dumps(message, sort_keys=True)
+        self.wfile.write((self.get_signature(body) + " " if signed else "") + body + "\n")
+        self.wfile.flush()
+
+    def get_signature(self, body):
+        """
+        This method returns the signature of the next message.
+
+        Attributes:
+            body            the message as JSON string
+
+        Return:
+            string          the HMAC-SHA256 as hexadecimal string
+        """
+        return hmac.new(self.key, "{0}\n{1}\n{2}".format(self.nonce, self.sequence, body),
+                        hashlib.sha256).hexdigest()
+
+    def send(self, message):
+        """
+        This method sends a signed message.
+
+        Raises:
+            socket.error
+
+        Attributes:
+            message         a dictionary
+        """
+        self._write(message, signed=True)
+        self.sequence += 1
+
+    def receive(self):
+        """
+        This method receives a signed message.
+
+        Raises:
+            socket.error
+            ValueError
 
         Return:
-            int             the date as Unix epoch time or None
-        """
-        return self.dates['end_time'] if self.dates['end_time'] else None
+            dictionary      the message or None if the other end has closed
+                            the connection
+        """
+        line = self.rfile.readline(self.max_line)
+        if not line:
+            return None
+        if not line.endswith("\n"):
+            raise ValueError('Message is incomplete or too long')
+        signature, sep, body = line.rstrip("\n").partition(" ")
+        if not hmac.compare_digest(signature, self.get_signature(body)):
+            raise ValueError('Invalid signature')
+        self.sequence += 1
+        message = json.loads(body)
+        if not isinstance(message, dict):
+            raise ValueError('Message is not a JSON object')
+        return message
+
+
+class Worker(object):
+    """
+    The Worker class runs next to the sites and executes the add and remove
+    jobs of a coordinator against the livestatus Unix sockets of the local
+    sites, so only one request per job crosses the network. The jobs are
+    executed one at a time.
+    """
+    logger = None
 
-    def set_end_time(self, end_time):
+    def __init__(self, sites, key, address):
         """
-        Setter method, retrieves the end time.
+        The constructor method for class Worker.
 
         Attributes:
-            end_time        the end time as Unix epoch time
+            sites           a reference to a Sites object with the local sites
+            key             the key shared with the coordinator
+            address         a tuple (host, port) to listen on
         """
-        self.dates['end_time'] = int(end_time)
-        self.logger.debug('Setting downtime end time to: %d', self.dates['end_time'])
+        if Worker.logger is None:
+            Worker.logger = setup_logging(self.__class__.__name__)
+        self.sites = sites
+        self.key = key
+        self.address = address
+        self.lock = threading.Lock()
 
-    def get_duration(self):
+    def serve(self):
         """
-        Getter method, returns the duration in second for the downtime object.
+        This method listens on the TCP address until the program gets
+        interrupted or terminated.
+        """
+        server = WorkerServer(self.address, WorkerRequestHandler)
+        server.worker = self
+        signal.signal(signal.SIGTERM, Daemon.terminate)
+        self.logger.info('Listening on %s:%d for the sites %s', server.server_address[0], server.server_address[1],
+                         ", ".join(sorted(self.sites.sites.keys())))
+        try:
+            server.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            server.server_close()
+
+    def handle(self, request):
+        """
+        This method executes a single job.
+
+        Attributes:
+            request         a dictionary created by Coordinator.get_request
 
         Return:
-            int             the time in seconds between the start and end date
+            dictionary      the result of the job with the status ok or the
+                            status error and the error message
         """
-        return self.dates['duration'] if self.dates['duration'] else None
+        try:
+            with self.lock:
+                result = self.execute(request)
+            result['status'] = 'ok'
+        except (KeyError, ValueError, TypeError, IOError, MKLivestatusException), e:
+            self.logger.error('Job failed: %s', e)
+            result = {'status': 'error', 'error': str(e)}
+        return result
 
-    def set_duration(self, duration):
+    def execute(self, request):
         """
-        Setter method, retrieves the duration of the downtime.
+        This method adds or removes the downtimes of the objects of a job.
+
+        Raises:
+            KeyError
+            ValueError
 
         Attributes:
-            duration        the duration of the downtime in seconds
+            request         a dictionary created by Coordinator.get_request
+
+        Return:
+            dictionary      the number of sent commands per site, the messages
+                            and the report of the recorded counters
+        """
+        if request['operation'] not in ['add', 'remove']:
+            raise ValueError('Invalid job, operation {0} is not possible'.format(request['operation']))
+        unknown = sorted(site for site in request['objects'].keys() if site not in self.sites.sites)
+        if unknown:
+            raise ValueError('The sites {0} are not served by this worker'.format(", ".join(unknown)))
+        stats = Stats()
+        self.sites.reset()
+        self.sites.set_stats(stats)
+        # the same credentials as Api.get_auth, so AuthUser is the user of
+        # the coordinator, the secret is not needed by a worker
+        auth = Auth(request['user'], None, request['authorization'], request['author'])
+        downtime = Downtime(self.sites, auth, request['comment'], request['groupedid'], quiet=request['quiet'],
+                            limit=request['limit'])
+        downtime.collect_messages()
+        if request['start_time'] is not None:
+            downtime.set_start_time(request['start_time'])
+            downtime.set_end_time(request['end_time'])
+            downtime.set_duration(request['duration'])
+        objects = dict((site, [self.get_object(auth, *values) for values in request['objects'][site]])
+                       for site in request['objects'].keys())
+        if request['operation'] == 'add':
+            commands = downtime.add_downtimes(objects)
+        else:
+            commands = downtime.remove_downtimes(objects)
+        self.logger.debug('Job %s %s sent %d commands', request['operation'], request['groupedid'],
+                          downtime.get_command_count())
+        return {
+            'commands': commands,
+            'messages': downtime.get_messages(),
+            'stats': stats.get_report(),
+        }
+
+    @staticmethod
+    def get_object(auth, host_name, service_name, window):
         """
-        self.dates['duration'] = int(duration)
-        self.logger.debug('Setting downtime duration to: %d', self.dates['duration'])
+        This method creates the object of a host or service of a job.
 
-    def calculate_end_time(self):
+        Attributes:
+            auth            the user credentials of the job
+            host_name       the name of the host
+            service_name    the name of the service or None for the host
+            window          the own downtime window of the object or None
+
+        Return:
+            obj             a reference to a Host or Service object
         """
-        If start time and duration is given, this method calculates the end time.
+        obj = Host(host_name, auth) if service_name is None else Service(host_name, service_name, auth)
+        obj.set_window(window)
+        return obj
+
+
+class WorkerServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    The WorkerServer class accepts the connections of the coordinators, each
+    one is handled by its own thread.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class WorkerRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    The WorkerRequestHandler class authenticates the messages of a coordinator
+    connection and answers each job.
+    """
+
+    def handle(self):
         """
-        self.set_end_time(self.get_start_time() + self.get_duration())
-        self.logger.debug('Calculating downtime end time')
+        This method answers each job until the coordinator closes the
+        connection, a connection with an invalid message gets closed.
+        """
+        worker = self.server.worker
+        channel = WorkerChannel(self.rfile, self.wfile, worker.key)
+        try:
+            channel.handshake(False)
+            for request in iter(channel.receive, None):
+                channel.send(worker.handle(request))
+        except (socket.error, ValueError), e:
+            worker.logger.warning('Connection from %s closed: %s', self.client_address[0], e)
 
-    def calculate_duration(self):
+
+class Coordinator(object):
+    """
+    The Coordinator class passes the add and remove jobs of the sites which
+    have a worker to it, instead of sending the queries and commands to the
+    livestatus sockets of these sites. The objects are partitioned by worker,
+    all workers get their job concurrently while the sites without a worker
+    are executed directly, then the results are merged.
+    """
+    logger = None
+
+    def __init__(self, workers, key, timeout=600):
         """
-        If start time and end time is given, this method calculates the duration.
-        :return:
+        The constructor method for class Coordinator.
+
+        Attributes:
+            workers         a dictionary with the site name as key and the
+                            tuple (host, port) of its worker as value
+            key             the key shared with the workers
+            timeout         the maximum time in seconds to wait for a worker
         """
-        self.set_duration(self.get_start_time() - self.get_end_time())
-        self.logger.debug('Calculating downtime duration')
+        if Coordinator.logger is None:
+            Coordinator.logger = setup_logging(self.__class__.__name__)
+        self.workers = workers
+        self.key = key
+        self.timeout = timeout
 
-    def validate_dates(self):
+    def execute(self, operation, objects, downtime, local):
         """
-        This method validates the given dates on plausibility.
+        This method adds or removes the downtimes of the objects, the sites
+        with a worker by their worker, the others by the passed function. A
+        failed worker is logged and its sites are marked as unreachable. If
+        the passed function fails, it is logged and the sites without worker
+        are missing in the result, the results of the workers are kept.
+
+        Attributes:
+            operation       either add or remove
+            objects         a dictionary with the site name as key and a list
+                            of objects as value
+            downtime        a reference to the downtime object
+            local           a function, which takes the objects of the sites
+                            without worker and returns the number of sent
+                            commands per site
 
         Return:
-            boolean         True if date is valid else False
+            dictionary      the site name as key and the number of sent
+                            commands as value, a site which failed or whose
+                            worker failed is missing
+        """
+        jobs = {}
+        direct = {}
+        for site in objects.keys():
+            if site in self.workers:
+                jobs.setdefault(self.workers[site], {})[site] = objects[site]
+            else:
+                direct[site] = objects[site]
+
+        results = {}
+        threads = [threading.Thread(target=self.request, args=(address, self.get_request(operation, jobs[address],
+                                                                                          downtime), results))
+                   for address in jobs.keys()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        commands = {}
+        try:
+            if direct:
+                commands = local(direct)
+        except Exception, e:
+            self.logger.error('The sites %s without worker failed: %s', ", ".join(sorted(direct.keys())), e)
+        finally:
+            for thread in threads:
+                thread.join()
+
+        for address in sorted(jobs.keys()):
+            result = results[address]
+            if result.get('status') == 'ok':
+                commands.update(downtime.merge_result(result))
+                continue
+            self.logger.error('Worker %s:%d of the sites %s failed: %s', address[0], address[1],
+                              ", ".join(sorted(jobs[address].keys())), result.get('error'))
+            for site in jobs[address].keys():
+                downtime.sites.stats.record_unreachable(site)
+        return commands
+
+    @staticmethod
+    def get_request(operation, objects, downtime):
         """
-        self.logger.debug('Validate downtime: %d < %d and %d > %d', self.get_start_time(),
-                          self.get_end_time(), self.get_end_time(), self.get_now())
-        return True if self.get_start_time() < self.get_end_time() and self.get_end_time() > self.get_now() else False
+        This method returns the job of a worker.
 
+        Attributes:
+            operation       either add or remove
+            objects         a dictionary with the site name as key and a list
+                            of objects as value
+            downtime        a reference to the downtime object
 
-class Query(object):
+        Return:
+            dictionary      the job
+        """
+        values = {}
+        for site in objects.keys():
+            values[site] = []
+            for obj in objects[site]:
+                a_filter = obj.get_filter_for_downtime()
+                values[site].append([a_filter['host_name'], a_filter['service_description'] or None,
+                                     obj.get_window()])
+        return {
+            'operation': operation,
+            'groupedid': downtime.get_groupedid(),
+            'comment': downtime.get_comment(),
+            'user': downtime.auth.get_user(),
+            'author': downtime.get_author(),
+            'authorization': downtime.auth.get_authorization(),
+            'start_time': downtime.get_start_time(),
+            'end_time': downtime.get_end_time(),
+            'duration': downtime.get_duration(),
+            'quiet': downtime.get_quiet(),
+            'limit': downtime.get_limit(),
+            'objects': values,
+        }
+
+    def request(self, address, request, results):
+        """
+        This method sends a job to a worker and stores its result, a failed
+        request is stored as result with the status error.
+
+        Attributes:
+            address         a tuple (host, port) of the worker
+            request         the job
+            results         a dictionary to store the result with the address
+                            as key
+        """
+        try:
+            sock = socket.create_connection(address, self.timeout)
+            try:
+                channel = WorkerChannel(sock.makefile('r'), sock.makefile('w'), self.key)
+                channel.handshake(True)
+                channel.send(request)
+                result = channel.receive()
+            finally:
+                sock.close()
+            if result is None:
+                raise socket.error('Connection closed by worker')
+        except (socket.error, ValueError), e:
+            result = {'status': 'error', 'error': str(e)}
+        results[address] = result
+
+
+class Rule(object):
     """
-    The Query class receives a bunch of arguments and creates a livestatus query
-    out of it.
+    The Rule class holds a recurring downtime. The downtime starts at the
+    given time on the given weekdays of each week or days of each month and
+    lasts for duration seconds. All other arguments are passed to class Job.
     """
-    # TODO: Combine queries instead of per object querying
     logger = None
+    _weekdays = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
 
-    def __init__(self):
+    def __init__(self, name, every, days, start, duration=7200, **kwargs):
         """
-        The constructor method for class Query.
+        The constructor method for class Rule.
+
+        Raises:
+            ValueError
+
+        Attributes:
+            name            a unique name, used to remember the submitted
+                            downtimes
+            every           either weekly or monthly
+            days            a list of weekdays (mon ... sun) for weekly or of
+                            days of the month (1 ... 31) for monthly, months
+                            without the day are skipped
+            start           the start time of the downtime (format: HH:MM)
+            duration        the duration of the downtime in seconds
+            kwargs          the arguments of class Job, except operation and
+                            the times
         """
-        if Query.logger is None:
-            Query.logger = setup_logging(self.__class__.__name__)
+        if Rule.logger is None:
+            Rule.logger = setup_logging(self.__class__.__name__)
+        self.name = name
+        self.every = every
+        if every == 'weekly':
+            self.days = set(self._weekdays.index(str(day).lower()[:3]) for day in days
+                            if str(day).lower()[:3] in self._weekdays)
+        elif every == 'monthly':
+            self.days = set(int(day) for day in days if 1 <= int(day) <= 31)
+        else:
+            raise ValueError('Rule {0}: every has to be weekly or monthly'.format(name))
+        if not self.days or len(self.days) != len(days):
+            raise ValueError('Rule {0}: invalid days {1}'.format(name, days))
+        self.start = datetime.strptime(start, "%H:%M").time()
+        self.duration = int(duration)
+        self.kwargs = kwargs
+        # create a job once, so invalid arguments are found while loading
+        self.get_job(0)
 
-    def get_query(self, auth, table, columns, is_filter=None):
+    def matches(self, day):
         """
-        The method creates a query string with all the received arguments. Then
-        it returns the created query.
+        This method checks if the downtime takes place on the given day.
 
         Attributes:
-            auth            the user credentials
-            table           the name of the livestatus table
-            columns         the requested columns
-            is_filter       optional a dictionary of key value pairs to form the
-                            Filter. The key has to be a valid column name of the
-                            queried table
+            day             a date object
 
         Return:
-            string          the query string for livestatus
+            boolean         True if the downtime starts on this day else False
         """
-        query = "GET {0}{1}{2}".format(
-            table,
-            self._columns(columns),
-            self._filter(is_filter))
-        if auth.get_authorization():
-            query += "\nAuthUser: " + auth.get_user()
-        self.logger.debug('Livestatus query: %s', ';'.join(query.split('\n')))
-        return query
+        return (day.weekday() if self.every == 'weekly' else day.day) in self.days
 
-    @staticmethod
-    def _columns(columns):
+    def next_window(self, after):
         """
-        If the passed columns list is not empty, this method will join all
-        columns with a space and return it.
+        This method returns the start of the next downtime after the given
+        time.
 
         Attributes:
-            columns         the requested columns
+            after           Unix epoch time
 
         Return:
-            string          a query string for livestatus
+            int             the start of the next downtime as Unix epoch time
         """
-        if columns is None:
-            return ""
-        else:
-            return "\nColumns: " + " ".join(columns)
+        day = datetime.fromtimestamp(after).date()
+        for offset in range(0, 400):
+            if self.matches(day + timedelta(offset)):
+                start = int(datetime.combine(day + timedelta(offset), self.start).strftime('%s'))
+                if start > after:
+                    return start
+        raise ValueError('Rule {0}: no downtime within a year'.format(self.name))
 
-    @staticmethod
-    def _filter(a_filter):
+    def get_job(self, start_time):
         """
-        This methode creates a query filter. The key has to be one of the column
-        names of the queried table.
-        Attributes:
-            a_filter        a dictionary of column: requested value pairs
-        """
-        string = ""
+        This method creates the job to add the downtime starting at the given
+        time.
 
-        if a_filter is None:
-            return string
+        Attributes:
+            start_time      the start as Unix epoch time
 
-        for key, value in a_filter.items():
-            if type(value) == list:
-                for v in value:
-                    string += "\nFilter: " + key + " = " + v
-                if len(value) > 1:
-                    string += "\nOr: " + str(len(value))
-            else:
-                string += "\nFilter: " + key + " = " + value
-        return string
+        Return:
+            obj             a reference to a Job object
+        """
+        return Job('add', start_time=start_time, duration=self.duration, **self.kwargs)
 
 
-class Command(object):
+class Scheduler(object):
     """
-    This class creates mainly a livestatus command which can be passed to the
-    command method of the livestatus module.
+    The Scheduler class submits the downtimes of recurring rules. The next
+    downtime of each rule is kept in a heap ordered by the time it has to be
+    submitted, which is lead seconds before its start. All downtimes that are
+    due are submitted together with one Api object. The start of the last
+    submitted downtime of each rule is stored in the state file, so a restart
+    does not submit it again.
     """
     logger = None
-    line_count = 0
+    _retry_interval = 60
+    _max_sleep = 60
 
-    def __init__(self):
+    def __init__(self, api, rules, state_path, lead=86400, catch_up='running'):
         """
-        The constructor method for class Command.
+        The constructor method for class Scheduler.
+
+        Attributes:
+            api             a reference to an Api object
+            rules           a list of Rule objects
+            state_path      the file name of the state file
+            lead            the downtimes are submitted lead seconds before
+                            they start
+            catch_up        running also submits downtimes, which have been
+                            missed but have not ended yet, skip only submits
+                            downtimes after now
+        """
+        if Scheduler.logger is None:
+            Scheduler.logger = setup_logging(self.__class__.__name__)
+        self.api = api
+        self.rules = rules
+        self.state_path = state_path
+        self.lead = lead
+        self.catch_up = catch_up
+        self.state = self.load_state()
+        self.heap = []
+
+    def load_state(self):
+        """
+        This method reads the state file.
+
+        Return:
+            dictionary      the rule name as key and the start of the last
+                            submitted downtime as value
         """
-        if Command.logger is None:
-            Command.logger = setup_logging(self.__class__.__name__)
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as state_file:
+            return json.load(state_file)
 
-    def print_details(self, obj, downtime, operation):
+    def save_state(self):
         """
-        This method prints details which hosts and services have been set or removed
-        from downtime.
+        This method writes the state file, the old file gets replaced only if
+        the new one has been written completely.
+        """
+        with open(self.state_path + '.tmp', 'w') as state_file:
+            json.dump(self.state, state_file, sort_keys=True)
+        os.rename(self.state_path + '.tmp', self.state_path)
+
+    def initialize(self, now):
+        """
+        This method pushes the next downtime of each rule to the heap, taking
+        the state and the catch up policy into account.
 
         Attributes:
-            obj         a reference to a object of class Host or Service
-            downtime    a reference to the downtime object
-            operation   either add or remove
+            now             the current time as Unix epoch time
         """
-        if not downtime.get_quiet():
-            if Command.line_count < downtime.get_limit():
-                Command.line_count += 1
-                dict = obj.get_filter_for_downtime()
-                if dict['service_description'] != '':
-                    string = "host {0} and service {1}".format(dict['host_name'], dict['service_description'])
-                else:
-                    string = "host {0}".format(dict['host_name'])
-
-                if operation == 'add' and not downtime.get_quiet():
-                    print "Adding downtime with the grouped id {0} for {1} from {2} for a duration of {3} seconds untill {4} created by {5}.".format(
-                        downtime.get_groupedid(),
-                        string,
-                        str(datetime.fromtimestamp(downtime.get_start_time())),
-                        str(downtime.get_duration()),
-                        str(datetime.fromtimestamp(downtime.get_end_time())),
-                        downtime.get_author())
-                else:
-                    print "Removing downtime with the grouped id {0} for {1} created by {2}.".format(
-                        downtime.get_groupedid(),
-                        string,
-                        downtime.get_author())
+        self.heap = []
+        for index, rule in enumerate(self.rules):
+            after = now - rule.duration if self.catch_up == 'running' else now
+            if self.state.get(rule.name) is not None:
+                after = max(after, self.state[rule.name])
+            self.push(index, rule.next_window(after))
 
-    def add_downtime(self, obj, downtime):
+    def push(self, index, start_time, fire_time=None):
         """
-        The method creates a command string with the settings of the passed
-        object references to add a downtime for a Host or Service object.
+        This method pushes a downtime to the heap.
 
         Attributes:
-            obj         a reference to a object of class Host or Service
-            downtime    a reference to the downtime object
+            index           the index of the rule
+            start_time      the start of the downtime as Unix epoch time
+            fire_time       the time to submit, default is lead seconds before
+                            the start
+        """
+        if fire_time is None:
+            fire_time = start_time - self.lead
+        self.logger.debug('Rule %s: downtime at %s gets submitted at %s', self.rules[index].name,
+                          datetime.fromtimestamp(start_time), datetime.fromtimestamp(fire_time))
+        heapq.heappush(self.heap, (fire_time, start_time, index))
+
+    def run(self):
+        """
+        This method submits the due downtimes until the program gets
+        terminated.
+        """
+        signal.signal(signal.SIGTERM, Daemon.terminate)
+        self.initialize(int(time.time()))
+        try:
+            while self.heap:
+                now = int(time.time())
+                self.submit_due(now)
+                time.sleep(max(1, min(self.heap[0][0] - now, self._max_sleep)))
+        except (KeyboardInterrupt, SystemExit):
+            pass
+
+    def submit_due(self, now):
+        """
+        This method submits all downtimes of the heap that are due. A failed
+        downtime is retried later, unless it has ended in the meantime.
+
+        Attributes:
+            now             the current time as Unix epoch time
 
         Return:
-            string      the created livestatus command string
+            int             the number of submitted downtimes
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap))
+        if not due:
+            return 0
+
+        submitted = 0
+        for fire_time, start_time, index in due:
+            rule = self.rules[index]
+            try:
+                result = self.api.execute(rule.get_job(start_time))
+            except (ValueError, argparse.ArgumentTypeError, MKLivestatusException), e:
+                self.logger.error('Rule %s: downtime at %s failed: %s', rule.name,
+                                  datetime.fromtimestamp(start_time), e)
+                if start_time + rule.duration > now + self._retry_interval:
+                    self.push(index, start_time, now + self._retry_interval)
+                    continue
+            else:
+                self.logger.info('Rule %s: downtime at %s submitted for %d objects', rule.name,
+                                 datetime.fromtimestamp(start_time), result['objects'])
+                submitted += 1
+            self.state[rule.name] = start_time
+            self.push(index, rule.next_window(start_time))
+        self.save_state()
+        return submitted
+
+
+class JobQueue(object):
+    """
+    The JobQueue class stores add and remove jobs in a sqlite database, so they
+    survive restarts. Each job is split into one task per site, a task that
+    fails because the site is not reachable is retried with an increasing
+    delay, the other tasks of the site wait as well. Each thread needs its own
+    JobQueue object.
+    """
+    logger = None
+    _retry_base = 10
+    _retry_max = 600
+    _max_attempts = 8
+    _schema = [
+        "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, groupedid TEXT, "
+        "operation TEXT, spec TEXT, state TEXT, created REAL, updated REAL)",
+        "CREATE TABLE IF NOT EXISTS tasks (job_id INTEGER, site TEXT, state TEXT, attempts INTEGER, "
+        "next_try REAL, error TEXT, objects INTEGER, commands INTEGER, owner INTEGER, PRIMARY KEY (job_id, site))",
+        "CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)",
+        "CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, next_try)",
+    ]
+
+    def __init__(self, path):
+        """
+        The constructor method for class JobQueue.
+
+        Attributes:
+            path            the file name of the database
         """
-        command = "[" + str(downtime.get_now()) + "] "
-        command += obj.get_downtime_operation('schedule') + ";"
-        command += obj.get_as_a_string() + ";"
-        command += str(downtime.get_start_time()) + ";"
-        command += str(downtime.get_end_time()) + ";1;0;"
-        command += str(downtime.get_duration()) + ";"
-        command += downtime.get_author() + ";"
-        command += downtime.get_comment() + " "
-        command += downtime.get_groupedid() + "\n"
-        self.logger.debug('Livestatus command: COMMAND %s', command)
-        self.print_details(obj, downtime, 'add')
+        if JobQueue.logger is None:
+            JobQueue.logger = setup_logging(self.__class__.__name__)
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        for statement in self._schema:
+            self.db.execute(statement)
+        # the owner of a running task has been added later
+        if 'owner' not in [row[1] for row in self.db.execute("PRAGMA table_info(tasks)")]:
+            try:
+                self.db.execute("ALTER TABLE tasks ADD COLUMN owner INTEGER")
+            except sqlite3.OperationalError:
+                # added by another process in the meantime
+                pass
+
+    def enqueue(self, spec):
+        """
+        This method adds a job to the queue. The idempotency key of a job
+        consists of the grouped ID, the operation and a digest of all other
+        arguments. If the same job has already been queued and no job with the
+        other operation for the same grouped ID has been queued since, the
+        existing job is returned instead.
 
-        return command
+        Raises:
+            ValueError, TypeError, ArgumentTypeError
 
-    def remove_downtime(self, obj, dtid, downtime):
+        Attributes:
+            spec            a dictionary with the arguments of class Job
+
+        Return:
+            int             the id of the job
+            string          the key of the job
+            boolean         True if the job has been queued before
+        """
+        job = Job(**spec)
+        if job.operation not in ['add', 'remove'] or job.groupedid is None:
+            raise ValueError('Only add and remove jobs with a grouped ID can be queued')
+        key = "{0}:{1}:{2}".format(job.groupedid, job.operation,
+                                   hashlib.sha1(json.dumps(spec, sort_keys=True)).hexdigest()[:12])
+        groupedid, operation = job.groupedid, job.operation
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT id FROM jobs WHERE key = ? AND NOT EXISTS (SELECT 1 FROM jobs AS other "
+                                  "WHERE other.groupedid = jobs.groupedid AND other.operation != jobs.operation AND "
+                                  "other.id > jobs.id) ORDER BY id DESC LIMIT 1", (key,)).fetchone()
+            if row is not None:
+                return row[0], key, True
+            cursor = self.db.execute("INSERT INTO jobs (key, groupedid, operation, spec, state, created, updated) "
+                                     "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                                     (key, groupedid, operation, json.dumps(spec), now, now))
+            return cursor.lastrowid, key, False
+        finally:
+            self.db.execute("COMMIT")
+
+    def recover(self):
+        """
+        This method retries the tasks, which have been interrupted. A running
+        task is only interrupted if the process which has claimed it does not
+        exist anymore, the tasks of other running workers are not touched.
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for job_id, site, owner in self.db.execute("SELECT job_id, site, owner FROM tasks WHERE state = "
+                                                       "'running'").fetchall():
+                if owner is None or owner == os.getpid() or not self.is_alive(owner):
+                    self.logger.info('Retrying the interrupted task %d on site %s', job_id, site)
+                    self.db.execute("UPDATE tasks SET state = 'retry' WHERE job_id = ? AND site = ?", (job_id, site))
+        finally:
+            self.db.execute("COMMIT")
+
+    @staticmethod
+    def is_alive(pid):
         """
-        The method creates a command string with the settings of the passed
-        object references to remove a downtime for a Host or Service object.
+        This method checks if a process exists.
 
-        Attribute:
-            obj         a reference to a object of class Host or Service
-            data        a list reference with informations to a specific object
-                        where data[0][0] has the needed downtime id
-            downtime    a reference to the downtime object
+        Attributes:
+            pid             the process id
 
         Return:
-            string      the created livestatus command string
+            boolean         True if the process exists
         """
-        command = "[{0}] {1};{2}\n".format(
-            str(downtime.get_now()),
-            obj.get_downtime_operation('remove'),
-            str(dtid))
-        self.logger.debug('Livestatus command: COMMAND %s', command)
-        self.print_details(obj, downtime, 'remove')
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno == errno.EPERM
+        return True
 
-        return command
+    def claim(self, sites):
+        """
+        This method splits the new jobs into tasks for the given sites and
+        marks the next task that is due as running.
 
+        Attributes:
+            sites           a list of the known site names
 
-class Auth(object):
-    """
-    This class holds the user credentials.
-    """
-    logger = None
+        Return:
+            tuple           (job id, site, spec, attempts) or None
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for (job_id,) in self.db.execute("SELECT id FROM jobs WHERE state = 'queued'").fetchall():
+                self.db.executemany("INSERT OR IGNORE INTO tasks (job_id, site, state, attempts, next_try, objects, "
+                                    "commands) VALUES (?, ?, 'queued', 0, 0, 0, 0)",
+                                    [(job_id, site) for site in sites])
+                self.update_job(job_id, now)
+            row = self.db.execute("SELECT tasks.job_id, tasks.site, jobs.spec, tasks.attempts FROM tasks JOIN jobs "
+                                  "ON jobs.id = tasks.job_id WHERE tasks.state IN ('queued', 'retry') AND "
+                                  "tasks.next_try <= ? ORDER BY tasks.next_try, tasks.job_id LIMIT 1",
+                                  (now,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE tasks SET state = 'running', owner = ? WHERE job_id = ? AND site = ?",
+                            (os.getpid(), row[0], row[1]))
+            return row[0], row[1], json.loads(row[2]), row[3]
+        finally:
+            self.db.execute("COMMIT")
+
+    def complete(self, job_id, site, result):
+        """
+        This method marks a task as done.
 
-    def __init__(self, user, secret, authorization, author=None):
+        Attributes:
+            job_id          the id of the job
+            site            the site name of the task
+            result          the result returned by Api.execute
         """
-        The constructor method for class Auth.
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("UPDATE tasks SET state = 'done', attempts = attempts + 1, error = NULL, objects = ?, "
+                            "commands = ? WHERE job_id = ? AND site = ?",
+                            (result['objects'], result['commands'], job_id, site))
+            self.update_job(job_id, time.time())
+        finally:
+            self.db.execute("COMMIT")
+
+    def fail(self, job_id, site, error, retry=True):
         """
-        if Command.logger is None:
-            Command.logger = setup_logging(self.__class__.__name__)
-        self.user = user
-        self.secret = secret
-        self.authorization = authorization
+        This method marks a task as failed. If retry is set and the task has not
+        reached the maximum number of attempts, it gets retried later. The
+        pending tasks of the same site wait as well.
 
-        if self.get_authorization():
-            self.author = author
+        Attributes:
+            job_id          the id of the job
+            site            the site name of the task
+            error           the error message
+            retry           False if a retry would fail again
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            attempts = self.db.execute("SELECT attempts FROM tasks WHERE job_id = ? AND site = ?",
+                                       (job_id, site)).fetchone()[0] + 1
+            if retry and attempts < self._max_attempts:
+                next_try = now + min(self._retry_base * 2 ** (attempts - 1), self._retry_max)
+                self.logger.warning('Task %d on site %s failed, retry in %d seconds: %s', job_id, site,
+                                    next_try - now, error)
+                self.db.execute("UPDATE tasks SET state = 'retry', attempts = ?, next_try = ?, error = ? "
+                                "WHERE job_id = ? AND site = ?", (attempts, next_try, error, job_id, site))
+                self.db.execute("UPDATE tasks SET next_try = ? WHERE site = ? AND state IN ('queued', 'retry') "
+                                "AND next_try < ?", (next_try, site, next_try))
+            else:
+                self.logger.error('Task %d on site %s failed: %s', job_id, site, error)
+                self.db.execute("UPDATE tasks SET state = 'failed', attempts = ?, error = ? WHERE job_id = ? AND "
+                                "site = ?", (attempts, error, job_id, site))
+            self.update_job(job_id, now)
+        finally:
+            self.db.execute("COMMIT")
+
+    def update_job(self, job_id, now):
+        """
+        This method derives the state of a job from its tasks.
+
+        Attributes:
+            job_id          the id of the job
+            now             the current time
+        """
+        states = set(state for (state,) in self.db.execute("SELECT state FROM tasks WHERE job_id = ?", (job_id,)))
+        if states & set(['queued', 'running', 'retry']):
+            state = 'running'
+        elif 'failed' in states:
+            state = 'failed'
         else:
-            self.author = user
+            state = 'done'
+        self.db.execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ?", (state, now, job_id))
+
+    def get_next_try(self):
+        """
+        This method returns the time when the next task is due.
+
+        Return:
+            float           the Unix epoch time or None if nothing is pending
+        """
+        if self.db.execute("SELECT 1 FROM jobs WHERE state = 'queued' LIMIT 1").fetchone():
+            return time.time()
+        return self.db.execute("SELECT MIN(next_try) FROM tasks WHERE state IN ('queued', 'retry', "
+                               "'running')").fetchone()[0]
+
+    def status(self, job=None):
+        """
+        This method returns the state of the jobs and their tasks.
+
+        Attributes:
+            job             optional the id or the key of a job
+
+        Return:
+            list            a list of dictionaries, one per job
+        """
+        query = "SELECT id, key, groupedid, operation, state, created, updated FROM jobs"
+        if job:
+            rows = self.db.execute(query + " WHERE id = ? OR key = ? ORDER BY id", (job, job)).fetchall()
+        else:
+            rows = self.db.execute(query + " ORDER BY id").fetchall()
+        jobs = []
+        for job_id, key, groupedid, operation, state, created, updated in rows:
+            sites = {}
+            for site, task_state, attempts, error, objects, commands in self.db.execute(
+                    "SELECT site, state, attempts, error, objects, commands FROM tasks WHERE job_id = ?", (job_id,)):
+                sites[site] = {'state': task_state, 'attempts': attempts, 'error': error, 'objects': objects,
+                               'commands': commands}
+            jobs.append({'id': job_id, 'key': key, 'groupedid': groupedid, 'operation': operation, 'state': state,
+                         'created': int(created), 'updated': int(updated), 'sites': sites})
+        return jobs
+
+
+class QueueWorkers(object):
+    """
+    The QueueWorkers class executes the tasks of a JobQueue with a pool of
+    threads until no task is pending anymore. Each thread has its own Api and
+    JobQueue object.
+    """
+    logger = None
 
-    def get_author(self):
+    def __init__(self, path, auth, omd_path, url, workers=4):
         """
-        Getter method for author.
+        The constructor method for class QueueWorkers.
 
-        Return:
-            string      the author name
+        Attributes:
+            path            the file name of the queue database
+            auth            the user credentials
+            omd_path        the base path (OMD_ROOT)
+            url             the url
+            workers         the number of threads
         """
-        return self.author
+        if QueueWorkers.logger is None:
+            QueueWorkers.logger = setup_logging(self.__class__.__name__)
+        self.path = path
+        self.auth = auth
+        self.omd_path = omd_path
+        self.url = url
+        self.workers = workers
+        self.errors = []
 
-    def get_user(self):
+    def run(self):
         """
-        Getter method for user.
+        This method starts the threads and waits for them.
 
         Return:
-            string      the user name
+            boolean         True if all threads finished without error
+        """
+        JobQueue(self.path).recover()
+        threads = []
+        for worker in range(max(self.workers, 1)):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        return not self.errors
+
+    def work(self):
+        """
+        This method is the target of a thread. It executes the due tasks and
+        waits for tasks to retry, until no task is pending.
+        """
+        try:
+            queue = JobQueue(self.path)
+            api = Api(self.auth, self.omd_path, self.url)
+        except Exception, e:
+            self.logger.critical('Worker could not be started: %s', e)
+            self.errors.append(e)
+            return
+        while True:
+            # all sites, the selection of the last executed task is not reset
+            task = queue.claim(api.sites.sites.keys())
+            if task is None:
+                next_try = queue.get_next_try()
+                if next_try is None:
+                    return
+                time.sleep(min(max(next_try - time.time(), 0.1), 1))
+                continue
+            job_id, site, spec, attempts = task
+            if site not in api.sites.sites:
+                queue.fail(job_id, site, 'Site {0} is not available'.format(site), retry=False)
+                continue
+            try:
+                result = api.execute(Job(**spec), site)
+            except (ValueError, TypeError, argparse.ArgumentTypeError), e:
+                queue.fail(job_id, site, str(e), retry=False)
+            except (MKLivestatusException, socket.error, IOError), e:
+                queue.fail(job_id, site, str(e) or e.__class__.__name__)
+            else:
+                self.logger.debug('Task %d on site %s sent %d commands', job_id, site, result['commands'])
+                queue.complete(job_id, site, result)
+
+
+class QueueHandler(logging.Handler):
+    """
+    The QueueHandler class passes the log records to a background thread,
+    which writes them with the wrapped handlers. The calling thread only
+    merges the message with its arguments, the formatting and writing of the
+    record is done by the listener thread. The thread is started with the
+    first record of a process and drained when the handler gets closed.
+    """
+
+    def __init__(self, handlers):
         """
-        return self.user
+        The constructor method for class QueueHandler.
 
-    def get_secret(self):
+        Attributes:
+            handlers        a list of handlers used by the listener thread
         """
-        Getter method for secret.
+        logging.Handler.__init__(self)
+        self.handlers = handlers
+        self.queue = None
+        self.listener = None
+        self.pid = None
 
-        Return:
-            string      the user secret
+    def emit(self, record):
         """
-        return self.secret
+        This method queues a record. The message and the exception get merged
+        now, so later changes of the arguments don't change the record.
 
-    def get_authorization(self):
+        Attributes:
+            record          a LogRecord object
+        """
+        try:
+            if self.pid != os.getpid():
+                self.start()
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+    def start(self):
+        """
+        This method starts the listener thread of the current process.
+        """
+        self.acquire()
+        try:
+            if self.pid != os.getpid():
+                self.queue = Queue.Queue()
+                self.listener = threading.Thread(target=self.listen, args=(self.queue,))
+                self.listener.daemon = True
+                self.listener.start()
+                self.pid = os.getpid()
+        finally:
+            self.release()
+
+    def listen(self, queue):
+        """
+        This method writes the queued records until it gets None.
+
+        Attributes:
+            queue           the queue of the records
         """
-        Getter method that returns if AuthUser shall be considered.
+        while True:
+            record = queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
 
-        Return:
-            boolean     True if it is enabled else False
+    def close(self):
         """
-        return self.authorization
+        This method writes the pending records and closes the wrapped handlers.
+        """
+        if self.pid == os.getpid():
+            self.queue.put(None)
+            self.listener.join()
+            self.pid = None
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
 
 
 # ------------------------------------------------------------------------------
@@ -1188,7 +5535,12 @@ class Auth(object):
 def setup_logging(name):
     """
     This function allows to setup the logging facility for main and all inline
-    classes the same but also take the class name as the logger.
+    classes the same but also take the class name as the logger. All loggers
+    share one QueueHandler, which writes the log file in a background thread,
+    and one console handler if the program runs as script. The handlers are
+    created once per process and also added to the logger main. Records
+    below the level set by set_log_level are dropped before their message
+    gets formatted.
 
     Attribute:
         name        the name of the logger
@@ -1196,36 +5548,56 @@ def setup_logging(name):
     Return:
         object      a reference to a logging object
     """
-    # TODO: Create a class to be able to implement logging by association (has a)
-    # setup of the log facility
-    log = logging.getLogger(name)
-    log.setLevel(logging.DEBUG)
-
-    # define formatter
-    form_console = logging.Formatter(
-        '[%(module)s:%(name)s:%(funcName)s:%(lineno)d] %(levelname)s:%(message)s'
-    )
-    form_file = logging.Formatter(
-        '%(asctime)s [%(module)s:%(name)s:%(funcName)s:%(lineno)d] %(levelname)s:%(message)s'
-    )
-
-    # define handler
-    log_console = logging.StreamHandler(sys.stdout)
-    log_file = logging.FileHandler(path_var_log + "/downtime.log")
-
-    # define log level for each handler
-    log_console.setLevel(logging.INFO)
-    log_file.setLevel(logging.DEBUG)
+    with log_lock:
+        if not log_handlers:
+            # define formatter
+            form_console = logging.Formatter(
+                '[%(module)s:%(name)s:%(funcName)s:%(lineno)d] %(levelname)s:%(message)s'
+            )
+            form_file = logging.Formatter(
+                '%(asctime)s [%(module)s:%(name)s:%(funcName)s:%(lineno)d] %(levelname)s:%(message)s'
+            )
+
+            # define handler, the file handler gets created first, so it gets
+            # closed after the queue has been drained at exit
+            log_file = logging.FileHandler(path_var_log + "/downtime.log")
+            log_file.setFormatter(form_file)
+            log_handlers.append(QueueHandler([log_file]))
+            if log_console:
+                console = logging.StreamHandler(sys.stdout)
+                console.setLevel(logging.INFO)
+                console.setFormatter(form_console)
+                log_handlers.append(console)
+
+        # setup of the log facility
+        for log in (logging.getLogger(name), logger):
+            log.setLevel(log_level)
+            for handler in log_handlers:
+                if handler not in log.handlers:
+                    log.addHandler(handler)
+
+    return logging.getLogger(name)
+
+
+def set_log_level(level):
+    """
+    This function sets the level of all loggers created by setup_logging,
+    also of the loggers created later.
 
-    # assign formatter to each handler
-    log_console.setFormatter(form_console)
-    log_file.setFormatter(form_file)
+    Attribute:
+        level       the log level, e.g. logging.DEBUG
+    """
+    global log_level
+    with log_lock:
+        log_level = level
+        for log in logging.Logger.manager.loggerDict.values():
+            if isinstance(log, logging.Logger) and log_handlers and log_handlers[0] in log.handlers:
+                log.setLevel(level)
 
-    # assign each handler to the logger
-    log.addHandler(log_console)
-    log.addHandler(log_file)
 
-    return log
+# make logging facility globally available, also if the program is used as
+# module, its handlers are added by the first call of setup_logging
+logger = logging.getLogger('main')
 
 
 def validate_downtime(args, downtime):
@@ -1310,6 +5682,56 @@ def validate_time(time):
         logger.critical(msg)
         raise argparse.ArgumentTypeError(msg)
 
+def validate_datetime(date_time):
+    """
+    This function validates the passed date and time argument and converts it
+    to Unix epoch time.
+
+    Raises:
+        ArgumentTypeError
+
+    Attribute:
+        date_time   the date and time string
+
+    Return:
+        int         the date and time as Unix epoch time
+    """
+    try:
+        logger.debug('Valid date and time: %s', datetime.strptime(date_time, "%d-%m-%Y %H:%M").strftime("%d-%m-%Y %H:%M"))
+        return int(datetime.strptime(date_time, "%d-%m-%Y %H:%M").strftime('%s'))
+    except ValueError:
+        msg = "Date and time argument is not in a valid format: '{0}'.".format(date_time)
+        logger.critical(msg)
+        raise argparse.ArgumentTypeError(msg)
+
+def validate_after_id(after_id):
+    """
+    This function validates the passed cursor argument. It is either a single
+    downtime id for all sites or a comma separated list of site:id pairs.
+
+    Raises:
+        ArgumentTypeError
+
+    Attribute:
+        after_id    the cursor string
+
+    Return:
+        dictionary  the downtime id per site, the key '' applies to all sites
+    """
+    try:
+        if ':' not in after_id:
+            return {'': int(after_id)}
+        cursors = {}
+        for cursor in after_id.split(','):
+            site, sep, dtid = cursor.rpartition(':')
+            cursors[site] = int(dtid)
+        logger.debug('Valid cursor: %s', cursors)
+        return cursors
+    except ValueError:
+        msg = "Cursor has to be a downtime id or a list of site:id pairs: '{0}'.".format(after_id)
+        logger.critical(msg)
+        raise argparse.ArgumentTypeError(msg)
+
 def validate_groupedid(groupedid):
     """
     This function validates the passed groupedid argument. Gropedid needs to be
@@ -1332,7 +5754,48 @@ def validate_groupedid(groupedid):
         logger.critical(msg)
         raise argparse.ArgumentTypeError(msg)
 
-def validate_args(args, sites, auth):
+
+def validate_run_id(run_id):
+    """
+    This function validates the passed run ID argument. It needs to be in the
+    format of the IDs created by class Checkpoint, e.g. 20190623-120000-4711.
+
+    Raises:
+        ArgumentTypeError
+
+    Attribute:
+        run_id      the run ID string
+
+    Return:
+        string      a valid run ID string
+    """
+    if not Checkpoint.run_id_format.match(run_id):
+        msg = "Run ID has to be in the format YYYYMMDD-HHMMSS-PID: '{0}'.".format(run_id)
+        logger.critical(msg)
+        raise argparse.ArgumentTypeError(msg)
+    return run_id
+
+
+def validate_address(address):
+    """
+    This function validates a TCP address of a worker, without host the
+    worker listens on all interfaces.
+
+    Raises:
+        ArgumentTypeError
+
+    Attribute:
+        address     the address string in the format [HOST:]PORT
+
+    Return:
+        tuple       the host and the port as integer
+    """
+    host, sep, port = str(address).rpartition(':')
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError("Address has to be [HOST:]PORT: '{0}'.".format(address))
+    return host.strip('[]'), int(port)
+
+def validate_args(args, sites, auth, plan=None):
     """
     This function will prepare relevant arguments like the passed host, service,
     hostgroup and servicegroup. It creates the related objects and store the
@@ -1342,23 +5805,27 @@ def validate_args(args, sites, auth):
         args        the relevant arguments passed by command line
         sites       a reference to a class Sites object
         auth        the user credentials
+        plan        a reference to a Plan object, replaces the objects of the
+                    command line
 
     Return:
         boolean     True if all went well else False
     """
+    # the objects and their windows are read from a plan
+    if plan is not None:
+        sites.append_obj_to_site(plan)
+        for host_name, service in plan.get_missing():
+            logger.warning('Plan object not found: %s', host_name + (";" + service if service else ""))
     # only a host and service is given
-    if args.service and args.host:
+    elif args.service and args.host:
         # Generator to create all posible combinations of host and service
         mp = ((h, s) for h in args.host.split(',') for s in args.service.split(','))
-        # Loop through the list mp and create an object of class service
-        for h, s in mp:
-            obj = Service(h, s, auth)
-            sites.append_obj_to_site(obj)
+        # Create an object of class service for each combination, all get
+        # resolved concurrently
+        sites.append_objs_to_sites([Service(h, s, auth) for h, s in mp])
     # only a host is given
     elif args.host:
-        for h in args.host.split(','):
-            obj = HostAndServices(h, auth, args.exclusive)
-            sites.append_obj_to_site(obj)
+        sites.append_objs_to_sites([HostAndServices(h, auth, args.exclusive) for h in args.host.split(',')])
     # only a hostgroup is given
     elif args.hostgroup:
         obj = Hostgroup(args.hostgroup, auth, args.exclusive)
@@ -1367,18 +5834,272 @@ def validate_args(args, sites, auth):
     elif args.servicegroup:
         obj = Servicegroup(args.servicegroup, auth)
         sites.append_obj_to_site(obj)
-    # in all other cases generate an error message
+    # in all other cases all downtimes are listed or an error is reported
     else:
-        if args.ignore or (args.comment is not None and args.operation == 'list'):
-            logger.debug('Ignore flag is set or just a listing of all downtimes is requested')
-            return True
-        else:
-            logger.critical('Allowed is either a hostgroup or a servicegroup or a host or host and service')
-            return False
+        return validate_selection(args)
 
     return True
 
 
+def validate_selection(args, plan=None):
+    """
+    This function checks that the arguments select hosts or services or that
+    all downtimes are listed. It needs no request, so it can be done before
+    the sites are discovered.
+
+    Attributes:
+        args        the relevant arguments passed by command line
+        plan        a reference to a Plan object or None
+
+    Return:
+        boolean     True if the selection is valid else False
+    """
+    if plan is not None or args.host or args.hostgroup or args.servicegroup:
+        return True
+    if args.ignore or (args.comment is not None and args.operation == 'list'):
+        logger.debug('Ignore flag is set or just a listing of all downtimes is requested')
+        return True
+    logger.critical('Allowed is either a hostgroup or a servicegroup or a host or host and service')
+    return False
+
+
+def run_batch(api, stream):
+    """
+    This function executes the jobs read from a stream. Each line contains a
+    job as JSON object with the arguments of class Job. The result of each job
+    is written as JSON object to stdout.
+
+    Attributes:
+        api         a reference to an Api object
+        stream      a file object with one job per line
+
+    Return:
+        int         0 if all jobs succeeded else 1
+    """
+    rc = 0
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+            if not isinstance(spec, dict):
+                raise ValueError('Job is not a JSON object')
+            result = api.execute(Job(**spec))
+            result['status'] = 'ok'
+        except (ValueError, TypeError, argparse.ArgumentTypeError, MKLivestatusException), e:
+            logger.error('Job in line %d failed: %s', number, e)
+            result = {'status': 'error', 'error': str(e)}
+            rc = 1
+        except Exception, e:
+            # any other error fails this job only, the following jobs are
+            # still executed
+            logger.exception('Job in line %d failed unexpectedly: %s', number, e)
+            result = {'status': 'error', 'error': str(e)}
+            rc = 1
+        result['job'] = number
+        sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+        sys.stdout.flush()
+    return rc
+
+
+def load_rules(path):
+    """
+    This function reads the recurring downtimes of a file. Each line contains
+    a rule as JSON object with the arguments of class Rule.
+
+    Raises:
+        ValueError
+
+    Attributes:
+        path        the file name of the rules
+
+    Return:
+        list        a list of Rule objects
+    """
+    rules = []
+    with open(path) as stream:
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                spec = json.loads(line)
+                if not isinstance(spec, dict):
+                    raise ValueError('Rule is not a JSON object')
+                rules.append(Rule(**spec))
+            except (ValueError, TypeError, argparse.ArgumentTypeError), e:
+                raise ValueError('Invalid rule in line {0}: {1}'.format(number, e))
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError('The names of the rules are not unique')
+    return rules
+
+
+def load_workers(path):
+    """
+    This function reads the workers of the coordinator from a JSON file, an
+    object with the site name as key and the address HOST:PORT of the worker
+    of the site as value.
+
+    Raises:
+        ValueError
+
+    Attributes:
+        path        the file name of the workers
+
+    Return:
+        dictionary  the site name as key and the tuple (host, port) as value
+    """
+    with open(path) as stream:
+        workers = json.load(stream)
+    if not isinstance(workers, dict):
+        raise ValueError('The workers in {0} are not a JSON object'.format(path))
+    try:
+        workers = dict((site, validate_address(address)) for site, address in workers.items())
+    except argparse.ArgumentTypeError, e:
+        raise ValueError('Invalid worker in {0}: {1}'.format(path, e))
+    for site, (host, port) in workers.items():
+        if not host:
+            raise ValueError('The worker of the site {0} in {1} needs a host'.format(site, path))
+    return workers
+
+
+def load_plan(args, auth):
+    """
+    This function reads and validates the plan file, or stdin if the file name
+    is -, before any site gets contacted. All invalid rows are reported.
+
+    Attributes:
+        args        all passed command line arguments
+        auth        the user credentials
+
+    Return:
+        obj         a reference to a Plan object or None if the plan is invalid
+    """
+    plan = Plan(auth, args.exclusive, args.comment, args.duration,
+                int(time.time()) if args.operation == 'add' else None)
+    try:
+        if args.plan == '-':
+            errors = plan.read(sys.stdin)
+        else:
+            with open(args.plan) as stream:
+                errors = plan.read(stream)
+    except IOError, e:
+        errors = [str(e)]
+    for error in errors:
+        logger.critical(error)
+    if errors:
+        return None
+    logger.debug('Plan %s has %d rows for %d hosts', args.plan, plan.get_row_count(), len(plan.host_names))
+    return plan
+
+
+def run_queue(args):
+    """
+    This function adds the job created from the command line arguments to the
+    queue or shows the state of the queued jobs, as JSON Lines.
+
+    Attributes:
+        args        all passed command line arguments
+
+    Return:
+        int         0 if everything went fine else 1
+    """
+    try:
+        queue = JobQueue(args.queue)
+        if args.queue_status is not None:
+            for job in queue.status(args.queue_status):
+                print json.dumps(job, sort_keys=True)
+            return 0
+        job_id, key, duplicate = queue.enqueue(get_request(args))
+    except (ValueError, TypeError, argparse.ArgumentTypeError, sqlite3.Error), e:
+        logger.critical('Queue %s: %s', args.queue, e)
+        return 1
+    print json.dumps({'id': job_id, 'key': key, 'duplicate': duplicate}, sort_keys=True)
+    return 0
+
+
+def get_request(args):
+    """
+    This function creates the request for the daemon from the command line
+    arguments. The dates are passed as strings and validated by the daemon.
+
+    Attributes:
+        args        all passed command line arguments
+
+    Return:
+        dictionary  the arguments of class Job
+    """
+    request = {
+        'operation': args.operation,
+        'groupedid': args.groupedid[3:] if args.groupedid is not None else None,
+        'host': args.host,
+        'service': args.service,
+        'hostgroup': args.hostgroup,
+        'servicegroup': args.servicegroup,
+        'exclusive': args.exclusive,
+        'comment': args.comment,
+        'author': args.author,
+        'quiet': args.quiet,
+        'limit': args.limit,
+    }
+    if args.operation == 'list':
+        request.update({
+            'ignore': args.ignore,
+            'epoch': args.epoch,
+            'sort': args.sort,
+            'after_id': args.after_id,
+            'page_size': args.page_size,
+            'summary': args.summary,
+            'created_by': args.created_by,
+            'since': args.since,
+            'until': args.until,
+        })
+    elif args.operation == 'add':
+        request['start_time'] = args.begindate + " " + args.begin
+        if args.end:
+            request['end_time'] = (args.enddate or datetime.now().strftime('%d-%m-%Y')) + " " + args.end
+        else:
+            request['duration'] = args.duration
+    return request
+
+
+def run_client(args):
+    """
+    This function sends the request created from the command line arguments
+    to the daemon and writes the result like the program itself.
+
+    Attributes:
+        args        all passed command line arguments
+
+    Return:
+        int         0 if everything went fine else 1
+    """
+    if args.operation == 'add' and args.enddate and not args.end:
+        logger.critical('Please specify the end time (-e) of the downtime')
+        return 1
+    try:
+        result = Client(args.socket).request(get_request(args))
+    except (socket.error, ValueError), e:
+        logger.critical('Request to the daemon on %s failed: %s', args.socket, e)
+        return 1
+    if result['status'] != 'ok':
+        logger.critical(result['error'])
+        return 1
+
+    if args.operation == 'list':
+        writer = Writer.get_writer(args.format, summary=result['summary'])
+        writer.write_header()
+        for row in result['rows']:
+            writer.write_row(row)
+        if result['cursor'] is not None:
+            writer.write_cursor(result['cursor'])
+        writer.close()
+    else:
+        for message in result['messages']:
+            print message.encode('utf-8')
+    return 0
+
+
 def main(argv):
     """
     Parse the given command line arguments and create a nice formatted help
@@ -1389,6 +6110,9 @@ def main(argv):
     Return:
         int         0 if everything went fine else 1
     """
+    global log_console
+    log_console = True
+    setup_logging('main')
     parser = argparse.ArgumentParser()
     # TODO: Add grouped_id random generator in case the id is not set
     # TODO: Add exclude list as argument for host- and servicegroup
@@ -1423,6 +6147,10 @@ def main(argv):
     parser.add_argument('-c', '--comment', default='Maintenance',
                           help='Descriptive comment for the downtime downtime (default: Maintenance)'
                           )
+    parser.add_argument('--plan', default=None,
+                        help='Read the hosts and services with their own windows from the given CSV or JSON Lines '
+                             'file or - for stdin, the fields are host, service, start, end or duration and comment'
+                        )
     ggroupedid = parser.add_mutually_exclusive_group(required=True)
     ggroupedid.add_argument('-g', '--groupedid', type=validate_groupedid,
                           help='Provide an ID to identify the group of hosts and services'
@@ -1430,17 +6158,101 @@ def main(argv):
     ggroupedid.add_argument('-i', '--ignore', action='store_true', default=False,
                           help='Bypass the groupedid argument, only available for the list argument'
                           )
+    ggroupedid.add_argument('--resume', type=validate_run_id, default=None, metavar='RUN_ID',
+                          help='Continue the interrupted add or remove run with the given ID, the arguments of the '
+                               'run are taken from its checkpoint'
+                          )
+    ggroupedid.add_argument('--batch', default=None,
+                          help='Read add and remove jobs as JSON Lines from the given file or - for stdin and '
+                               'write the result of each job as JSON Lines'
+                          )
+    ggroupedid.add_argument('--daemon', default=None, metavar='SOCKET',
+                          help='Keep running and execute the requests received on the given Unix socket'
+                          )
+    ggroupedid.add_argument('--worker', type=validate_address, default=None, metavar='ADDRESS',
+                          help='Keep running next to the sites and execute the add and remove jobs of a '
+                               'coordinator received on the given [HOST:]PORT against the local sites'
+                          )
+    ggroupedid.add_argument('--schedule', default=None, metavar='RULES',
+                          help='Keep running and add the recurring downtimes of the rules in the given file'
+                          )
+    ggroupedid.add_argument('--work', type=int, default=None, metavar='WORKERS',
+                          help='Execute the jobs of the queue with the given number of threads until no job is '
+                               'pending, needs --queue'
+                          )
+    ggroupedid.add_argument('--queue-status', nargs='?', const='', default=None, metavar='JOB',
+                          help='Show the state of all queued jobs or of the job with the given id or key, needs '
+                               '--queue'
+                          )
     parser.add_argument('-C', '--epoch', action='store_true', default=False,
                         help='Shows the listed downtimes in epoch instead of date and time (default: False)'
                         )
+    parser.add_argument('--sort', default=None,
+                        choices=['id', 'start', 'end', 'host'],
+                        help='Sort the listed downtimes of all sites by id, start time, end time or host'
+                        )
+    parser.add_argument('--after-id', type=validate_after_id, default=None,
+                        help='Continue the listing after the given downtime id, either one id for all sites or the '
+                             'cursor site:id,... printed by the previous page'
+                        )
+    parser.add_argument('--page-size', type=int, default=None,
+                        help='List at most the given number of downtimes per site and print the cursor for the '
+                             'next page, each page transfers all downtimes after the cursor'
+                        )
+    parser.add_argument('--summary', action='store_true', default=False,
+                        help='Count the listed downtimes per site, author and grouped ID instead of listing them'
+                        )
+    parser.add_argument('-f', '--format', default='table',
+                        choices=['table', 'jsonl', 'csv'],
+                        help='Output format of the list operation, one of table, jsonl or csv (default: table)'
+                        )
     parser.add_argument('-U', '--url', default='http://localhost/cmk_master/check_mk/',
                         help='Base-URL of Multisite (default: guess local OMD site)'
                         )
     parser.add_argument('-P', '--path', default='/omd/sites',
                         help='The OMD base path (default: /omd/sites)'
                         )
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='Add or remove the downtimes in chunks of the given number of objects per site, each '
+                             'sent chunk is recorded, so an interrupted run can be continued (default: 1000)'
+                        )
+    parser.add_argument('--site-cache', type=int, default=300, metavar='SECONDS',
+                        help='Use the sites discovered by a previous run if they are not older than the given '
+                             'seconds instead of asking the webapi, 0 disables the cache (default: 300)'
+                        )
     parser.add_argument('-v', '--verbose', action='store_true',
-                        help='Verbose output'
+                        help='Verbose output, write also the debug messages to the log file'
+                        )
+    parser.add_argument('--socket', default=None,
+                        help='Send the request to the daemon listening on the given Unix socket, -u and -p are '
+                             'not needed'
+                        )
+    parser.add_argument('--queue', default=None,
+                        help='Add the add or remove job to the persistent queue in the given database file instead '
+                             'of executing it, see --work and --queue-status'
+                        )
+    parser.add_argument('--coordinate', default=None, metavar='WORKERS',
+                        help='Pass the add and remove jobs of the sites listed in the given JSON file, the site '
+                             'name as key and HOST:PORT of its worker as value, to the workers'
+                        )
+    parser.add_argument('--worker-key', default=path_worker_key, metavar='KEY',
+                        help='The file with the key shared by the coordinator and the workers (default: '
+                             '~/etc/downtime.key)'
+                        )
+    parser.add_argument('--worker-timeout', type=int, default=600, metavar='SECONDS',
+                        help='The maximum time to wait for the result of a worker with --coordinate (default: 600)'
+                        )
+
+    # Scheduler
+    parser.add_argument('--lead-time', type=int, default=86400,
+                        help='Add the recurring downtimes the given seconds before they start (default: 86400)'
+                        )
+    parser.add_argument('--catch-up', default='running',
+                        choices=['running', 'skip'],
+                        help='Add missed recurring downtimes that are still running or skip them (default: running)'
+                        )
+    parser.add_argument('--state', default=None,
+                        help='The state file of the scheduler (default: the rules file with the suffix .state)'
                         )
 
     # Begin Time and Date
@@ -1466,14 +6278,25 @@ def main(argv):
                         help='Duration of the downtime in seconds, if -e is set, duration is ignored (default: 7200)'
                         )
 
+    # List filter
+    parser.add_argument('--created-by', default=None,
+                        help='List only downtimes created by the given author'
+                        )
+    parser.add_argument('--since', type=validate_datetime,
+                        help='List only downtimes ending after the given date and time (format: dd-mm-yyyy HH:MM)'
+                        )
+    parser.add_argument('--until', type=validate_datetime,
+                        help='List only downtimes starting before the given date and time (format: dd-mm-yyyy HH:MM)'
+                        )
+
     # Identification
     parser.add_argument('-a', '--author', default=None,
                         help='Check_MK user name'
                         )
-    parser.add_argument('-u', '--user', required=True,
+    parser.add_argument('-u', '--user',
                         help='Name of the automation user'
                         )
-    parser.add_argument('-p', '--secret', required=True,
+    parser.add_argument('-p', '--secret',
                         help='Secret of the automation user'
                         )
     parser.add_argument('-A', '--authorization', action='store_true', default=False,
@@ -1487,8 +6310,91 @@ def main(argv):
     parser.add_argument('-l', '--limit', type=int, default=100,
                         help='Limit the output for adding or removing downtimes (default: 100)'
                         )
+    parser.add_argument('--stats', default=None,
+                        help='Write the wall time of the phases and the requests, rows and bytes per site as JSON '
+                             'to the given file or - for stderr'
+                        )
+    parser.add_argument('--profile', default=None,
+                        help='Write a cProfile dump of the run to the given file'
+                        )
+    parser.add_argument('--trace', type=int, nargs='?', const=10, default=None, metavar='TOP',
+                        help='Trace the livestatus requests and write the TOP (default: 10) slowest and most '
+                             'frequent query shapes per site to stderr at exit'
+                        )
+    parser.add_argument('--metrics', default=None,
+                        help='Write the phases, requests, commands, objects and unreachable sites of the run as '
+                             'Prometheus metrics to the given file, e.g. for the textfile collector'
+                        )
 
     args = parser.parse_args(argv)
+    if args.verbose:
+        set_log_level(logging.DEBUG)
+    stats = Stats()
+    if args.trace is not None:
+        stats.set_tracer(QueryTracer())
+    profiler = None
+    if args.profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    result = None
+    try:
+        result = run(parser, args, stats)
+        return result
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stats is not None:
+            stats.write(args.stats)
+        if stats.tracer is not None:
+            stats.tracer.write(sys.stderr, args.trace)
+        if args.metrics is not None:
+            stats.write_metrics(args.metrics, {'source': 'script'},
+                                {'success': ('The run finished without error', 1 if result == 0 else 0)})
+
+
+def run(parser, args, stats):
+    """
+    This function executes the operation requested by the parsed command line
+    arguments.
+
+    Attributes:
+        parser      the argument parser to report usage errors
+        args        all passed command line arguments
+        stats       a reference to a Stats object to record the phases
+
+    Return:
+        int         0 if everything went fine else 1
+    """
+    checkpoint = None
+    if args.resume is not None:
+        if args.host or args.hostgroup or args.service or args.servicegroup or args.plan is not None or \
+                args.socket is not None or args.queue is not None:
+            parser.error('argument --resume: not allowed with argument -n, -N, -s, -S, --plan, --socket or --queue')
+        try:
+            checkpoint = Checkpoint(args.resume)
+            spec = checkpoint.load()
+        except (IOError, ValueError), e:
+            logger.critical(e)
+            return 1
+        for key in run_spec_args:
+            setattr(args, key, spec[key])
+    if args.plan is not None and (args.host or args.hostgroup or args.service or args.servicegroup):
+        parser.error('argument --plan: not allowed with argument -n, -N, -s or -S')
+    if args.plan is not None and (args.socket is not None or args.queue is not None or args.groupedid is None):
+        parser.error('argument --plan: needs argument -g and is not allowed with argument --socket or --queue')
+    if args.socket is not None:
+        if args.batch is not None or args.daemon is not None or args.schedule is not None:
+            parser.error('argument --socket: not allowed with argument --batch, --daemon or --schedule')
+        return run_client(args)
+    if (args.work is not None or args.queue_status is not None) and args.queue is None:
+        parser.error('argument --work and --queue-status: needs argument --queue')
+    if args.queue is not None and args.work is None:
+        return run_queue(args)
+    if args.worker is not None:
+        return run_worker(args, stats)
+    if args.user is None or args.secret is None:
+        parser.error('argument -u/--user and -p/--secret are required')
     if args.authorization and args.author == None:
         logger.critical('Error authorization enabled but author has been not given')
         return 1
@@ -1498,32 +6404,159 @@ def main(argv):
     # Collecting and validating all data
     logger.debug('Collect and validate all passed data')
     auth = Auth(args.user, args.secret, args.authorization, args.author)
-    sites = Sites(auth, args.path, args.url)
+    if args.batch is not None:
+        api = Api(auth, args.path, args.url, persist=True, stats=stats)
+        if args.batch == '-':
+            return run_batch(api, sys.stdin)
+        with open(args.batch) as stream:
+            return run_batch(api, stream)
+    if args.daemon is not None:
+        return 0 if Daemon(Api(auth, args.path, args.url, persist=True, stats=stats), args.daemon).serve() else 1
+    if args.work is not None:
+        return 0 if QueueWorkers(args.queue, auth, args.path, args.url, args.work).run() else 1
+    if args.schedule is not None:
+        try:
+            rules = load_rules(args.schedule)
+        except (IOError, ValueError), e:
+            logger.critical(e)
+            return 1
+        Scheduler(Api(auth, args.path, args.url, persist=True, stats=stats), rules,
+                  args.state or args.schedule + '.state', args.lead_time, args.catch_up).run()
+        return 0
+    plan = None
+    if args.plan is not None:
+        plan = load_plan(args, auth)
+        if plan is None:
+            return 1
+    if not validate_selection(args, plan):
+        return 1
+    coordinator = None
+    if args.coordinate is not None:
+        if args.operation not in ['add', 'remove']:
+            parser.error('argument --coordinate: only possible with operation add or remove')
+        try:
+            coordinator = Coordinator(load_workers(args.coordinate), WorkerChannel.load_key(args.worker_key),
+                                      args.worker_timeout)
+        except (IOError, ValueError), e:
+            logger.critical(e)
+            return 1
+
+    # all arguments are validated before the sites get discovered
+    sites = Sites(auth, args.path, args.url, stats=stats, discover=False, cache_ttl=args.site_cache)
     logger.debug('Create downtime object')
-    downtime = Downtime(sites, auth, args.comment, args.groupedid, args.epoch, args.quiet, args.limit)
-    if args.operation == 'add' and not validate_downtime(args, downtime):
+    downtime = Downtime(sites, auth, args.comment, args.groupedid, args.epoch, args.quiet, args.limit,
+                        args.format, args.sort)
+    downtime.set_coordinator(coordinator)
+    if args.operation == 'list':
+        downtime.set_list_filter(args.created_by, args.since, args.until)
+        downtime.set_page(args.after_id, args.page_size)
+    if checkpoint is not None:
+        # the dates of the interrupted run, a plan has none
+        if checkpoint.get_spec()['start_time'] is not None:
+            downtime.set_start_time(checkpoint.get_spec()['start_time'])
+            downtime.set_end_time(checkpoint.get_spec()['end_time'])
+            downtime.set_duration(checkpoint.get_spec()['duration'])
+    elif args.operation == 'add' and plan is None and not validate_downtime(args, downtime):
         logger.critical('Error in date and time arguments')
         return 1
-    if not validate_args(args, sites, auth):
+    sites.discover()
+    if not validate_args(args, sites, auth, plan):
         return 1
 
     # List, set or remove downtimes
     # List downtimes
     if args.operation == 'list':
-        if (args.ignore and len(sites.get_sites_with_data()) == 0) or\
-                (args.groupedid is not None and len(sites.get_sites_with_data()) == 0):
-            downtime.list_downtimes(is_filter=False)
+        is_filter = not ((args.ignore and len(sites.get_sites_with_data()) == 0) or
+                         (args.groupedid is not None and len(sites.get_sites_with_data()) == 0))
+        if args.summary:
+            downtime.summarize_downtimes(is_filter)
         else:
-            downtime.list_downtimes()
+            downtime.list_downtimes(is_filter)
+
+    # Add or remove downtimes in chunks
+    elif args.operation in ['add', 'remove']:
+        return run_chunks(args, downtime, checkpoint)
+
+    return 0
+
+
+def run_worker(args, stats):
+    """
+    This function runs the worker of the local sites until it gets
+    interrupted or terminated.
+
+    Attributes:
+        args        all passed command line arguments
+        stats       a reference to a Stats object to record the discovery
+
+    Return:
+        int         0 if the worker has been stopped else 1
+    """
+    try:
+        key = WorkerChannel.load_key(args.worker_key)
+    except (IOError, ValueError), e:
+        logger.critical(e)
+        return 1
+    # the connections to the Unix sockets are cheap, so an idle worker does
+    # not occupy the threads of livestatus
+    sites = Sites(Auth(None, None, False), args.path, args.url, stats=stats, discover=False)
+    sites.discover_local()
+    if not sites.sites:
+        logger.critical('No livestatus socket found below %s', args.path)
+        return 1
+    Worker(sites, key, args.worker).serve()
+    return 0
 
-    # Add downtimes
-    elif args.operation == 'add':
-        downtime.add_downtimes()
 
-    # Remove downtimes
-    elif args.operation == 'remove':
-        downtime.remove_downtimes()
+def run_chunks(args, downtime, checkpoint=None):
+    """
+    This function adds or removes the downtimes of the resolved objects in
+    chunks and records each sent chunk in a checkpoint, so an interrupted run
+    can be continued with --resume. Only a run with more than one chunk per
+    site gets a checkpoint. The files are recorded with their absolute path, a
+    plan read from stdin can't be read again, so such a run gets no
+    checkpoint either. The progress is written to stderr if the run has more
+    than one chunk.
+
+    Attributes:
+        args        all passed command line arguments
+        downtime    a reference to the downtime object with the resolved
+                    objects
+        checkpoint  the Checkpoint object of a continued run or None
 
+    Return:
+        int         0 if everything went fine else 1
+    """
+    chunked = max([len(objs) for objs in downtime.get_objects().values()] or [0]) > args.chunk_size
+    if checkpoint is None and chunked and args.plan != '-':
+        spec = dict((key, getattr(args, key)) for key in run_spec_args)
+        spec.update(start_time=downtime.get_start_time(), end_time=downtime.get_end_time(),
+                    duration=downtime.get_duration(), path=os.path.abspath(args.path))
+        if args.plan is not None:
+            spec['plan'] = os.path.abspath(args.plan)
+        checkpoint = Checkpoint()
+        checkpoint.create(spec)
+    run_id = checkpoint.get_run_id() if checkpoint is not None else None
+    progress = None
+    if not args.quiet and downtime.get_object_count() > args.chunk_size:
+        progress = Progress(run_id)
+    try:
+        downtime.run_chunks(args.operation, checkpoint, args.chunk_size, progress)
+    except ValueError, e:
+        logger.critical(e)
+        return 1
+    except IOError, e:
+        if run_id is None:
+            logger.critical(e)
+        else:
+            logger.critical('%s, continue run %s with --resume %s', e, run_id, run_id)
+        return 1
+    except (Exception, KeyboardInterrupt):
+        if run_id is None:
+            logger.critical('Run interrupted, it can not be continued')
+        else:
+            logger.critical('Run %s interrupted, continue it with --resume %s', run_id, run_id)
+        raise
     return 0
 
 
@@ -1531,5 +6564,4 @@ def main(argv):
 #   Main
 # ------------------------------------------------------------------------------
 if __name__ == '__main__':
-    logger = setup_logging('main')
     sys.exit(main(sys.argv[1:]))
@@ -28,22 +28,140 @@
 # -----------------------------------------------------------------------------
 #   External Modules
 # -----------------------------------------------------------------------------
+import collections
+import hashlib
+import imp
 import json
 import os
 import subprocess
+import threading
 import time
+import Queue
 
 # -----------------------------------------------------------------------------
 #   Globale Variables
 # -----------------------------------------------------------------------------
+downtime_new_script = os.path.expanduser("~/local/bin/downtime_new")
+
+# The downtime script is loaded as module and its Api objects are kept for
+# downtime_new_api_ttl seconds, so the sites are discovered once and the
+# livestatus connections are shared by all definitions and categories. An Api
+# object is used by one job at a time, idle objects are kept per user.
+downtime_new_api_ttl = 3600
+downtime_new_apis = {}
+downtime_new_apis_lock = threading.Lock()
+
+# The module is loaded once per process, a new load would run the module
+# code again and create new module objects.
+downtime_new_module = None
+downtime_new_module_lock = threading.Lock()
+
+# The output of a started downtime script is captured in a ring buffer of at
+# most downtime_new_output_lines lines, longer lines get split.
+downtime_new_output_lines = 200
+downtime_new_line_length = 4096
+
+# Successfully applied definitions are remembered in the item state, they are
+# skipped as long as they don't change and their downtimes have not ended, so
+# a definition is applied again after its duration. With reapply_interval (or
+# "reapply" in a definition) set to a shorter number of seconds, it is applied
+# again after that time.
+#
+# The runtime of a check run is compared with runtime_levels (warn, crit) in
+# seconds, None disables the levels.
+#
+# With metrics_path set, the phases, requests, commands, objects and
+# unreachable sites of all jobs of a check run are written as Prometheus
+# metrics to the file, e.g. for the textfile collector of the node exporter.
+factory_settings["downtime_new_default_levels"] = {
+    "max_parallel": 4,
+    "job_timeout": 60,
+    "reapply_interval": None,
+    "runtime_levels": None,
+    "metrics_path": None,
+}
+
+# Maps each category to the Job attribute, the key in the collected data and
+# the command line option of the downtime script
+downtime_new_categories = {
+    'host': [('host', 'hostname', '-n')],
+    'service': [('host', 'hostname', '-n'), ('service', 'servicename', '-s')],
+    'hostgroup': [('hostgroup', 'hostgroup', '-N')],
+    'servicegroup': [('servicegroup', 'servicegroup', '-S')],
+}
+
+
 def inventory_downtime_new(info):
     yield "New Downtime Collector", None
 
 
-def run_downtime(gid, user, password, author, operation, cat, comment, duration, data):
+def load_downtime_module():
+    """
+    This method loads the downtime script as module on the first call and
+    returns the same module on the following calls. A failed load is tried
+    again on the next call.
+
+    Return:
+        module          the downtime module or None if it can't be loaded
+    """
+    global downtime_new_module
+    with downtime_new_module_lock:
+        if downtime_new_module is None:
+            try:
+                downtime_new_module = imp.load_source("downtime_new", downtime_new_script)
+            except Exception:
+                return None
+        return downtime_new_module
+
+
+def get_downtime_api(user, password):
     """
-    This method calls the downtime script and passes all needed arguments. In
-    the event, that the given category isn't known, it return a string
+    This method takes an idle Api object of the downtime module for the given
+    credentials from the cache or creates a new one if there is none. Expired
+    objects get dropped. The object has to be returned with
+    release_downtime_api.
+
+    Attributes:
+        user            a user, should be an automation user
+        password        a secret
+
+    Return:
+        tuple           (module, Api object, creation time) or None if the
+                        module can't be loaded
+    """
+    key = (user, password)
+    with downtime_new_apis_lock:
+        idle = downtime_new_apis.setdefault(key, [])
+        while idle:
+            entry = idle.pop()
+            if entry[2] + downtime_new_api_ttl >= time.time():
+                return entry
+
+    module = load_downtime_module()
+    if module is None:
+        return None
+    return module, module.Api(module.Auth(user, password, False), persist=True), time.time()
+
+
+def release_downtime_api(user, password, entry):
+    """
+    This method returns an Api object to the cache of idle objects.
+
+    Attributes:
+        user            a user, should be an automation user
+        password        a secret
+        entry           the tuple returned by get_downtime_api
+    """
+    with downtime_new_apis_lock:
+        downtime_new_apis.setdefault((user, password), []).append(entry)
+
+
+def run_downtime(gid, user, password, author, operation, cat, comment, duration, data, timeout=None, report=None):
+    """
+    This method executes the downtime operation in-process with the Api of the
+    downtime script. If the script can't be loaded as module, it gets started
+    as before. In the event, that the given category isn't known, it return a
+    string
 
     Attributes:
         gid             a groupedid needed to identify the downtime
@@ -54,50 +172,356 @@ def run_downtime(gid, user, password, author, operation, cat, comment, duration,
         comment         a descriptive comment for the downtime
         duration        the duration of the downtime
         data            the host, service, host- or servicegroup name
+        timeout         the maximum runtime of a started downtime script
+        report          optional a dictionary, which gets updated with the
+                        Stats report of the job
 
     Return:
         int             a return code (1 = We found data, 2 = An error occured)
         string          a message
         string          all errors that happend
+        int             the number of affected objects
+        int             the number of sent commands
     """
-    output = ''
-    errors = ''
-    cmd = os.path.expanduser("~/local/bin/downtime_new")
+    if operation not in ['add', 'remove']:
+        return 2, "", "ERROR unknown operation " + operation + "\n", 0, 0
+    if cat not in downtime_new_categories:
+        return 2, "", "ERROR couldn't add a downtime, category " + cat + " is unknown" + '\n', 0, 0
 
-    if operation in ['add', 'remove']:
-        cmd_string = "{0} -g {1} -u {2} -p {3} -o {4} -a {5} ".format(cmd, str(gid), user, password, operation, author)
-        if operation == 'add':
-            cmd_string += "-d {0} -c {1} ".format(str(duration), comment)
-    else:
-        return 2, "ERROR unknown operation " + operation + "\n"
-
-    if cat == 'host':
-        cmd_string += '-n ' + ",".join(data['hostname'])
-    elif cat == 'service':
-        cmd_string += '-n ' + ",".join(data['hostname']), '-s ' + ",".join(data['servicename'])
-    elif cat == 'hostgroup':
-        cmd_string += '-N ' + ",".join(data['hostgroup'])
-    elif cat == 'servicegroup':
-        cmd_string += '-S ' + ",".join(data['servicegroup'])
-    else:
-        return 2, "", "ERROR couldn't add a downtime, category " + cat + " is unknown" + '\n'
-
-    proc = subprocess.Popen(cmd_string.split(" "), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    proc.wait()
-    if proc.returncode != 0:
-        errors += "ERROR "
-        for line in proc.stderr.readlines():
-            errors += line
-        return 2, output, errors
+    selection = {}
+    for attribute, key, option in downtime_new_categories[cat]:
+        selection[attribute] = data[key]
+
+    try:
+        entry = get_downtime_api(user, password)
+    except Exception, e:
+        return 2, "", "ERROR {0}\n".format(e), 0, 0
+    if entry is None:
+        return run_downtime_process(gid, user, password, author, operation, cat, comment, duration, data, timeout)
+
+    module, api, created = entry
+    stats = module.Stats()
+    try:
+        job = module.Job(operation, gid, comment=comment, duration=duration, author=author, **selection)
+        result = api.execute(job, stats=stats)
+    except Exception, e:
+        return 2, "", "ERROR {0}\n".format(e), 0, 0
+    finally:
+        release_downtime_api(user, password, entry)
+        if report is not None:
+            report.update(stats.get_report())
+    return 1, "".join(message + "\n" for message in result['messages']), "", result['objects'], result['commands']
+
+
+def get_definition_hash(data):
+    """
+    This method returns a hash over the parts of a definition that define the
+    downtimes, the credentials are not part of it.
+
+    Attributes:
+        data            a dictionary with the collected downtime definition
+
+    Return:
+        string          the hex digest of the definition
+    """
+    definition = {
+        'id': data['id'],
+        'operation': data['operation'],
+        'comment': data.get('comment', ""),
+        'duration': data.get('duration', 7200),
+    }
+    return hashlib.sha1(json.dumps(definition, sort_keys=True)).hexdigest()
+
+
+def is_definition_applied(applied, digest, interval, duration):
+    """
+    This method checks if a definition has already been applied successfully
+    and neither its downtimes have ended nor the re-apply interval has passed.
+
+    Attributes:
+        applied         the dictionary with the hash of each applied
+                        definition as key and (timestamp, return code) as value
+        digest          the hash of the definition
+        interval        the re-apply interval in seconds or None
+        duration        the duration of the downtimes of the definition
+
+    Return:
+        boolean         True if the definition can be skipped else False
+    """
+    if digest not in applied or applied[digest][1] > 1:
+        return False
+    expiry = int(duration) if interval is None else min(interval, int(duration))
+    return applied[digest][0] + expiry > time.time()
+
+
+def run_downtime_jobs(jobs, max_parallel, timeout):
+    """
+    This method executes the jobs on a pool of at most max_parallel worker
+    threads. A job that does not finish within timeout seconds is reported as
+    error and its worker gets replaced, so the remaining jobs are not blocked.
+    The thread of the timed out job can't be stopped, it may still complete
+    the job but takes no further jobs.
+
+    Attributes:
+        jobs            a list of argument tuples for run_downtime
+        max_parallel    the maximum number of concurrently executed jobs
+        timeout         the maximum time of a job in seconds
+
+    Return:
+        list            a (return code, message, errors, objects, commands)
+                        tuple for each job in the order of jobs
+        list            a (start time, end time) tuple for each job
+        list            a dictionary with the Stats report of each job, empty
+                        if the job has been executed by a started script
+    """
+    results = [None] * len(jobs)
+    reports = [{} for job in jobs]
+    started = [None] * len(jobs)
+    finished = [None] * len(jobs)
+    lock = threading.Lock()
+    pending = Queue.Queue()
+    for index in range(len(jobs)):
+        pending.put(index)
+
+    for worker in range(min(max(max_parallel, 1), len(jobs))):
+        start_downtime_worker(jobs, pending, results, started, finished, lock, timeout, reports)
+
+    while None in results:
+        time.sleep(0.05)
+        with lock:
+            for index in range(len(jobs)):
+                if results[index] is None and started[index] is not None and \
+                        started[index] + timeout < time.time():
+                    results[index] = (2, "", "ERROR downtime job {0} {1} for id {2} timed out after {3} seconds, "
+                                      "it may still complete in the background\n".format(
+                                          jobs[index][4], jobs[index][5], jobs[index][0], timeout), 0, 0)
+                    finished[index] = time.time()
+                    start_downtime_worker(jobs, pending, results, started, finished, lock, timeout, reports)
+    return results, zip(started, finished), reports
+
+
+def start_downtime_worker(jobs, pending, results, started, finished, lock, timeout, reports):
+    """
+    This method starts a worker thread for run_downtime_jobs.
+
+    Attributes:
+        see downtime_worker
+    """
+    thread = threading.Thread(target=downtime_worker, args=(jobs, pending, results, started, finished, lock,
+                                                            timeout, reports))
+    thread.daemon = True
+    thread.start()
+
+
+def downtime_worker(jobs, pending, results, started, finished, lock, timeout, reports):
+    """
+    This method is the target of a worker thread. It executes pending jobs
+    until there are none left and stores the result, unless the job has
+    already been reported as timed out. Then the thread has been abandoned
+    and replaced by a new worker, so it stops.
+
+    Attributes:
+        jobs            a list of argument tuples for run_downtime
+        pending         a queue with the indexes of the pending jobs
+        results         a list for the result of each job
+        started         a list for the start time of each job
+        finished        a list for the end time of each job
+        lock            a lock protecting results, started and finished
+        timeout         the maximum time of a job in seconds
+        reports         a list for the Stats report of each job
+    """
+    abandoned = False
+    while not abandoned:
+        try:
+            index = pending.get_nowait()
+        except Queue.Empty:
+            return
+        with lock:
+            started[index] = time.time()
+        try:
+            result = run_downtime(*jobs[index], timeout=timeout, report=reports[index])
+        except Exception, e:
+            result = (2, "", "ERROR {0}\n".format(e), 0, 0)
+        with lock:
+            abandoned = results[index] is not None
+            if not abandoned:
+                results[index] = result
+                finished[index] = time.time()
+
+
+def run_downtime_process(gid, user, password, author, operation, cat, comment, duration, data, timeout=None):
+    """
+    This method calls the downtime script and passes all needed arguments. It
+    is used if the downtime script can't be loaded as module. The output is
+    captured while the script runs, so a full pipe can't block it, and the
+    script gets killed after timeout seconds.
+
+    Attributes:
+        see run_downtime
+
+    Return:
+        int             a return code (1 = We found data, 2 = An error occured)
+        string          a message
+        string          all errors that happend
+        int             always 0, the script does not report the objects
+        int             always 0, the script does not report the commands
+    """
+    cmd = [downtime_new_script, '-g', str(gid), '-u', user, '-p', password, '-o', operation, '-a', author]
+    if operation == 'add':
+        cmd += ['-d', str(duration), '-c', comment]
+    for attribute, key, option in downtime_new_categories[cat]:
+        cmd += [option, ",".join(data[key])]
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    returncode, output, errors = capture_process_output(proc, timeout)
+    if returncode is None:
+        return 2, output, "ERROR downtime script killed after {0} seconds\n{1}".format(timeout, errors), 0, 0
+    elif returncode != 0:
+        return 2, output, "ERROR " + errors, 0, 0
     else:
-        for line in proc.stdout.readlines():
-            output += line
-        return 1, output, errors
+        return 1, output, errors, 0, 0
+
+
+def capture_process_output(proc, timeout=None):
+    """
+    This method reads stdout and stderr of a process concurrently until the
+    process exits or the timeout is reached, in which case the process gets
+    killed. Only the last downtime_new_output_lines lines of each pipe are
+    kept, dropped lines are summarized.
+
+    Attributes:
+        proc            a subprocess.Popen object with stdout and stderr pipes
+        timeout         the maximum runtime in seconds, None waits forever
+
+    Return:
+        int             the return code or None if the process got killed
+        string          the captured stdout
+        string          the captured stderr
+    """
+    buffers = []
+    threads = []
+    for pipe in [proc.stdout, proc.stderr]:
+        buf = {'lines': collections.deque(maxlen=downtime_new_output_lines), 'count': 0}
+        thread = threading.Thread(target=read_process_pipe, args=(pipe, buf))
+        thread.daemon = True
+        thread.start()
+        buffers.append(buf)
+        threads.append(thread)
+
+    killed = False
+    deadline = time.time() + timeout if timeout is not None else None
+    while proc.poll() is None:
+        if deadline is not None and time.time() > deadline:
+            proc.kill()
+            proc.wait()
+            killed = True
+            break
+        time.sleep(0.05)
+
+    for thread in threads:
+        thread.join(1)
+
+    captured = []
+    for buf in buffers:
+        lines = list(buf['lines'])
+        if buf['count'] > len(lines):
+            lines.insert(0, "[{0} lines truncated]\n".format(buf['count'] - len(lines)))
+        captured.append("".join(lines))
+    return None if killed else proc.returncode, captured[0], captured[1]
+
+
+def read_process_pipe(pipe, buf):
+    """
+    This method is the target of a reader thread. It reads the pipe line by
+    line into the ring buffer until the pipe gets closed.
+
+    Attributes:
+        pipe            a file object of a pipe
+        buf             a dictionary with the ring buffer 'lines' and the
+                        number of read lines 'count'
+    """
+    for line in iter(lambda: pipe.readline(downtime_new_line_length), ''):
+        buf['lines'].append(line)
+        buf['count'] += 1
+    pipe.close()
+
+
+def write_downtime_metrics(path, reports, begin, collect_errors):
+    """
+    This method merges the Stats reports of the jobs of a check run and writes
+    them as Prometheus metrics.
+
+    Attributes:
+        path            the file name of the metrics
+        reports         the reports returned by run_downtime_jobs
+        begin           the start time of the check run
+        collect_errors  the number of errors in the collected data
+
+    Return:
+        string          an error message or an empty string
+    """
+    module = load_downtime_module()
+    if module is None:
+        return "ERROR metrics not written, the downtime script can't be loaded\n"
+    stats = module.Stats(begin)
+    for report in reports:
+        if report:
+            stats.merge(report)
+    try:
+        stats.write_metrics(path, {'source': 'check'},
+                            {'jobs': ('Executed downtime jobs', len(reports)),
+                             'collect_errors': ('Errors in the collected downtime data', collect_errors)})
+    except (IOError, OSError), e:
+        return "ERROR metrics not written, {0}\n".format(e)
+    return ""
+
+
+def get_downtime_perfdata(definitions, jobs, results, timings, collect_errors, runtime, runtime_levels):
+    """
+    This method creates the performance data of a check run. The wall-clock
+    time of each operation and category is the time between the start of its
+    first and the end of its last job.
+
+    Attributes:
+        definitions     a list with the definition hash of each job
+        jobs            a list of argument tuples for run_downtime
+        results         the results returned by run_downtime_jobs
+        timings         the timings returned by run_downtime_jobs
+        collect_errors  the number of errors in the collected data
+        runtime         the runtime of the check run in seconds
+        runtime_levels  a tuple (warn, crit) in seconds or None
+
+    Return:
+        list            a list of performance data tuples
+    """
+    warn, crit = runtime_levels or (None, None)
+    perfdata = [
+        ("definitions", len(set(definitions))),
+        ("objects", sum(result[3] for result in results)),
+        ("commands", sum(result[4] for result in results)),
+        ("errors", collect_errors + len([result for result in results if result[0] > 1])),
+        ("runtime", runtime, warn, crit),
+    ]
+    for op in ['add', 'remove']:
+        for cat in sorted(downtime_new_categories.keys()):
+            spans = [timing for job, timing in zip(jobs, timings) if job[4] == op and job[5] == cat]
+            elapsed = max(end for start, end in spans) - min(start for start, end in spans) if spans else 0
+            perfdata.append(("{0}_{1}_time".format(op, cat), elapsed))
+    return perfdata
+
 
 # the check function (dummy)
 def check_downtime_new(item, params, info):
     status = 0
     errors = ''
+    collect_errors = 0
+    begin = time.time()
+    params = params or {}
+    max_parallel = params.get("max_parallel", factory_settings["downtime_new_default_levels"]["max_parallel"])
+    timeout = params.get("job_timeout", factory_settings["downtime_new_default_levels"]["job_timeout"])
+    reapply_interval = params.get("reapply_interval", factory_settings["downtime_new_default_levels"]["reapply_interval"])
+    runtime_levels = params.get("runtime_levels", factory_settings["downtime_new_default_levels"]["runtime_levels"])
+    metrics_path = params.get("metrics_path", factory_settings["downtime_new_default_levels"]["metrics_path"])
 
     if not info:
         return status, "New Downtime Collector has nothing to do..."
@@ -105,6 +529,13 @@ def check_downtime_new(item, params, info):
     # Initial string
     output = 'New Downtime Collector will process the following definitions:\n'
 
+    # Collect the jobs of all changed definitions first, they get executed
+    # concurrently
+    applied = get_item_state("downtime_new.applied", {})
+    current = {}
+    definitions = []
+    skipped = 0
+    jobs = []
     for line in info:
         if line[0] == 'data:':
             data = json.loads(" ".join(line[1:]))
@@ -112,30 +543,59 @@ def check_downtime_new(item, params, info):
             for mandatory in ['user', 'password', 'author', 'id', 'operation']:
                 if mandatory not in data.keys():
                     error = True
+                    collect_errors += 1
                     errors += "ERROR in collected downtime data, {0} is mandatory\n".format(mandatory)
             if not error:
+                digest = get_definition_hash(data)
                 comment = data['comment'] if 'comment' in data.keys() else ""
                 duration = data['duration'] if 'duration' in data.keys() else 7200
+                if is_definition_applied(applied, digest, data.get('reapply', reapply_interval), duration):
+                    current[digest] = applied[digest]
+                    skipped += 1
+                    continue
+
                 operation = data['operation']
 
                 for op in operation.keys():
                     for cat in operation[op].keys():
-                        rc, msg, err = run_downtime(data['id'], data['user'], data['password'], data['author'], op, cat, comment, duration, operation[op][cat])
-                        output += msg
-                        errors += err
-
-                        if rc > status:
-                            status = rc
+                        definitions.append(digest)
+                        jobs.append((data['id'], data['user'], data['password'], data['author'], op, cat, comment,
+                                     duration, operation[op][cat]))
         else:
             status = 2
+            collect_errors += 1
             errors += " ".join(line) + '\n'
 
-    return status, errors + output
+    results, timings, reports = run_downtime_jobs(jobs, max_parallel, timeout)
+    now = time.time()
+    for digest, (rc, msg, err, objects, commands) in zip(definitions, results):
+        current[digest] = (now, max(rc, current[digest][1] if digest in current else 0))
+        if rc > status:
+            status = rc
+    set_item_state("downtime_new.applied", current)
+
+    if skipped:
+        output += "{0} unchanged definitions have already been applied\n".format(skipped)
+
+    runtime = time.time() - begin
+    if runtime_levels and runtime >= runtime_levels[1]:
+        status = 2
+        errors += "ERROR runtime of {0:.1f} seconds exceeds {1} seconds\n".format(runtime, runtime_levels[1])
+    elif runtime_levels and runtime >= runtime_levels[0]:
+        status = max(status, 1)
+        errors += "WARNING runtime of {0:.1f} seconds exceeds {1} seconds\n".format(runtime, runtime_levels[0])
+    perfdata = get_downtime_perfdata(definitions, jobs, results, timings, collect_errors, runtime, runtime_levels)
+    if metrics_path:
+        errors += write_downtime_metrics(metrics_path, reports, begin, collect_errors)
+
+    return status, errors + "".join(result[2] for result in results) + output + \
+        "".join(result[1] for result in results), perfdata
 
 
 check_info["downtime_new"] = {
     "check_function"        : check_downtime_new,
     "inventory_function"    : inventory_downtime_new,
     "service_description"   : "",
-    "has_perfdata"          : False,
+    "has_perfdata"          : True,
+    "default_levels_variable": "downtime_new_default_levels",
 }